@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from functools import partial
+from hashlib import blake2b
+from importlib import metadata
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterator, List, Optional
+from unittest import mock
+
+import numpy as np
+import typer
+from obs_test_files import Freq, mep_ds
+from pyaerocom_preproc.checksum import file_digest
+
+try:
+    from blake3 import blake3  # type: ignore
+except ModuleNotFoundError:  # pragma: no cover
+    blake3 = None
+
+app = typer.Typer(add_completion=False)
+
+
+@app.callback()
+def callback():
+    """Benchmarks for pyaerocom-preproc"""
+
+
+def hashing_engines() -> Iterator[tuple[str, Callable[[Path], Any]]]:
+    def loop_4k(path: Path, hasher=blake2b) -> str:
+        _checksum = hasher()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(4096), b""):
+                _checksum.update(block)
+        return _checksum.hexdigest()
+
+    yield "blake2b 4KiB loop", loop_4k
+    for size in (1, 4, 8):
+        yield f"blake2b {size}MiB readinto", lambda path, size=size: file_digest(
+            path, hasher=blake2b, buffer_size=size * 2**20
+        )
+    yield "blake2b mmap", lambda path: file_digest(path, hasher=blake2b, use_mmap=True)
+
+    if blake3 is None:
+        return
+
+    yield "blake3 4KiB loop", lambda path: loop_4k(path, blake3)
+    yield "blake3 1MiB readinto", lambda path: file_digest(path, hasher=blake3)
+    yield "blake3 mmap", lambda path: file_digest(path, hasher=blake3, use_mmap=True)
+    yield "blake3 mmap AUTO threads", lambda path: file_digest(
+        path, hasher=blake3, use_mmap=True, max_threads=blake3.AUTO
+    )
+
+
+@app.command()
+def hashing(
+    files: Optional[List[Path]] = typer.Argument(None, help="files to hash"),
+    size: int = typer.Option(256, help="size [MiB] of the random file, when no files are given"),
+    repeat: int = typer.Option(3, help="best of N runs"),
+):
+    """Report hashing throughput [MB/s] for the blake2b and blake3 backends"""
+    with TemporaryDirectory() as tmp:
+        if not files:
+            path = Path(tmp) / "random.bin"
+            with path.open("wb") as f:
+                for _ in range(size):
+                    f.write(os.urandom(2**20))
+            files = [path]
+
+        total = sum(path.stat().st_size for path in files)
+        for name, engine in hashing_engines():
+            elapsed = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for path in files:
+                    engine(path)
+                elapsed.append(time.perf_counter() - start)
+            print(f"{name:<28} {total / min(elapsed) / 1e6:10.1f} MB/s")
+
+
+@app.command()
+def readers(
+    files: Optional[List[Path]] = typer.Argument(
+        None, help="files to check  [default: tests/check_obs/*.nc]"
+    ),
+    repeat: int = typer.Option(5, help="best of N runs"),
+):
+    """Report the time [ms/file] to open files and run the values checks, for each reader engine"""
+    from loguru import logger
+    from pyaerocom_preproc.check_obs import REGISTERED_CHECKERS
+    from pyaerocom_preproc.reader import ENGINES, open_dataset
+
+    logger.remove()  # messages are not part of the benchmark
+    if not files:
+        files = sorted(Path("tests/check_obs").glob("*.nc"))
+    checkers = [checker.values for checker in REGISTERED_CHECKERS if checker.values is not None]
+
+    for engine in ENGINES:
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for path in files:
+                with open_dataset(path, engine=engine) as ds:
+                    for values in checkers:
+                        list(values(ds))
+            elapsed.append(time.perf_counter() - start)
+        print(f"{engine:<28} {min(elapsed) / len(files) * 1e3:10.2f} ms/file")
+
+
+def _break_units(ds):
+    del ds["CO_density"].attrs["units"]
+    return ds
+
+
+# ways to break a synthetic file, each one is found by a different checker
+BREAKERS: dict[str, Callable] = dict(
+    negative=lambda ds: ds.assign(NO2_density=-ds["NO2_density"]),
+    missing_units=_break_units,
+    bad_times=lambda ds: ds.assign(datetime_start=ds["datetime_start"].roll(time=7)),
+    incomplete=lambda ds: ds.isel(time=slice(None, None, 2)),
+)
+
+
+def synthetic_obs(
+    root: Path,
+    *,
+    data_set: str = "bench",
+    stations: int = 10,
+    years: tuple[int, ...] = (2020,),
+    freq: Freq = Freq.HOURLY,
+    broken: float = 0.1,
+    seed: int = 0,
+) -> list[Path]:
+    """write `stations` x `years` observation files with random positive data,
+    a `broken` fraction of the files fails one of the checks, see `BREAKERS`"""
+    from pyaerocom_preproc.check_obs import VARIABLE_UNITS
+
+    rng = np.random.default_rng(seed)
+    n_files = stations * len(years)
+    broken_files = set(rng.choice(n_files, round(broken * n_files), replace=False).tolist())
+
+    files = []
+    for n, (station, year) in enumerate(product(range(stations), years)):
+        ds = mep_ds(year, freq)
+        for var in VARIABLE_UNITS:
+            ds[var][:] = rng.uniform(0, 100, ds.sizes["time"])
+        if n in broken_files:
+            ds = list(BREAKERS.values())[n % len(BREAKERS)](ds)
+        path = root / f"{data_set}-{station:04d}-{freq}-{year}.nc"
+        ds.to_netcdf(path)
+        files.append(path)
+    return files
+
+
+@app.command()
+def generate(
+    root: Path = typer.Argument(..., help="write the files to this directory"),
+    data_set: str = typer.Option("bench", help="filename prefix"),
+    stations: int = typer.Option(10, min=1),
+    years: List[int] = typer.Option([2020], "--year", help="repeat for several years"),
+    freq: Freq = typer.Option(Freq.HOURLY),
+    broken: float = typer.Option(0.1, min=0, max=1, help="fraction of files which fail a check"),
+    seed: int = typer.Option(0, help="random seed, the same seed writes the same files"),
+):
+    """Write synthetic observations, for N stations x Y years"""
+    root.mkdir(parents=True, exist_ok=True)
+    files = synthetic_obs(
+        root,
+        data_set=data_set,
+        stations=stations,
+        years=tuple(years),
+        freq=freq,
+        broken=broken,
+        seed=seed,
+    )
+    size = sum(path.stat().st_size for path in files)
+    typer.echo(f"wrote {len(files)} files ({size / 1e6:.1f} MB) to {root}")
+
+
+def best_of(repeat: int, func: Callable[[], Any], setup: Callable[[], Any] | None = None) -> float:
+    """best elapsed time [s] of `repeat` runs, `setup` runs untimed before each run"""
+    elapsed = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+@contextmanager
+def isolated_caches(root: Path) -> Iterator[Path]:
+    """point the checksum cache and the errors DB under root, yields the errors DB path"""
+    import pyaerocom_preproc.check_obs as check_obs
+    import pyaerocom_preproc.error_db as error_db
+
+    database = root / "errors.sqlite"
+    patches = {
+        name: partial(getattr(error_db, name), database=database)
+        for name in (
+            "read_errors_many",
+            "read_results_many",
+            "write_results",
+            "write_seen",
+            "maintain",
+            "delete_db",
+        )
+    }
+    with mock.patch("pyaerocom_preproc.checksum.CACHE_PATH", root / "checksums.sqlite"):
+        with mock.patch.multiple(check_obs, **patches):
+            yield database
+
+
+@contextmanager
+def local_bucket(root: Path) -> Iterator[None]:
+    """in-memory S3 stand-in, with moto"""
+    import tomli_w
+    from moto import mock_aws
+    from pyaerocom_preproc.config import _settings
+    from pyaerocom_preproc.s3_bucket import s3_client
+
+    secrets = root / "secrets.toml"
+    s3_bucket = dict(bucket_name="bench", access_key_id="bench", secret_access_key="bench")
+    secrets.write_text(tomli_w.dumps(dict(s3_bucket=s3_bucket)))
+    env = dict(AWS_DEFAULT_REGION="us-east-1")
+    env["PYA_PP_S3_BUCKET__ENDPOINT_URL"] = "https://s3.amazonaws.com"
+    with mock.patch.dict(os.environ, env), mock_aws():
+        settings = _settings(secrets=secrets)
+        with mock.patch("pyaerocom_preproc.s3_bucket.config", lambda: settings):
+            s3_client.cache_clear()
+            s3_client(settings).create_bucket(Bucket="bench")
+            yield
+        s3_client.cache_clear()
+
+
+def suite_scenarios(
+    files: list[Path], *, data_set: str, repeat: int, jobs: int, root: Path
+) -> Iterator[dict[str, Any]]:
+    """timed scenarios, as {scenario, seconds, files, MB}"""
+    from pyaerocom_preproc import checksum as _checksum
+    from pyaerocom_preproc import error_db
+    from pyaerocom_preproc.check_obs import REGISTERED_CHECKERS, _check_all, _versions
+    from pyaerocom_preproc.reader import ENGINES, open_dataset, read_header
+
+    size = sum(path.stat().st_size for path in files) / 1e6
+
+    def result(scenario: str, seconds: float, **kwargs) -> dict[str, Any]:
+        return dict(scenario=scenario, seconds=seconds, files=len(files), MB=size, **kwargs)
+
+    with isolated_caches(root) as database:
+
+        def cold() -> None:
+            error_db.delete_db(database)
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{_checksum.CACHE_PATH}{suffix}").unlink(missing_ok=True)
+            _checksum._cache_db.cache_clear()
+            _checksum.checksum.cache_clear()
+
+        # hashing
+        seconds = best_of(repeat, lambda: [_checksum._hash(path) for path in files])
+        yield result(f"hashing:{_checksum.HASHLIB}", seconds)
+        cold()
+        [_checksum.checksum(path) for path in files]
+        seconds = best_of(
+            repeat,
+            lambda: [_checksum.checksum(path) for path in files],
+            setup=_checksum.checksum.cache_clear,
+        )
+        yield result("checksum:cached", seconds)
+
+        # each checker, metadata phase on the header and values phase with each engine
+        for checker in REGISTERED_CHECKERS:
+            if checker.metadata is not None:
+                seconds = best_of(
+                    repeat, lambda: [list(checker.metadata(read_header(p))) for p in files]
+                )
+                yield result(f"checker:{checker.name}:metadata", seconds)
+            if checker.values is None:
+                continue
+            for engine in ENGINES:
+
+                def values() -> None:
+                    for path in files:
+                        with open_dataset(path, engine=engine) as ds:
+                            list(checker.values(ds))
+
+                seconds = best_of(repeat, values)
+                yield result(f"checker:{checker.name}:values:{engine}", seconds)
+
+        # full report, from empty caches and answered from the caches
+        for engine in ENGINES:
+            check_all = partial(_check_all, data_set, files, jobs=jobs, engine=engine)
+            yield result(f"report:cold:{engine}", best_of(repeat, check_all, setup=cold))
+        yield result("report:warm", best_of(repeat, check_all))
+
+        # DB lookups, after the report filled the DB
+        versions = _versions()
+        for name in ("read_results", "read_errors"):
+            lookup = partial(getattr(error_db, name), versions=versions, database=database)
+            seconds = best_of(repeat, lambda: [lookup(path) for path in files])
+            yield result(f"db:{name}", seconds)
+        for name in ("read_results_many", "read_errors_many"):
+            lookup = partial(getattr(error_db, name), versions=versions, database=database)
+            yield result(f"db:{name}", best_of(repeat, lambda: lookup(files)))
+
+    # uploads to the S3 stand-in, first upload and re-upload of unchanged files
+    try:
+        import moto  # noqa: F401
+    except ModuleNotFoundError:  # pragma: no cover
+        typer.echo("moto not installed, skip upload scenarios", err=True)
+        return
+
+    from pyaerocom_preproc.s3_bucket import s3_upload_many
+
+    uploads = {path: f"{data_set}/download/{path.name}" for path in files}
+    with local_bucket(root):
+        start = time.perf_counter()
+        s3_upload_many(uploads)
+        yield result("upload:new", time.perf_counter() - start)
+        yield result("upload:unchanged", best_of(repeat, lambda: s3_upload_many(uploads)))
+
+
+@app.command()
+def suite(
+    root: Optional[Path] = typer.Option(
+        None, help="use existing files from `generate`  [default: generate into a temp dir]"
+    ),
+    data_set: str = typer.Option("bench", help="filename prefix"),
+    stations: int = typer.Option(10, min=1),
+    years: List[int] = typer.Option([2020], "--year", help="repeat for several years"),
+    freq: Freq = typer.Option(Freq.HOURLY),
+    broken: float = typer.Option(0.1, min=0, max=1, help="fraction of files which fail a check"),
+    repeat: int = typer.Option(3, help="best of N runs"),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="check files on N processes"),
+    output: Optional[Path] = typer.Option(None, "--output", "-o", help="write JSON results"),
+):
+    """Run timed scenarios on synthetic observations, and report the results as JSON
+
+    Scenarios: hashing, checksum cache, each checker phase/engine, cold and warm reports,
+    DB lookups and uploads to an in-memory S3 stand-in (needs moto).
+    """
+    from loguru import logger
+
+    logger.remove()  # messages are not part of the benchmark
+
+    with TemporaryDirectory() as tmp:
+        if root is None:
+            root = Path(tmp)
+            files = synthetic_obs(
+                root,
+                data_set=data_set,
+                stations=stations,
+                years=tuple(years),
+                freq=freq,
+                broken=broken,
+            )
+        else:
+            files = sorted(root.glob(f"{data_set}-*.nc"))
+
+        results = []
+        for result in suite_scenarios(
+            files, data_set=data_set, repeat=repeat, jobs=jobs, root=Path(tmp)
+        ):
+            typer.echo(
+                f"{result['scenario']:<40} {result['seconds'] * 1e3:10.1f} ms "
+                f"{result['seconds'] / result['files'] * 1e3:8.2f} ms/file",
+                err=True,
+            )
+            results.append(result)
+
+    report = dict(
+        version=metadata.version("pyaerocom_preproc"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(
+            data_set=data_set,
+            stations=stations,
+            years=years,
+            freq=str(freq),
+            broken=broken,
+            repeat=repeat,
+            jobs=jobs,
+        ),
+        results=results,
+    )
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        output.write_text(json.dumps(report, indent=2))
+
+
+@app.command()
+def compare(
+    baseline: Path = typer.Argument(..., help="JSON results from `suite`"),
+    current: Path = typer.Argument(..., help="JSON results from `suite`"),
+    threshold: float = typer.Option(1.1, help="flag scenarios slower by this factor"),
+):
+    """Compare two `suite` results, scenario by scenario"""
+    before = {r["scenario"]: r["seconds"] for r in json.loads(baseline.read_text())["results"]}
+    after = {r["scenario"]: r["seconds"] for r in json.loads(current.read_text())["results"]}
+    regressions = 0
+    for scenario in (scenario for scenario in before if scenario in after):
+        ratio = after[scenario] / before[scenario]
+        flag = "slower" if ratio > threshold else ""
+        regressions += bool(flag)
+        typer.echo(f"{scenario:<40} {ratio:6.2f}x {flag}")
+    if regressions:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
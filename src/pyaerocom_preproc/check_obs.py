@@ -1,17 +1,42 @@
 from __future__ import annotations
 
+import json
 import re
+import time
+from calendar import isleap
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from itertools import chain
 from pathlib import Path
-from typing import Callable, Literal
+from typing import Callable, Iterable, Iterator, Literal, NamedTuple
 
 import numpy as np
 import xarray as xr
 from loguru import logger
 
-from .error_db import DB_PATH, read_errors
-from .s3_bucket import s3_upload
+from . import timing
+from .checksum import checksum
+from .error_db import (
+    DAY,
+    DB_PATH,
+    CheckResult,
+    delete_db,
+    invalidate,
+    maintain,
+    optimize,
+    prune,
+    read_errors_many,
+    read_results_many,
+    read_timings,
+    write_results,
+    write_seen,
+    write_timings,
+)
+from .reader import Engine, Header, LazyDataset, LazyVariable, open_dataset, read_header
+from .timing import timed
 
-__all__ = ["obs_report"]
+__all__ = ["obs_report", "prune_cache", "invalidate_cache"]
 
 VARIABLE_UNITS = dict(
     air_quality_index={"1"},
@@ -24,144 +49,680 @@ VARIABLE_UNITS = dict(
 )
 
 
-REGISTERED_CHECKERS: list[Callable[[xr.Dataset], None]] = []
+# checkers run cheap first, and expensive checkers run last
+Cost = Literal["low", "medium", "high"]
+COSTS: tuple[Cost, ...] = ("low", "medium", "high")
 
 
-def register(func):
-    REGISTERED_CHECKERS.append(func)
-    return func
+class Issue(NamedTuple):
+    """error yielded by a checker, see `CheckResult`"""
 
+    code: str
+    message: str
 
-def _check(path: Path) -> bool:
-    """Check requirements for observations datasets"""
-    ds = xr.open_dataset(path)
 
-    with logger.contextualize(path=path):
-        for checker in REGISTERED_CHECKERS:
-            checker(ds)
+class Checker(NamedTuple):
+    func: Callable[[xr.Dataset], Iterable[Issue] | None]
+    version: int = 1
+    # checks split into a metadata phase, which only needs the netCDF header,
+    # and a values phase, which needs to load the data
+    metadata: Callable[[Header], Iterator[Issue]] | None = None
+    values: Callable[[xr.Dataset | LazyDataset], Iterator[Issue]] | None = None
+    cost: Cost = "medium"
+    # names of checkers which need to pass before this one runs
+    requires: tuple[str, ...] = ()
 
-        if errors := read_errors(path):
-            logger.debug(f"{len(errors)} errors")
+    @property
+    def name(self) -> str:
+        return self.func.__name__
+
+
+REGISTERED_CHECKERS: list[Checker] = []
+
+
+def register(
+    func=None,
+    *,
+    version: int = 1,
+    metadata=None,
+    values=None,
+    cost: Cost = "medium",
+    requires: tuple[str, ...] = (),
+):
+    """register a checker, bump the `version` when a checker changes
+
+    Results from previous checks are cached by checker name and version,
+    so only new or changed checkers are re-run on files which were checked before.
+
+    Checkers yield an `Issue` for every error found, which are collected per file
+    as `CheckResult` records, and then logged and written to the DB.
+    The checker can also be split into `metadata` and `values` phases.
+    The `metadata` phase of all checkers runs on the netCDF header,
+    and the `values` phase only runs if there were no metadata errors.
+
+    Checkers run in order of `cost`, see `check_plan`, and are skipped
+    when any of the checkers they `requires` (registered before) did not pass.
+    """
+    if cost not in COSTS:
+        raise ValueError(f"unknown {cost=}, expected one of {COSTS}")
+    if unknown := set(requires).difference(checker.name for checker in REGISTERED_CHECKERS):
+        raise ValueError(f"unknown prerequisites {sorted(unknown)}, register them first")
+
+    def decorator(func):
+        REGISTERED_CHECKERS.append(Checker(func, version, metadata, values, cost, requires))
+        return func
+
+    if func is None:
+        return decorator
+    return decorator(func)
 
-    return not errors
 
+def _versions() -> dict[str, int]:
+    return {checker.name: checker.version for checker in REGISTERED_CHECKERS}
 
-def _report(path: Path) -> bool:
-    """Report known errors from previous checks"""
-    if not (errors := read_errors(path)):
+
+def check_plan(checkers: list[Checker]) -> list[Checker]:
+    """execution order: cheap checkers first, in order of registration within the same cost,
+    and prerequisites before the checkers which require them
+
+    Prerequisites which are not among `checkers` already passed on previous checks.
+    """
+    names = {checker.name for checker in checkers}
+    pending = sorted(checkers, key=lambda checker: COSTS.index(checker.cost))
+    plan: list[Checker] = []
+    planned: set[str] = set()
+    while pending:
+        for checker in pending:
+            if all(name in planned or name not in names for name in checker.requires):
+                break
+        else:
+            raise ValueError(f"circular prerequisites {[checker.name for checker in pending]}")
+        pending.remove(checker)
+        plan.append(checker)
+        planned.add(checker.name)
+    return plan
+
+
+def _collect(
+    path: Path,
+    checkers: list[Checker],
+    *,
+    engine: Engine = "xarray",
+    fail_fast: bool = False,
+    timed_as: Path | None = None,
+    failed_before: list[Checker] | None = None,
+) -> tuple[list[Checker], list[CheckResult]]:
+    """Run `checkers` on path and return the checkers which ran to completion
+    and the errors found
+
+    The metadata phase reads only the netCDF header, and the dataset is only loaded
+    if there are no metadata errors. Otherwise, checkers with a values phase did not complete.
+    The values phase reads the dataset with `engine`, see `reader.open_dataset`.
+    Checkers run following `check_plan`, and are skipped if their prerequisites did not pass.
+    If `fail_fast` is True: stop at the first checker with errors.
+    Stages are timed under `timed_as`, path by default, e.g. for a temporary copy of a file.
+    Metadata errors of the `failed_before` checkers, with known errors on path from a previous
+    run, also keep the dataset from being loaded, so the errors found do not depend on which
+    checkers ran before.
+
+    Nothing is logged or written to the DB, see `_report` and `_write_results`.
+    """
+    errors: list[CheckResult] = []
+    if timed_as is None:
+        timed_as = path
+
+    def collect(checker: Checker, issues: Iterable[Issue] | None) -> None:
+        errors.extend(CheckResult(checker.name, *issue) for issue in issues or ())
+
+    plan = check_plan(checkers)
+    completed: list[Checker] = []
+    header: Header | None = None
+    for checker in plan:
+        if checker.metadata is None:
+            continue
+        if fail_fast and errors:
+            break
+        if header is None:
+            with timed("read_header", timed_as):
+                header = read_header(path)
+        with timed(f"metadata:{checker.name}", timed_as):
+            collect(checker, checker.metadata(header))
+        if checker.values is None:
+            completed.append(checker)
+    if errors:
+        return completed, list(dict.fromkeys(errors))
+    for checker in failed_before or ():
+        if checker.metadata is None:
+            continue
+        if header is None:
+            with timed("read_header", timed_as):
+                header = read_header(path)
+        if any(True for _ in checker.metadata(header) or ()):
+            return completed, []
+
+    values = [c for c in plan if c.values is not None or c.metadata is None]
+    if not values:
+        return completed, []
+
+    failed: set[str] = set()
+    with ExitStack() as stack:
+        with timed(f"open_dataset:{engine}", timed_as):
+            ds = open_dataset(path, engine=engine)
+        stack.callback(ds.close)
+        fallback: xr.Dataset | None = None
+        for checker in values:
+            if fail_fast and errors:
+                break
+            if skip := [name for name in checker.requires if name in failed]:
+                logger.bind(path=path).debug(
+                    f"skip {checker.name}, {', '.join(skip)} did not pass"
+                )
+                failed.add(checker.name)
+                continue
+
+            before = len(errors)
+            with timed(f"values:{checker.name}", timed_as):
+                if checker.values is not None:
+                    collect(checker, checker.values(ds))
+                elif isinstance(ds, LazyDataset):  # single phase checkers expect a xr.Dataset
+                    if fallback is None:
+                        fallback = stack.enter_context(xr.open_dataset(path))
+                    collect(checker, checker.func(fallback))
+                else:
+                    collect(checker, checker.func(ds))
+            completed.append(checker)
+            if len(errors) > before:
+                failed.add(checker.name)
+
+    return completed, list(dict.fromkeys(errors))
+
+
+def _write_results(
+    path: Path,
+    checkers: list[Checker],
+    completed: list[Checker],
+    errors: list[CheckResult],
+    *,
+    fail_fast: bool = False,
+) -> None:
+    """record results for the `checkers` which completed, and for any checker with errors
+
+    Without `fail_fast`, checkers which did not complete were skipped after metadata errors
+    or failed prerequisites, and are recorded as not passed. After a fail-fast run,
+    checkers which did not run are not recorded, so they run on the next full report.
+    """
+    versions = _versions()
+    failed = {error.checker for error in errors}
+    results = {checker.name: checker.name not in failed for checker in completed}
+    if not fail_fast:
+        results.update((c.name, False) for c in checkers if c.name not in results)
+    results.update((name, False) for name in failed if name in versions)
+    with timed("error_db", path):
+        write_results(path, results, errors=errors, versions=versions)
+
+
+def _check(
+    path: Path,
+    checkers: list[Checker] | None = None,
+    *,
+    engine: Engine = "xarray",
+    fail_fast: bool = False,
+) -> bool:
+    """Check requirements for observations datasets
+
+    Only run `checkers`, all registered checkers by default.
+    The file is not opened if there is nothing to check.
+    """
+    if checkers is None:
+        checkers = REGISTERED_CHECKERS
+    if not checkers:
         return True
 
+    completed, errors = _collect(path, checkers, engine=engine, fail_fast=fail_fast)
+    _write_results(path, checkers, completed, errors, fail_fast=fail_fast)
+    _report(path, errors)
+    return not errors
+
+
+def _init_worker(profile: bool = False) -> None:
+    """Silence the logger on worker processes, errors are collected and sent to the parent"""
+    logger.configure(handlers=[])
+    timing.enable(profile)
+
+
+def _collect_timed(
+    path: Path, checkers: list[Checker], **kwargs
+) -> tuple[list[Checker], list[CheckResult], list[timing.Timing]]:
+    """`_collect` on a worker process, also returns the timings recorded on the worker"""
+    return (*_collect(path, checkers, **kwargs), timing.records(clear=True))
+
+
+def _checksum(path: Path) -> None:
+    """hash path before the DB lookups, which then use the cached checksum,
+    so the time spent hashing is not attributed to the DB stages"""
+    with timed("checksum", path):
+        checksum(path)
+
+
+def _cached(files: list[Path]) -> dict[Path, tuple[list[CheckResult], list[Checker]]]:
+    """known errors and registered checkers without cached results for each file,
+    looked up for all files at once"""
+    for path in files:
+        _checksum(path)
+    versions = _versions()
+    with timed("error_db"):
+        errors = read_errors_many(files, versions=versions)
+        results = read_results_many(files, versions=versions)
+    return {
+        path: (
+            errors.get(path, []),
+            [c for c in REGISTERED_CHECKERS if c.name not in results.get(path, {})],
+        )
+        for path in files
+    }
+
+
+def _passed(files: list[Path]) -> dict[Path, bool]:
+    """files without known errors, which were checked by all registered checkers"""
+    return {path: not errors and not pending for path, (errors, pending) in _cached(files).items()}
+
+
+def _report(path: Path, errors: list[CheckResult]) -> None:
+    """Log errors found on path, as logged by the checker which found them"""
+    if not errors:
+        return
     with logger.contextualize(path=path):
-        for func_name, message in errors:
+        for error in errors:
             logger.patch(
-                lambda record: record.update(function=func_name)  # type:ignore[call-arg]
-            ).error(message)
+                lambda record: record.update(function=error.checker)  # type:ignore[call-arg]
+            ).error(error.message)
         logger.debug(f"{len(errors)} errors")
 
-    return False
+
+def _check_all(
+    data_set: str,
+    files: list[Path],
+    *,
+    jobs: int = 1,
+    engine: Engine = "xarray",
+    fail_fast: bool = False,
+    on_pass: Callable[[Path], None] | None = None,
+) -> bool:
+    """Report known errors and check files without known errors.
+
+    Known errors and cached results for all files are read with a single DB lookup,
+    and files which were already checked are reported before any file is opened.
+    Only checkers without cached results are run, e.g. the checkers left after a fail-fast run
+    are run on files with known errors, unless `fail_fast` is True.
+    With `jobs > 1`, files are checked on a pool of worker processes.
+    Results of the checked files are logged on the parent process in the same order as `files`.
+    `on_pass` is called with each file as soon as it passed, e.g. to start its upload.
+    Return True if all files passed the check.
+    """
+    regex = re.compile(rf"{data_set}.*.nc")
+    passed = True
+
+    matched: list[Path] = []
+    for path in files:
+        if regex.match(path.name):
+            matched.append(path)
+        else:
+            logger.bind(path=path).error(f"filename does not match r'{regex.pattern}', skip")
+            passed = False
+
+    cached = _cached(matched)
+    with timed("error_db"):
+        write_seen(matched, data_set=data_set)
+
+    pending: dict[Path, list[Checker]] = {}
+    known: dict[Path, list[CheckResult]] = {}
+    failed_before: dict[Path, list[Checker]] = {}
+    for path, (errors, checkers) in cached.items():
+        failed = {error.checker for error in errors}
+        checkers = [c for c in checkers if not failed.intersection(c.requires)]
+        if errors and (fail_fast or not checkers):
+            _report(path, errors)
+            passed = False
+        elif checkers:
+            pending[path] = checkers
+            known[path] = errors
+            failed_before[path] = [c for c in REGISTERED_CHECKERS if c.name in failed]
+        else:
+            logger.bind(path=path).success("pass 🎉")
+            if on_pass is not None:
+                on_pass(path)
+
+    futures: dict[Path, Future[tuple[list[Checker], list[CheckResult], list[timing.Timing]]]]
+    futures = {}
+    pool = None
+    if jobs > 1 and pending:
+        pool = ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(timing.enabled(),))
+        for path, checkers in pending.items():
+            futures[path] = pool.submit(
+                _collect_timed,
+                path,
+                checkers,
+                engine=engine,
+                fail_fast=fail_fast,
+                failed_before=failed_before[path],
+            )
+
+    try:
+        for path, checkers in pending.items():
+            if (future := futures.get(path)) is not None:
+                completed, errors, timings = future.result()
+                timing.extend(timings)
+            else:
+                completed, errors = _collect(
+                    path,
+                    checkers,
+                    engine=engine,
+                    fail_fast=fail_fast,
+                    failed_before=failed_before[path],
+                )
+            _write_results(path, checkers, completed, errors, fail_fast=fail_fast)
+            errors = known[path] + errors
+            _report(path, errors)
+
+            if not errors:
+                logger.bind(path=path).success("pass 🎉")
+                if on_pass is not None:
+                    on_pass(path)
+            else:
+                passed = False
+    finally:
+        if pool is not None:
+            for future in futures.values():
+                future.cancel()
+            pool.shutdown()
+
+    with timed("error_db"):
+        if maintain():
+            logger.bind(path=DB_PATH).debug("pruned and compacted")
+
+    return passed
 
 
 def obs_report(
-    data_set: str, files: list[Path], *, clear_cache: bool = False, upload: bool = False
+    data_set: str,
+    files: list[Path],
+    *,
+    clear_cache: bool = False,
+    strict_checksum: bool = False,
+    upload: bool = False,
+    jobs: int = 1,
+    upload_jobs: int | None = None,
+    max_rate: float | None = None,
+    engine: Engine = "xarray",
+    fail_fast: bool = False,
+    profile: bool = False,
+    profile_json: Path | None = None,
+    pipeline: bool = False,
+    repack: bool = False,
 ):
     """Report known errors from previous checks, files without known errors will be re-tested.
 
     If `clear_cache` is True: all files will be retested
+    If `strict_checksum` is True: re-hash all files, instead of using the cached checksums.
     If `upload` is True: upload files, if all files passed the check.
+    If `pipeline` is True: upload files as soon as they pass, while other files are checked,
+    and publish them only if all files passed, see `upload._pipelined`.
+    If `repack` is True: upload compressed netCDF4 copies of the files instead,
+    if they are smaller and hold the same data, see `upload._repacked`.
+    If `jobs` > 1: check files in parallel on `jobs` worker processes.
+    `upload_jobs` files are uploaded at the same time, see `s3_bucket.UPLOAD_JOBS`,
+    and at most `max_rate` bytes/s in total, if given, see `s3_bucket.s3_upload_many`.
+    `engine` reads the data for the checks, see `reader.open_dataset`.
+    If `fail_fast` is True: stop checking a file at its first error.
+    If `profile` is True: time each stage and print a summary, see `_profiled`.
+    If `profile_json` is given: write the timings of each stage to this JSON file.
     """
     if clear_cache:
-        DB_PATH.unlink(missing_ok=True)
-
-    regex = re.compile(rf"{data_set}.*.nc")
-    for path in files:
-        if not regex.match(path.name):
-            logger.bind(path=path).error(f"filename does not match r'{regex.pattern}', skip")
+        delete_db()
+    if upload:  # boto3 is only imported to upload, and the upload module imports the checkers
+        from .upload import _pipelined, _repack, _upload
+
+    with _profiled(profile=profile, output=profile_json):
+        if strict_checksum:
+            for path in files:
+                with timed("checksum", path):
+                    checksum(path, strict=True)
+
+        if upload and pipeline:
+            check_all = partial(_check_all, jobs=jobs, engine=engine, fail_fast=fail_fast)
+            _pipelined(
+                data_set, files, check_all, jobs=upload_jobs, max_rate=max_rate, repack=repack
+            )
+            return
+
+        if not _check_all(data_set, files, jobs=jobs, engine=engine, fail_fast=fail_fast):
             upload = False
-            continue
 
-        if _report(path) and _check(path):
-            logger.bind(path=path).success("pass 🎉")
-        else:
-            upload = False
+        if upload:
+            sources = _repack(files) if repack else None
+            _upload(data_set, files, jobs=upload_jobs, max_rate=max_rate, sources=sources)
+
 
-    if not upload:
+@contextmanager
+def _profiled(*, profile: bool = False, output: Path | None = None) -> Iterator[None]:
+    """time each stage per file (checksum, DB, reads, checkers and uploads),
+    and store the timings in the DB, so slow files and checkers can be found across runs
+
+    If `profile` is True: print a summary of this run, and the slowest files across runs.
+    If `output` is given: write the summary and the timings of this run as JSON.
+    """
+    if not (profile or output):
+        yield
         return
 
-    regex = re.compile(rf"{data_set}-.*-(?P<year>\d\d\d\d).nc")
-    for path in files:
-        if (match := regex.search(path.name)) is None:
-            logger.bind(path=path).error(f"could not infer year from filename, skip")
-            continue
+    run = time.time()
+    timing.records(clear=True)
+    timing.enable()
+    try:
+        yield
+    finally:
+        timing.enable(False)
+
+    timings = timing.records(clear=True)
+    write_timings(timings, run=run)
+    if profile:
+        timing.print_summary(timings)
+        print("\nslowest files across runs")
+        for path, runs, seconds in read_timings("path", limit=5):
+            print(f"{seconds:10.3f} s  ({runs} runs)  {path}")
+    if output is not None:
+        report = dict(
+            run=run,
+            stages=[stage._asdict() for stage in timing.summary(timings)],
+            timings=[t._asdict() for t in timings],
+        )
+        output.write_text(json.dumps(report, indent=2))
+
+
+def prune_cache(
+    *,
+    max_age: float | None = None,
+    max_entries: int | None = None,
+    max_mib: float | None = None,
+):
+    """Evict cached errors and results of files not seen recently, and compact the cache
 
-        year = match.group("year")
-        s3_upload(path, object_name=f"{data_set}/download/{year}/{path.name}")
+    `max_age` [days]: evict files not seen for longer
+    `max_entries`: keep only the most recently seen files
+    `max_mib`: keep only the most recently seen files which fit in this size
+    """
+    evicted = prune(
+        max_age=None if max_age is None else max_age * DAY,
+        max_entries=max_entries,
+        max_bytes=None if max_mib is None else int(max_mib * 2**20),
+    )
+    optimize()
+    size = DB_PATH.stat().st_size / 2**20 if DB_PATH.exists() else 0
+    logger.bind(path=DB_PATH).info(f"evicted {evicted} files, {size:.1f} MiB")
+
+
+def invalidate_cache(
+    *,
+    files: list[Path] | None = None,
+    data_set: str | None = None,
+    checkers: list[str] | None = None,
+):
+    """Forget cached errors and results, so the files are re-checked
 
-    logger.success("uploaded files 🚀")
+    Only the results of `files`, of the files checked as `data_set`, and/or of `checkers`.
+    """
+    if checkers is not None and (unknown := set(checkers).difference(_versions())):
+        logger.error(f"unknown checkers {', '.join(sorted(unknown))}, skip")
+        return
+    try:
+        deleted = invalidate(files=files, data_set=data_set, checkers=checkers)
+    except ValueError as e:
+        logger.error(f"{e}, skip")
+        return
+    logger.bind(path=DB_PATH).info(f"invalidated {deleted} results")
 
 
-@register
-def time_checker(ds: xr.Dataset) -> None:
+def time_metadata(ds: xr.Dataset | Header) -> Iterator[Issue]:
     if (datetime_start := ds.get("datetime_start")) is None:
-        logger.error("missing 'datetime_start' field")
+        yield Issue("missing_field", "missing 'datetime_start' field")
     if (datetime_stop := ds.get("datetime_stop")) is None:
-        logger.error("missing 'datetime_stop' field")
+        yield Issue("missing_field", "missing 'datetime_stop' field")
 
     if datetime_start is None or datetime_stop is None:
         return
 
     if datetime_start.dims != ("time",):
-        logger.error(f"{datetime_start.dims=} != ('time',)")
+        yield Issue("wrong_dims", f"{datetime_start.dims=} != ('time',)")
     if datetime_stop.dims != ("time",):
-        logger.error(f"{datetime_stop.dims=} != ('time',)")
+        yield Issue("wrong_dims", f"{datetime_stop.dims=} != ('time',)")
 
+
+def time_values(ds: xr.Dataset | LazyDataset) -> Iterator[Issue]:
+    datetime_start, datetime_stop = ds.get("datetime_start"), ds.get("datetime_stop")
+    if datetime_start is None or datetime_stop is None:
+        return
     if not (datetime_start.dims == datetime_stop.dims == ("time",)):
         return
 
-    if not monotonically_increasing(datetime_start):
-        logger.error("datetime_start is not monotonically increasing")
-    if not monotonically_increasing(datetime_stop):
-        logger.error("datetime_stop is not monotonically increasing")
-    if not (datetime_start <= datetime_stop).all():
-        logger.error("datetime_start <!= datetime_stop")
+    summary = time_summary(_nanoseconds(datetime_start), _nanoseconds(datetime_stop))
+    if not summary.start_increasing:
+        yield Issue("not_increasing", "datetime_start is not monotonically increasing")
+    if not summary.stop_increasing:
+        yield Issue("not_increasing", "datetime_stop is not monotonically increasing")
+    if not summary.start_before_stop:
+        yield Issue("start_after_stop", "datetime_start <!= datetime_stop")
         return
 
-    if (freq := infer_freq(datetime_stop - datetime_start)) == "?":
-        logger.error("not hourly or daily frequency")
+    if summary.freq == "?":
+        yield Issue("unknown_freq", "not hourly or daily frequency")
 
-    if len(years(datetime_start)) > 1:
-        logger.error("different years")
+    if len(summary.years) > 1:
+        yield Issue("different_years", "different years")
 
-    days = 366 if datetime_start.dt.is_leap_year.any() else 365
+    days = 366 if any(map(isleap, summary.years)) else 365
     records = {"1D": days, "1H": days * 24}
-    if freq in records and datetime_start.size < records[freq]:
-        logger.error("not a full year")
+    if summary.freq in records and summary.records < records[summary.freq]:
+        yield Issue("incomplete_year", "not a full year")
 
 
-def monotonically_increasing(time: xr.DataArray) -> bool:
-    return (time.diff("time").data.view(int) > 0).all()
+@register(metadata=time_metadata, values=time_values, cost="medium")
+def time_checker(ds: xr.Dataset) -> Iterator[Issue]:
+    yield from chain(time_metadata(ds), time_values(ds))
 
 
-def infer_freq(time_delta: xr.DataArray) -> Literal["1H", "1D", "?"]:
-    time_delta = time_delta.dt.round("min")
-    if (time_delta.dt.seconds == 3600).all():
+NaT = np.iinfo(np.int64).min  # NaT as int64
+MINUTE_NS, HOUR_NS, DAY_NS = 60 * 10**9, 3600 * 10**9, 86400 * 10**9
+
+
+class TimeSummary(NamedTuple):
+    start_increasing: bool
+    stop_increasing: bool
+    start_before_stop: bool
+    freq: Literal["1H", "1D", "?"]
+    years: set[int]
+    records: int
+
+
+def time_summary(start: np.ndarray, stop: np.ndarray) -> TimeSummary:
+    """all the time checks on int64 nanoseconds since epoch, without datetime conversions"""
+    valid = (start != NaT) & (stop != NaT)
+    return TimeSummary(
+        _increasing(start),
+        _increasing(stop),
+        bool((valid & (start <= stop)).all()),
+        _freq(np.where(valid, stop - start, NaT)),
+        _years(start),
+        start.size,
+    )
+
+
+def _nanoseconds(time: xr.DataArray | LazyVariable) -> np.ndarray:
+    """datetime64/timedelta64 values as int64 nanoseconds, without copies for [ns] values"""
+    data = np.asarray(time.data)
+    unit = "datetime64[ns]" if data.dtype.kind == "M" else "timedelta64[ns]"
+    return data.astype(unit, copy=False).view(np.int64)
+
+
+def _increasing(time: np.ndarray) -> bool:
+    # NaT is the smallest int64, any NaT is not increasing, as the NaT differences were
+    if time.size > 1 and (time == NaT).any():
+        return False
+    return bool((time[1:] > time[:-1]).all())
+
+
+def _freq(time_delta: np.ndarray) -> Literal["1H", "1D", "?"]:
+    # round half to even to the minute, as pd.Timedelta.round
+    minutes, rest = np.divmod(time_delta, MINUTE_NS)
+    minutes += (2 * rest > MINUTE_NS) | ((2 * rest == MINUTE_NS) & (minutes % 2 == 1))
+    time_delta = np.where(time_delta == NaT, NaT, minutes * MINUTE_NS)
+
+    # days and seconds components, as pd.Timedelta.days and pd.Timedelta.seconds
+    valid = time_delta != NaT
+    days, seconds = np.divmod(time_delta, DAY_NS)
+    if (valid & (seconds == HOUR_NS)).all():
         return "1H"
-    if (time_delta.dt.days == 1).all():
+    if (valid & (days == 1)).all():
         return "1D"
     return "?"
 
 
+def _years(time: np.ndarray) -> set[int]:
+    time = time[time != NaT]
+    if time.size == 0:
+        return set()
+    first, last = time.min(), time.max()
+    if _year(first) == _year(last):  # single year, no need to convert every timestamp
+        return {_year(first)}
+    return set(
+        np.unique(
+            time.view("datetime64[ns]").astype("datetime64[Y]").view(np.int64) + 1970
+        ).tolist()
+    )
+
+
+def _year(time: np.int64) -> int:
+    return int(np.datetime64(int(time), "ns").astype("datetime64[Y]").astype(int)) + 1970
+
+
+def monotonically_increasing(time: xr.DataArray) -> bool:
+    return _increasing(_nanoseconds(time))
+
+
+def infer_freq(time_delta: xr.DataArray) -> Literal["1H", "1D", "?"]:
+    return _freq(_nanoseconds(time_delta))
+
+
 def years(time: xr.DataArray) -> set[int]:
-    return set(np.unique(time.dt.year))
+    return _years(_nanoseconds(time))
 
 
-@register
-def coord_checker(ds: xr.Dataset) -> None:
+def coord_metadata(ds: xr.Dataset | Header) -> Iterator[Issue]:
     if (latitude := ds.get("latitude")) is None:
-        logger.error("missing 'latitude' field")
+        yield Issue("missing_field", "missing 'latitude' field")
     if (longitude := ds.get("longitude")) is None:
-        logger.error("missing 'longitude' field")
+        yield Issue("missing_field", "missing 'longitude' field")
     if (altitude := ds.get("altitude")) is None:
-        logger.error("missing 'altitude' field")
+        yield Issue("missing_field", "missing 'altitude' field")
 
     if latitude is None or longitude is None or altitude is None:
         return
@@ -169,23 +730,33 @@ def coord_checker(ds: xr.Dataset) -> None:
     coord_units = ((latitude, "degree_north"), (longitude, "degree_east"), (altitude, "m"))
     for coord, _units in coord_units:
         if (size := coord.size) != 1:
-            logger.error(f"{coord.name}.{size=} != 1")
+            yield Issue("wrong_size", f"{coord.name}.{size=} != 1")
         if (units := coord.attrs.get("units")) is None:
-            logger.error(f"missing {coord.name}.units")
+            yield Issue("missing_units", f"missing {coord.name}.units")
             continue
         if units != _units:
-            logger.error(f"{coord.name}.{units=} != '{_units}'")
+            yield Issue("wrong_units", f"{coord.name}.{units=} != '{_units}'")
+
+
+def coord_values(ds: xr.Dataset | LazyDataset) -> Iterator[Issue]:
+    latitude, longitude = ds.get("latitude"), ds.get("longitude")
+    if latitude is None or longitude is None or ds.get("altitude") is None:
+        return
 
     if (latitude < -90).any() or (latitude > 90).any():
-        logger.error("latitude out of range [-90, 90]")
+        yield Issue("out_of_range", "latitude out of range [-90, 90]")
     if (longitude < -180).any() or (longitude > 180).any():
-        logger.error("longitude out of range [-180, 180]")
+        yield Issue("out_of_range", "longitude out of range [-180, 180]")
+
+
+@register(metadata=coord_metadata, values=coord_values, cost="low")
+def coord_checker(ds: xr.Dataset) -> Iterator[Issue]:
+    yield from chain(coord_metadata(ds), coord_values(ds))
 
 
-@register
-def data_checker(ds: xr.Dataset) -> None:
+def data_metadata(ds: xr.Dataset | Header) -> Iterator[Issue]:
     if not set(VARIABLE_UNITS).intersection(ds.data_vars):
-        logger.error("missing obs found")
+        yield Issue("missing_obs", "missing obs found")
         return
 
     for var, _units in VARIABLE_UNITS.items():
@@ -193,15 +764,71 @@ def data_checker(ds: xr.Dataset) -> None:
             continue
 
         if (dims := ds[var].dims) != ("time",):
-            logger.error(f"{var}.{dims=} != ('time',)")
+            yield Issue("wrong_dims", f"{var}.{dims=} != ('time',)")
         if (units := ds[var].attrs.get("units")) is None:
-            logger.error(f"missing {var}.units")
+            yield Issue("missing_units", f"missing {var}.units")
             continue
         if units not in _units:
-            logger.error(f"{var}.{units=} not in {sorted(_units)}")
+            yield Issue("wrong_units", f"{var}.{units=} not in {sorted(_units)}")
+
+
+# memory ceiling for reading a data variable, larger variables are read in chunks along time
+MAX_MEMORY = 256 * 2**20  # 256 MiB
+
+
+class VariableStats(NamedTuple):
+    negatives: int
+    nans: int
+    min: float
+    max: float
+
+
+def _chunks(da: xr.DataArray | LazyVariable, *, max_memory: int) -> Iterator[np.ndarray]:
+    """values of da, in chunks along time if it has a time dimension,
+    so at most `max_memory` bytes are loaded at the time, including temporary masks"""
+    if "time" not in da.dims or da.size == 0:
+        yield da.values
+        return
+    row_bytes = (da.dtype.itemsize + 1) * (da.size // da.sizes["time"])
+    step = max(1, max_memory // row_bytes)
+    for start in range(0, da.sizes["time"], step):
+        yield da.isel(time=slice(start, start + step)).values
+
+
+def has_negatives(da: xr.DataArray | LazyVariable, *, max_memory: int) -> bool:
+    """any negative value, reading chunks until the first one is found"""
+    return any(np.any(chunk < 0) for chunk in _chunks(da, max_memory=max_memory))
+
+
+def variable_stats(da: xr.DataArray | LazyVariable, *, max_memory: int) -> VariableStats:
+    """count negative and NaN values, and find min/max in a single pass, see `_chunks`"""
+    negatives = nans = 0
+    _min, _max = np.inf, -np.inf
+    for chunk in _chunks(da, max_memory=max_memory):
+        negatives += np.count_nonzero(chunk < 0)
+        chunk_nans = 0
+        if np.issubdtype(chunk.dtype, np.floating):
+            chunk_nans = np.count_nonzero(np.isnan(chunk))
+            nans += chunk_nans
+        if chunk.size > chunk_nans:
+            _min = min(_min, np.nanmin(chunk))
+            _max = max(_max, np.nanmax(chunk))
+
+    return VariableStats(negatives, nans, float(_min), float(_max))
+
+
+def data_values(ds: xr.Dataset | LazyDataset, *, max_memory: int | None = None) -> Iterator[Issue]:
+    """variables larger than `max_memory` bytes (default `MAX_MEMORY`) are checked in chunks"""
+    if max_memory is None:
+        max_memory = MAX_MEMORY
 
     for var in VARIABLE_UNITS:
         if var not in ds.data_vars:
             continue
-        if (ds[var] < 0).any():
-            logger.error(f"{var} has negative values")
+        if has_negatives(ds[var], max_memory=max_memory):
+            yield Issue("negative_values", f"{var} has negative values")
+
+
+@register(metadata=data_metadata, values=data_values, cost="high")
+def data_checker(ds: xr.Dataset) -> Iterator[Issue]:
+    yield from chain(data_metadata(ds), data_values(ds))
@@ -1,22 +1,134 @@
+from __future__ import annotations
+
+import mmap
+import sqlite3
 from functools import lru_cache
 from pathlib import Path
+from threading import Lock
+from typing import Any, Callable
+
+from .timing import timed
 
 try:  # pragma: no cover
     HASHLIB = "blake3"
     from blake3 import blake3 as hasher  # type: ignore
+
+    MAX_THREADS: int = hasher.AUTO  # hash on all CPU cores
 except ModuleNotFoundError:  # pragma: no cover
     HASHLIB = "hashlib.blake2b"
     from hashlib import blake2b as hasher
 
+    MAX_THREADS = 1
+
+
+__all__ = ["HASHLIB", "checksum", "file_digest", "CACHE_PATH"]
+
+CACHE_PATH = Path(f"~/.cache/{__package__}/checksums.sqlite").expanduser()
 
-__all__ = ["HASHLIB", "checksum"]
+# read buffer for hashers without a memory map path
+BUFFER_SIZE = 2**20  # 1 MiB
+
+_lock = Lock()
 
 
 @lru_cache
-def checksum(path: Path) -> str:
-    _checksum = hasher()
+def _cache_db(database: Path) -> sqlite3.Connection:
+    """long-lived connection to the checksum cache, create db and table if needed"""
+    if not database.exists():
+        database.parent.mkdir(parents=True, exist_ok=True)
+        database.parent.chmod(0o700)  # only user has read/write/execute permissions
+
+    db = sqlite3.connect(database, check_same_thread=False)
+    db.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS checksums (
+            path     TEXT PRIMARY KEY,
+            inode    INTEGER NOT NULL,
+            size     INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            hashlib  TEXT NOT NULL,
+            checksum TEXT NOT NULL
+        );
+        """
+    )
+    return db
+
+
+def file_digest(
+    path: Path,
+    *,
+    hasher: Callable[..., Any] = hasher,
+    buffer_size: int = BUFFER_SIZE,
+    use_mmap: bool = False,
+    max_threads: int = 1,
+) -> str:
+    """hex digest of the file content
+
+    By default, the file is read into a single re-used buffer of `buffer_size` bytes.
+    If `use_mmap` is True: hash a read-only memory map of the file, without copies.
+    `max_threads` is only used by blake3, where `blake3.AUTO` uses all CPU cores.
+    """
+    if getattr(hasher, "AUTO", None) is not None:  # blake3
+        _checksum = hasher(max_threads=max_threads)
+    else:
+        _checksum = hasher()
+
+    if use_mmap and hasattr(_checksum, "update_mmap"):
+        _checksum.update_mmap(path)
+        return _checksum.hexdigest()
+
     with path.open("rb") as f:
-        # Read and update hash in chunks of 4K
-        for block in iter(lambda: f.read(4096), b""):
-            _checksum.update(block)
+        if use_mmap and path.stat().st_size > 0:  # can not memory map empty files
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                _checksum.update(m)
+            return _checksum.hexdigest()
+
+        buffer = memoryview(bytearray(buffer_size))
+        while size := f.readinto(buffer):
+            _checksum.update(buffer[:size])
     return _checksum.hexdigest()
+
+
+def _hash(path: Path) -> str:
+    # blake3 hashes memory maps on multiple threads, blake2b is faster reading into a buffer
+    return file_digest(path, use_mmap=HASHLIB == "blake3", max_threads=MAX_THREADS)
+
+
+@lru_cache
+def checksum(path: Path, *, strict: bool = False) -> str:
+    """file checksum, cached on disk by (realpath, inode, size, mtime_ns)
+
+    The file is only re-hashed when any of the stat fields changed since the last time.
+    If `strict` is True: ignore the cached checksum, re-hash the file and update the cache.
+    """
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_ino, stat.st_size, stat.st_mtime_ns, HASHLIB)
+
+    select = """
+        SELECT
+            checksum
+        FROM
+            checksums
+        WHERE
+            path IS ? AND inode IS ? AND size IS ? AND mtime_ns IS ? AND hashlib IS ?;
+        """
+    insert = """
+        INSERT or REPLACE INTO checksums (path, inode, size, mtime_ns, hashlib, checksum)
+        VALUES (?, ?, ?, ?, ?, ?);
+        """
+
+    with _lock:  # upload threads might open the cache at the same time
+        db = _cache_db(CACHE_PATH)
+    if not strict:
+        with _lock:
+            if (row := db.execute(select, key).fetchone()) is not None:
+                return row[0]
+
+    with timed("hash", path) as stage:
+        stage.bytes = stat.st_size
+        _checksum = _hash(path)
+    with _lock, db:
+        db.execute(insert, (*key, _checksum))
+    return _checksum
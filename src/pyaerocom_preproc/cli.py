@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import sys
+from enum import Enum
 from functools import partial
 from importlib import metadata
 from pathlib import Path
@@ -11,19 +12,25 @@ from typing import List, Optional
 import typer
 from loguru import logger
 
-from .check_obs import obs_report
-from .checksum import HASHLIB
-from .config import config
-from .error_db import logging_patcher
-from .s3_bucket import s3_list
+# heavy dependencies (xarray, boto3, dynaconf) are imported inside the commands,
+# so `--help`, `--version` and simple commands start fast
 
 main = typer.Typer(add_completion=False)
 
 
+class Engine(str, Enum):
+    """reader engines for the values checks, see `reader.ENGINES`"""
+
+    xarray = "xarray"
+    netcdf4 = "netcdf4"
+
+
 def version_callback(value: bool) -> None:
     if not value:
         return
 
+    from .checksum import HASHLIB
+
     _package = partial(typer.style, fg=typer.colors.GREEN, bold=True)
     _version = partial(typer.style, fg=typer.colors.CYAN, bold=True)
 
@@ -68,9 +75,7 @@ def logging_config(verbose: int = 0, *, quiet: bool = False, debug: bool = False
             handler.update(level="DEBUG")
         else:
             handler.update(format="{time:%F %T} <level>{message}</level>")
-        logger.configure(
-            handlers=[handler], extra={"path": Path(__file__)}, patcher=logging_patcher()
-        )
+        logger.configure(handlers=[handler], extra={"path": Path(__file__)})
 
     logger.debug(
         f"{__package__} version {metadata.version(__package__)}, Python {python_version()}"
@@ -90,8 +95,11 @@ def callback(
     logging_config(verbose, quiet=quiet, debug=debug)
 
 
-@main.command(help=config.__doc__)
+@main.command()
 def check_s3(overwrite: bool = typer.Option(False, "--overwrite", "-O")):
+    """Check S3 credentials file"""
+    from .config import config
+
     if config(overwrite=overwrite) is None:
         raise typer.Abort()
 
@@ -103,21 +111,244 @@ def report_obs(
     clear_cache: bool = typer.Option(
         False, "--clear-cache", help="clear cached errors and rerun check"
     ),
+    strict_checksum: bool = typer.Option(
+        False, "--strict-checksum", help="re-hash files instead of using cached checksums"
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="check files on N processes"),
+    engine: Engine = typer.Option(
+        Engine.xarray, "--engine", help="read the data with xarray, or a lazy netCDF4 view"
+    ),
+    fail_fast: bool = typer.Option(
+        False, "--fail-fast", help="stop checking a file at its first error"
+    ),
+    profile: bool = typer.Option(
+        False, "--profile", help="print the time spent on each stage, e.g. checksum or checkers"
+    ),
+    profile_json: Optional[Path] = typer.Option(
+        None, "--profile-json", help="write the time spent on each stage as JSON"
+    ),
 ):
     """Report known errors from previous checks, files without known errors will be re-tested."""
-    obs_report(data_set, files, clear_cache=clear_cache)
+    from .check_obs import obs_report
+
+    obs_report(
+        data_set,
+        files,
+        clear_cache=clear_cache,
+        strict_checksum=strict_checksum,
+        jobs=jobs,
+        engine=engine.value,
+        fail_fast=fail_fast,
+        profile=profile,
+        profile_json=profile_json,
+    )
 
 
 @main.command()
-def upload_obs(data_set: str, files: List[Path]):
+def upload_obs(
+    data_set: str,
+    files: List[Path],
+    strict_checksum: bool = typer.Option(
+        False, "--strict-checksum", help="re-hash files instead of using cached checksums"
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="check files on N processes"),
+    upload_jobs: Optional[int] = typer.Option(
+        None, "--upload-jobs", min=1, help="upload about N files at the same time  [default: 8]"
+    ),
+    max_rate: Optional[float] = typer.Option(
+        None, "--max-rate", min=0, help="upload at most N MB/s, across all files"
+    ),
+    engine: Engine = typer.Option(
+        Engine.xarray, "--engine", help="read the data with xarray, or a lazy netCDF4 view"
+    ),
+    fail_fast: bool = typer.Option(
+        False, "--fail-fast", help="stop checking a file at its first error"
+    ),
+    profile: bool = typer.Option(
+        False, "--profile", help="print the time spent on each stage, e.g. checksum or checkers"
+    ),
+    profile_json: Optional[Path] = typer.Option(
+        None, "--profile-json", help="write the time spent on each stage as JSON"
+    ),
+    pipeline: bool = typer.Option(
+        False, "--pipeline", help="upload files to a staging area while the others are checked"
+    ),
+    repack: bool = typer.Option(
+        False, "--repack", help="upload compressed netCDF4 copies, if smaller with the same data"
+    ),
+):
     """Upload files without known errors from previous checks
 
     Files without known errors will be re-tested
     """
-    obs_report(data_set, files, upload=True)
+    from .check_obs import obs_report
+
+    obs_report(
+        data_set,
+        files,
+        strict_checksum=strict_checksum,
+        upload=True,
+        jobs=jobs,
+        upload_jobs=upload_jobs,
+        max_rate=max_rate * 1e6 if max_rate else None,
+        engine=engine.value,
+        fail_fast=fail_fast,
+        profile=profile,
+        profile_json=profile_json,
+        pipeline=pipeline,
+        repack=repack,
+    )
 
 
 @main.command()
-def bucket_ls():
-    """List up to 1000 items in the S3 bucket"""
-    s3_list()
+def sync_obs(
+    data_set: str,
+    files: List[Path],
+    strict_checksum: bool = typer.Option(
+        False, "--strict-checksum", help="re-hash files instead of using cached checksums"
+    ),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="check files on N processes"),
+    upload_jobs: Optional[int] = typer.Option(
+        None, "--upload-jobs", min=1, help="upload about N files at the same time  [default: 8]"
+    ),
+    max_rate: Optional[float] = typer.Option(
+        None, "--max-rate", min=0, help="upload at most N MB/s, across all files"
+    ),
+    engine: Engine = typer.Option(
+        Engine.xarray, "--engine", help="read the data with xarray, or a lazy netCDF4 view"
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", "-n", help="only show the files which would be uploaded"
+    ),
+    repack: bool = typer.Option(
+        False, "--repack", help="upload compressed netCDF4 copies, if smaller with the same data"
+    ),
+):
+    """Upload files which passed the checks and changed since the last sync
+
+    Published files are listed on a manifest, stored with the data set on the bucket.
+    """
+    from .sync import sync_obs
+
+    sync_obs(
+        data_set,
+        files,
+        strict_checksum=strict_checksum,
+        jobs=jobs,
+        upload_jobs=upload_jobs,
+        max_rate=max_rate * 1e6 if max_rate else None,
+        engine=engine.value,
+        dry_run=dry_run,
+        repack=repack,
+    )
+
+
+@main.command()
+def watch(
+    data_set: str,
+    directory: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True),
+    interval: float = typer.Option(10, "--interval", min=0, help="seconds between polls"),
+    settle: float = typer.Option(
+        30, "--settle", min=0, help="only check files which did not change for N seconds"
+    ),
+    upload: bool = typer.Option(False, "--upload", help="upload once all the files passed"),
+    jobs: int = typer.Option(1, "--jobs", "-j", min=1, help="check files on N processes"),
+    upload_jobs: Optional[int] = typer.Option(
+        None, "--upload-jobs", min=1, help="upload about N files at the same time  [default: 8]"
+    ),
+    max_rate: Optional[float] = typer.Option(
+        None, "--max-rate", min=0, help="upload at most N MB/s, across all files"
+    ),
+    engine: Engine = typer.Option(
+        Engine.xarray, "--engine", help="read the data with xarray, or a lazy netCDF4 view"
+    ),
+    once: bool = typer.Option(False, "--once", help="poll once and exit, e.g. from cron"),
+    repack: bool = typer.Option(
+        False, "--repack", help="upload compressed netCDF4 copies, if smaller with the same data"
+    ),
+):
+    """Check new or modified files in directory, as they arrive"""
+    from .watch import watch_obs
+
+    try:
+        watch_obs(
+            data_set,
+            directory,
+            interval=interval,
+            settle=settle,
+            upload=upload,
+            jobs=jobs,
+            upload_jobs=upload_jobs,
+            max_rate=max_rate * 1e6 if max_rate else None,
+            engine=engine.value,
+            iterations=1 if once else None,
+            repack=repack,
+        )
+    except KeyboardInterrupt:
+        logger.bind(path=directory).info("stop watching")
+
+
+@main.command()
+def cache_prune(
+    max_age: Optional[float] = typer.Option(
+        180, "--max-age", min=0, help="evict files not seen for N days"
+    ),
+    max_files: Optional[int] = typer.Option(
+        None, "--max-files", min=0, help="keep only the N most recently seen files"
+    ),
+    max_size: Optional[float] = typer.Option(
+        None, "--max-size", min=0, help="keep the cache under N MiB, evict least recently seen"
+    ),
+):
+    """Evict cached results of files not seen recently, and compact the cache"""
+    from .check_obs import prune_cache
+
+    prune_cache(max_age=max_age, max_entries=max_files, max_mib=max_size)
+
+
+@main.command()
+def cache_invalidate(
+    files: Optional[List[Path]] = typer.Argument(None, help="only the results of these files"),
+    data_set: Optional[str] = typer.Option(
+        None, "--data-set", help="only the results of files checked as data set"
+    ),
+    checkers: Optional[List[str]] = typer.Option(
+        None, "--checker", help="only the results of this checker, can be repeated"
+    ),
+):
+    """Forget cached results, so the files are re-checked on the next report"""
+    from .check_obs import invalidate_cache
+
+    invalidate_cache(files=files or None, data_set=data_set, checkers=checkers or None)
+
+
+@main.command()
+def bucket_ls(
+    prefix: str = typer.Option("", "--prefix", "-p", help="only list keys starting with prefix"),
+    delimiter: str = typer.Option(
+        "", "--delimiter", help="group keys by prefix up to the delimiter, e.g. '/'"
+    ),
+    index: bool = typer.Option(False, "--index", help="list from the local index"),
+    refresh: bool = typer.Option(
+        False, "--refresh", help="update the local index under prefix, and list from it"
+    ),
+    long: bool = typer.Option(False, "--long", "-l", help="show size and last modified"),
+):
+    """List items in the S3 bucket"""
+    from .s3_bucket import s3_list
+
+    s3_list(prefix=prefix, delimiter=delimiter, index=index, refresh=refresh, long=long)
+
+
+@main.command()
+def bucket_abort_uploads(
+    older_than: float = typer.Option(
+        24, "--older-than", min=0, help="only uploads started more than N hours ago"
+    ),
+    prefix: str = typer.Option("", "--prefix", "-p", help="only keys starting with prefix"),
+):
+    """Abort incomplete multipart uploads, e.g. from interrupted runs which will not be resumed"""
+    from .s3_bucket import abort_uploads
+
+    aborted = abort_uploads(older_than=older_than * 3600, prefix=prefix)
+    typer.echo(f"aborted {aborted} uploads")
@@ -1,87 +1,523 @@
 from __future__ import annotations
 
 import sqlite3
+import time
 from contextlib import closing, contextmanager
 from pathlib import Path
-from typing import Iterator
-
-import loguru
+from typing import Iterator, Literal, NamedTuple
 
 from .checksum import checksum
+from .timing import Timing
 
-__all__ = ["logging_patcher", "read_errors", "DB_PATH"]
+__all__ = [
+    "CheckResult",
+    "delete_db",
+    "read_errors",
+    "read_errors_many",
+    "write_errors",
+    "read_results",
+    "read_results_many",
+    "write_results",
+    "read_timings",
+    "write_timings",
+    "read_watched",
+    "write_watched",
+    "WatchedFile",
+    "write_seen",
+    "prune",
+    "optimize",
+    "maintain",
+    "invalidate",
+    "DB_PATH",
+]
 
 DB_PATH = Path(f"~/.cache/{__package__}/errors.sqlite").expanduser()
 
+# bump when the tables change, older DBs are only a cache and will be re-created
+SCHEMA_VERSION = 5
 
-@contextmanager
-def connect(database: Path) -> Iterator[sqlite3.Connection]:
-    try:
-        db = sqlite3.connect(database)
-        yield db
-    except sqlite3.Error as e:  # pragma: no cover
-        exit(str(e))
-    finally:
-        db.close()
+DAY = 24 * 60 * 60  # seconds
 
+# results for files not seen for longer are evicted by `maintain`
+MAX_AGE = 180 * DAY
 
-@contextmanager
-def errors_db(database: Path = DB_PATH) -> Iterator[sqlite3.Connection]:
+# `maintain` prunes and compacts the DB at most once per interval
+MAINTENANCE_INTERVAL = 7 * DAY
+
+
+class CheckResult(NamedTuple):
+    """error found by a checker on a file"""
+
+    checker: str
+    code: str  # short identifier of the kind of error, e.g. "missing_units"
+    message: str
+
+
+# long-lived connections, one per DB
+_connections: dict[Path, sqlite3.Connection] = {}
+
+
+def _connect(database: Path) -> sqlite3.Connection:
     """
-    create db and errors table, if do not exists already
-    and yields a DB connection from within a context manager
+    long-lived DB connection, create db and errors/results tables if do not exists already.
+    WAL mode allows to read while other process writes, and needs fewer fsync calls.
     """
+    if (db := _connections.get(database)) is not None:
+        return db
+
     if not database.exists():
         database.parent.mkdir(parents=True, exist_ok=True)
         database.parent.chmod(0o700)  # only user has read/write/execute permissions
-        create_table = """
-            CREATE TABLE IF NOT EXISTS errors (
+
+    db = sqlite3.connect(database)
+    db.execute("PRAGMA journal_mode = WAL;")
+    db.execute("PRAGMA synchronous = NORMAL;")
+
+    (user_version,) = db.execute("PRAGMA user_version;").fetchone()
+    if user_version < SCHEMA_VERSION:
+        create_tables = f"""
+            DROP TABLE IF EXISTS errors;
+            DROP TABLE IF EXISTS results;
+            DROP TABLE IF EXISTS timings;
+            DROP TABLE IF EXISTS watched;
+            DROP TABLE IF EXISTS seen;
+            DROP TABLE IF EXISTS maintenance;
+            CREATE TABLE errors (
                 checksum  TEXT NOT NULL,
                 test_func TEXT NOT NULL,
+                version   INTEGER NOT NULL,
+                code      TEXT NOT NULL,
                 error_msg TEXT NOT NULL,
-                UNIQUE(checksum, test_func, error_msg)
+                UNIQUE(checksum, test_func, version, error_msg)
+            );
+            CREATE TABLE results (
+                checksum  TEXT NOT NULL,
+                test_func TEXT NOT NULL,
+                version   INTEGER NOT NULL,
+                passed    INTEGER NOT NULL,
+                UNIQUE(checksum, test_func, version)
+            );
+            CREATE TABLE timings (
+                run       REAL NOT NULL,
+                checksum  TEXT NOT NULL,
+                path      TEXT NOT NULL,
+                stage     TEXT NOT NULL,
+                seconds   REAL NOT NULL,
+                bytes     INTEGER NOT NULL,
+                max_rss   INTEGER NOT NULL
+            );
+            CREATE TABLE watched (
+                path      TEXT PRIMARY KEY,
+                size      INTEGER NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                passed    INTEGER NOT NULL,
+                uploaded  INTEGER NOT NULL
+            );
+            CREATE TABLE seen (
+                checksum  TEXT PRIMARY KEY,
+                data_set  TEXT NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX seen_last_seen ON seen (last_seen);
+            CREATE INDEX seen_data_set ON seen (data_set);
+            CREATE TABLE maintenance (
+                task      TEXT PRIMARY KEY,
+                last_run  REAL NOT NULL
             );
+            PRAGMA user_version = {SCHEMA_VERSION};
             """
-        with connect(database) as db, closing(db.cursor()) as cur:
-            cur.executescript(create_table)
+        with closing(db.cursor()) as cur:
+            cur.executescript(create_tables)
 
-    with connect(database) as db:
-        yield db
+    _connections[database] = db
+    return db
 
 
-def logging_patcher(database: Path = DB_PATH) -> loguru.PatcherFunction:
-    """extract error info from records and write to DB"""
-    insert = """
-        INSERT or IGNORE INTO errors (checksum, test_func, error_msg)
-        VALUES (?, ?, ?);
+@contextmanager
+def errors_db(database: Path = DB_PATH) -> Iterator[sqlite3.Connection]:
+    """
+    yields the long-lived DB connection from within a context manager,
+    create db and errors/results tables if do not exists already
+    """
+    try:
+        yield _connect(database)
+    except sqlite3.Error as e:  # pragma: no cover
+        exit(str(e))
+
+
+def delete_db(database: Path = DB_PATH) -> None:
+    """close the DB connection and delete the DB, including the WAL files"""
+    if (db := _connections.pop(database, None)) is not None:
+        db.close()
+    for suffix in ("", "-wal", "-shm"):
+        database.with_name(f"{database.name}{suffix}").unlink(missing_ok=True)
+
+
+INSERT_ERRORS = """
+    INSERT or IGNORE INTO errors (checksum, test_func, version, code, error_msg)
+    VALUES (?, ?, ?, ?, ?);
+    """
+
+
+def _error_rows(
+    _checksum: str, errors: list[CheckResult], versions: dict[str, int]
+) -> Iterator[tuple[str, str, int, str, str]]:
+    for checker, code, message in errors:
+        yield _checksum, checker, versions.get(checker, 0), code, message
+
+
+def write_errors(
+    path: Path,
+    errors: list[CheckResult],
+    *,
+    versions: dict[str, int] | None = None,
+    database: Path = DB_PATH,
+) -> None:
+    """write errors found elsewhere, e.g. on a worker process
+
+    `versions` maps checker names to their version, unknown checkers get version 0
+    """
+    if not errors:
+        return
+    if versions is None:
+        versions = {}
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        cur.executemany(INSERT_ERRORS, _error_rows(checksum(path), errors, versions))
+
+
+def read_errors(
+    path: Path, *, versions: dict[str, int] | None = None, database: Path = DB_PATH
+) -> list[CheckResult]:
+    """errors found on previous checks of path
+
+    If `versions` is given, only return errors from these checker versions
+    """
+
+    select = """
+        SELECT
+            test_func, version, code, error_msg
+        FROM
+            errors
+        WHERE
+            checksum IS ?;
         """
+    with errors_db(database) as db, closing(db.cursor()) as cur:
+        _checksum = checksum(path)
+        cur.execute(select, (_checksum,))
+        return [
+            CheckResult(func, code, msg)
+            for func, version, code, msg in cur.fetchall()
+            if versions is None or versions.get(func) == version
+        ]
 
-    def patcher(record: loguru.Record) -> None:
-        if record["level"].name != "ERROR":
-            return
-        if record["function"].endswith("_report"):
-            return
-        if record["message"].endswith("skip"):
-            return
-        with errors_db(database) as db, db, closing(db.cursor()) as cur:
-            _checksum = checksum(record["extra"]["path"])
-            cur.execute(insert, (_checksum, record["function"], record["message"]))
 
-    return patcher
+def write_results(
+    path: Path,
+    results: dict[str, bool],
+    *,
+    errors: list[CheckResult] | None = None,
+    versions: dict[str, int],
+    database: Path = DB_PATH,
+) -> None:
+    """write {test_func: passed} for the checker `versions` which were run on path,
+    and the errors found, in a single transaction"""
+    insert_results = """
+        INSERT or REPLACE INTO results (checksum, test_func, version, passed)
+        VALUES (?, ?, ?, ?);
+        """
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        _checksum = checksum(path)
+        if errors:
+            cur.executemany(INSERT_ERRORS, _error_rows(_checksum, errors, versions))
+        cur.executemany(
+            insert_results,
+            ((_checksum, func, versions[func], passed) for func, passed in results.items()),
+        )
 
 
-def read_errors(path: Path, *, database: Path = DB_PATH) -> list[tuple[str, str]]:
-    """read messages from DB and return decoded observations"""
+def read_results(
+    path: Path, *, versions: dict[str, int], database: Path = DB_PATH
+) -> dict[str, bool]:
+    """read {test_func: passed} for the checker `versions` which were run on path before"""
 
     select = """
         SELECT
-            test_func, error_msg
+            test_func, version, passed
         FROM
-            errors 
+            results
         WHERE
             checksum IS ?;
         """
     with errors_db(database) as db, closing(db.cursor()) as cur:
         _checksum = checksum(path)
         cur.execute(select, (_checksum,))
+        return {
+            func: bool(passed)
+            for func, version, passed in cur.fetchall()
+            if versions.get(func) == version
+        }
+
+
+def _lookup(cur: sqlite3.Cursor, files: list[Path]) -> dict[str, list[Path]]:
+    """fill the temporary lookup table with the checksums of files, for a single join
+    instead of one query per file, returns the files with each checksum"""
+    paths: dict[str, list[Path]] = {}
+    for path in files:
+        paths.setdefault(checksum(path), []).append(path)
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (checksum TEXT PRIMARY KEY);")
+    cur.execute("DELETE FROM lookup;")
+    cur.executemany("INSERT INTO lookup (checksum) VALUES (?);", ((c,) for c in paths))
+    return paths
+
+
+def read_errors_many(
+    files: list[Path], *, versions: dict[str, int] | None = None, database: Path = DB_PATH
+) -> dict[Path, list[CheckResult]]:
+    """`read_errors` for all files at once, on a single connection and query
+
+    Files without messages are not included.
+    """
+    select = """
+        SELECT
+            errors.checksum, test_func, version, code, error_msg
+        FROM
+            lookup JOIN errors ON errors.checksum = lookup.checksum
+        ORDER BY
+            errors.rowid;
+        """
+    errors: dict[Path, list[CheckResult]] = {}
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        paths = _lookup(cur, files)
+        for _checksum, func, version, code, msg in cur.execute(select):
+            if versions is None or versions.get(func) == version:
+                for path in paths[_checksum]:
+                    errors.setdefault(path, []).append(CheckResult(func, code, msg))
+    return errors
+
+
+def read_results_many(
+    files: list[Path], *, versions: dict[str, int], database: Path = DB_PATH
+) -> dict[Path, dict[str, bool]]:
+    """`read_results` for all files at once, on a single connection and query
+
+    Files without results are not included.
+    """
+    select = """
+        SELECT
+            results.checksum, test_func, version, passed
+        FROM
+            lookup JOIN results ON results.checksum = lookup.checksum;
+        """
+    results: dict[Path, dict[str, bool]] = {}
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        paths = _lookup(cur, files)
+        for _checksum, func, version, passed in cur.execute(select):
+            if versions.get(func) == version:
+                for path in paths[_checksum]:
+                    results.setdefault(path, {})[func] = bool(passed)
+    return results
+
+
+def write_timings(timings: list[Timing], *, run: float, database: Path = DB_PATH) -> None:
+    """write the stage timings of a run, started at `run` [s since epoch]"""
+    insert = """
+        INSERT INTO timings (run, checksum, path, stage, seconds, bytes, max_rss)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
+        """
+    if not timings:
+        return
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        cur.executemany(
+            insert,
+            ((run, checksum(Path(t.path)) if t.path else "", *t) for t in timings),
+        )
+
+
+def read_timings(
+    by: Literal["path", "stage"], *, limit: int = 10, database: Path = DB_PATH
+) -> list[tuple[str, int, float]]:
+    """slowest files or stages across runs, as (path/stage, runs, mean seconds per run)"""
+    select = f"""
+        SELECT
+            {by}, COUNT(DISTINCT run), SUM(seconds) / COUNT(DISTINCT run)
+        FROM
+            timings
+        WHERE
+            {by} != ''
+        GROUP BY
+            {by}
+        ORDER BY
+            3 DESC
+        LIMIT ?;
+        """
+    if by not in {"path", "stage"}:
+        raise ValueError(f"unknown {by=}")
+    with errors_db(database) as db, closing(db.cursor()) as cur:
+        cur.execute(select, (limit,))
         return cur.fetchall()
+
+
+class WatchedFile(NamedTuple):
+    size: int
+    mtime_ns: int
+    passed: bool
+    uploaded: bool = False
+
+
+def write_watched(files: dict[Path, WatchedFile], *, database: Path = DB_PATH) -> None:
+    """write the state of files seen by `watch`, keyed by the resolved path"""
+    insert = """
+        INSERT or REPLACE INTO watched (path, size, mtime_ns, passed, uploaded)
+        VALUES (?, ?, ?, ?, ?);
+        """
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        cur.executemany(insert, ((str(path.resolve()), *state) for path, state in files.items()))
+
+
+def read_watched(directory: Path, *, database: Path = DB_PATH) -> dict[Path, WatchedFile]:
+    """state of the files under directory seen by `watch` before"""
+    select = """
+        SELECT
+            path, size, mtime_ns, passed, uploaded
+        FROM
+            watched
+        WHERE
+            path >= ? AND path < ?;
+        """
+    prefix = f"{directory.resolve()}/"
+    with errors_db(database) as db, closing(db.cursor()) as cur:
+        cur.execute(select, (prefix, f"{prefix}\U0010ffff"))
+        return {
+            Path(path): WatchedFile(size, mtime_ns, bool(passed), bool(uploaded))
+            for path, size, mtime_ns, passed, uploaded in cur.fetchall()
+        }
+
+
+def write_seen(
+    files: list[Path], *, data_set: str, now: float | None = None, database: Path = DB_PATH
+) -> None:
+    """record the files of data_set as seen `now` [s since epoch], for `prune` and `invalidate`"""
+    insert = """
+        INSERT or REPLACE INTO seen (checksum, data_set, last_seen)
+        VALUES (?, ?, ?);
+        """
+    if now is None:
+        now = time.time()
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        cur.executemany(insert, ((checksum(path), data_set, now) for path in files))
+
+
+def _used_bytes(cur: sqlite3.Cursor) -> int:
+    """bytes on pages in use, the DB file shrinks to about this size after VACUUM"""
+    (page_count,) = cur.execute("PRAGMA page_count;").fetchone()
+    (freelist_count,) = cur.execute("PRAGMA freelist_count;").fetchone()
+    (page_size,) = cur.execute("PRAGMA page_size;").fetchone()
+    return (page_count - freelist_count) * page_size
+
+
+def prune(
+    *,
+    max_age: float | None = MAX_AGE,
+    max_entries: int | None = None,
+    max_bytes: int | None = None,
+    now: float | None = None,
+    database: Path = DB_PATH,
+) -> int:
+    """evict errors and results of files not seen recently, returns the number of files evicted
+
+    max_age: evict files not seen for longer [s], and timings from older runs
+    max_entries: keep only the most recently seen files
+    max_bytes: keep only the most recently seen files which fit, see `optimize`
+
+    Errors and results of files which were never seen, e.g. from older versions, are evicted.
+    """
+    keep_recent = """
+        DELETE FROM seen
+        WHERE
+            checksum NOT IN (SELECT checksum FROM seen ORDER BY last_seen DESC LIMIT ?);
+        """
+    if now is None:
+        now = time.time()
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        (before,) = cur.execute("SELECT COUNT(*) FROM seen;").fetchone()
+        if max_age is not None:
+            cur.execute("DELETE FROM seen WHERE last_seen < ?;", (now - max_age,))
+            cur.execute("DELETE FROM timings WHERE run < ?;", (now - max_age,))
+        if max_entries is not None:
+            cur.execute(keep_recent, (max_entries,))
+        if max_bytes is not None and (used := _used_bytes(cur)) > max_bytes:
+            (entries,) = cur.execute("SELECT COUNT(*) FROM seen;").fetchone()
+            cur.execute(keep_recent, (entries * max_bytes // used,))
+        for table in ("errors", "results"):
+            cur.execute(f"DELETE FROM {table} WHERE checksum NOT IN (SELECT checksum FROM seen);")
+        (after,) = cur.execute("SELECT COUNT(*) FROM seen;").fetchone()
+    return before - after
+
+
+def optimize(database: Path = DB_PATH) -> None:
+    """update the query planner statistics, and compact the DB file"""
+    with errors_db(database) as db:
+        db.execute("ANALYZE;")
+        db.execute("VACUUM;")
+
+
+def maintain(
+    *, interval: float = MAINTENANCE_INTERVAL, now: float | None = None, database: Path = DB_PATH
+) -> bool:
+    """`prune` files not seen for `MAX_AGE` and `optimize` the DB,
+    if it was not done for longer than `interval` [s], returns True if it was done"""
+    select = """
+        SELECT
+            last_run
+        FROM
+            maintenance
+        WHERE
+            task IS 'maintain';
+        """
+    insert = """
+        INSERT or REPLACE INTO maintenance (task, last_run)
+        VALUES ('maintain', ?);
+        """
+    if now is None:
+        now = time.time()
+    with errors_db(database) as db:
+        if (row := db.execute(select).fetchone()) is not None and now - row[0] < interval:
+            return False
+        with db:
+            db.execute(insert, (now,))
+    prune(now=now, database=database)
+    optimize(database)
+    return True
+
+
+def invalidate(
+    *,
+    files: list[Path] | None = None,
+    data_set: str | None = None,
+    checkers: list[str] | None = None,
+    database: Path = DB_PATH,
+) -> int:
+    """delete the errors and results of files, of the files seen with data_set,
+    and/or of checkers, so they are re-checked, returns the number of results deleted
+
+    The filters are combined, e.g. only the results of `checkers` on `files`.
+    """
+    where: list[str] = []
+    params: list[str] = []
+    if files is not None:
+        where.append("checksum IN (SELECT checksum FROM lookup)")
+    if data_set is not None:
+        where.append("checksum IN (SELECT checksum FROM seen WHERE data_set IS ?)")
+        params.append(data_set)
+    if checkers is not None:
+        where.append(f"test_func IN ({', '.join('?' * len(checkers))})")
+        params.extend(checkers)
+    if not where:
+        raise ValueError("nothing to invalidate, give files, data_set and/or checkers")
+
+    with errors_db(database) as db, db, closing(db.cursor()) as cur:
+        if files is not None:
+            _lookup(cur, files)
+        cur.execute(f"DELETE FROM errors WHERE {' AND '.join(where)};", params)
+        cur.execute(f"DELETE FROM results WHERE {' AND '.join(where)};", params)
+        return cur.rowcount
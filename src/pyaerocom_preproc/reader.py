@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Literal, NamedTuple
+
+import netCDF4
+import numpy as np
+import xarray as xr
+from xarray.coding.times import decode_cf_datetime
+
+__all__ = [
+    "ENGINES",
+    "Header",
+    "HeaderVariable",
+    "LazyDataset",
+    "LazyVariable",
+    "open_dataset",
+    "read_header",
+]
+
+Engine = Literal["xarray", "netcdf4"]
+ENGINES: tuple[Engine, ...] = ("xarray", "netcdf4")
+
+
+class HeaderVariable(NamedTuple):
+    """variable metadata, with the same names as `xr.DataArray`"""
+
+    name: str
+    dims: tuple[str, ...]
+    size: int
+    attrs: dict[str, Any]
+
+
+@dataclass
+class Header:
+    """dims, variables and attributes from the netCDF header, without any data
+
+    Offers the subset of the `xr.Dataset` interface used by the metadata checks.
+    """
+
+    dims: dict[str, int]
+    variables: dict[str, HeaderVariable]
+    attrs: dict[str, Any]
+
+    def get(self, name: str) -> HeaderVariable | None:
+        return self.variables.get(name)
+
+    def __getitem__(self, name: str) -> HeaderVariable:
+        return self.variables[name]
+
+    @cached_property
+    def coords(self) -> set[str]:
+        """dimension coordinates and variables named on `coordinates` attributes,
+        as they are decoded by xarray"""
+        coords = {name for name, var in self.variables.items() if var.dims == (name,)}
+        for var in self.variables.values():
+            coords.update(str(var.attrs.get("coordinates", "")).split())
+        return coords.intersection(self.variables)
+
+    @cached_property
+    def data_vars(self) -> list[str]:
+        coords = self.coords
+        return [name for name in self.variables if name not in coords]
+
+
+def _variable(var: netCDF4.Variable) -> HeaderVariable:
+    dims, size = tuple(var.dimensions), int(var.size)
+    if var.dtype == "S1" and dims:  # char arrays are decoded as strings by xarray
+        size //= len(var.get_dims()[-1]) or 1
+        dims = dims[:-1]
+    return HeaderVariable(
+        var.name, dims, size, {attr: var.getncattr(attr) for attr in var.ncattrs()}
+    )
+
+
+def _header(nc: netCDF4.Dataset) -> Header:
+    variables = {name: _variable(var) for name, var in nc.variables.items()}
+    used = {dim for var in variables.values() for dim in var.dims}
+    dims = {name: len(dim) for name, dim in nc.dimensions.items() if name in used}
+    attrs = {attr: nc.getncattr(attr) for attr in nc.ncattrs()}
+    return Header(dims, variables, attrs)
+
+
+def read_header(path: Path) -> Header:
+    """read the netCDF header, variable data is not read"""
+    with netCDF4.Dataset(path) as nc:
+        return _header(nc)
+
+
+class LazyVariable:
+    """variable data read on demand from the netCDF4 file, only the selected slices
+
+    Offers the subset of the `xr.DataArray` interface used by the values checks.
+    Values are decoded as xarray would: fill values are masked as NaN, scale_factor/add_offset
+    are applied, and variables with "<units> since <date>" units are decoded as datetime64[ns].
+    """
+
+    def __init__(
+        self,
+        var: netCDF4.Variable,
+        header: HeaderVariable,
+        key: tuple[slice, ...] | None = None,
+    ):
+        self._var = var
+        self._header = header
+        self._key = key if key is not None else (slice(None),) * len(header.dims)
+
+    name = property(lambda self: self._header.name)
+    dims = property(lambda self: self._header.dims)
+    attrs = property(lambda self: self._header.attrs)
+
+    @cached_property
+    def shape(self) -> tuple[int, ...]:
+        return tuple(
+            len(range(*key.indices(len(dim)))) for key, dim in zip(self._key, self._var.get_dims())
+        )
+
+    @property
+    def sizes(self) -> dict[str, int]:
+        return dict(zip(self.dims, self.shape))
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def ndim(self) -> int:
+        return len(self.dims)
+
+    @property
+    def is_datetime(self) -> bool:
+        return " since " in str(self.attrs.get("units", ""))
+
+    @property
+    def _is_char(self) -> bool:
+        return self._var.dtype == "S1" and self._var.ndim > len(self.dims)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """dtype of the decoded values, without reading them"""
+        if self.is_datetime:
+            return np.dtype("datetime64[ns]")
+        dtype = np.dtype(self._var.dtype)
+        if self._is_char:
+            length = len(self._var.get_dims()[-1])
+            return np.dtype(f"U{length}" if "_Encoding" in self.attrs else f"S{length}")
+        if {"scale_factor", "add_offset"}.intersection(self.attrs):
+            return np.result_type(dtype, np.float32)
+        if dtype.kind in "iu" and {"_FillValue", "missing_value"}.intersection(self.attrs):
+            return np.result_type(dtype, np.float32)
+        return dtype
+
+    def isel(self, **indexers: slice) -> LazyVariable:
+        """select slices along named dimensions, nothing is read"""
+        key = list(self._key)
+        for dim, indexer in indexers.items():
+            i = self.dims.index(dim)
+            offset = range(len(self._var.get_dims()[i]))[key[i]][indexer]
+            key[i] = slice(offset.start, offset.stop, offset.step)
+        return LazyVariable(self._var, self._header, tuple(key))
+
+    @property
+    def values(self) -> np.ndarray:
+        data = self._var[self._key]
+        if self._is_char:
+            return netCDF4.chartostring(data, encoding=self.attrs.get("_Encoding", "bytes"))
+        data = np.asarray(data)
+
+        fill_values = [
+            self.attrs[attr] for attr in ("_FillValue", "missing_value") if attr in self.attrs
+        ]
+        if fill_values and (mask := np.isin(data, fill_values)).any():
+            data = np.where(mask, np.nan, data.astype(np.result_type(data, np.float32)))
+        if {"scale_factor", "add_offset"}.intersection(self.attrs):
+            scale_factor, add_offset = self.attrs.get("scale_factor", 1), self.attrs.get(
+                "add_offset", 0
+            )
+            data = data * scale_factor + add_offset
+        if self.is_datetime:
+            data = decode_cf_datetime(data, self.attrs["units"], self.attrs.get("calendar"))
+        return data
+
+    data = values
+
+    def __lt__(self, other) -> np.ndarray:
+        return self.values < other
+
+    def __le__(self, other) -> np.ndarray:
+        return self.values <= other
+
+    def __gt__(self, other) -> np.ndarray:
+        return self.values > other
+
+    def __ge__(self, other) -> np.ndarray:
+        return self.values >= other
+
+
+@dataclass
+class LazyDataset:
+    """open netCDF4 file with the header already read, variable data is read on access
+
+    Offers the subset of the `xr.Dataset` interface used by the values checks,
+    without decoding every variable and building indexes as `xr.open_dataset` does.
+    """
+
+    nc: netCDF4.Dataset
+    header: Header
+
+    @classmethod
+    def open(cls, path: Path) -> LazyDataset:
+        nc = netCDF4.Dataset(path)
+        nc.set_auto_maskandscale(False)  # decoded by LazyVariable, as xarray does
+        return cls(nc, _header(nc))
+
+    dims = property(lambda self: self.header.dims)
+    attrs = property(lambda self: self.header.attrs)
+    data_vars = property(lambda self: self.header.data_vars)
+    coords = property(lambda self: self.header.coords)
+
+    def get(self, name: str) -> LazyVariable | None:
+        if name not in self.header.variables:
+            return None
+        return self[name]
+
+    def __getitem__(self, name: str) -> LazyVariable:
+        return LazyVariable(self.nc.variables[name], self.header.variables[name])
+
+    def close(self) -> None:
+        self.nc.close()
+
+    def __enter__(self) -> LazyDataset:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_dataset(path: Path, *, engine: Engine = "xarray") -> xr.Dataset | LazyDataset:
+    """open path for the values checks
+
+    engine="xarray": decoded `xr.Dataset`, as `xr.open_dataset`
+    engine="netcdf4": `LazyDataset` view, which only reads and decodes the variables accessed
+    """
+    if engine == "netcdf4":
+        return LazyDataset.open(path)
+    if engine == "xarray":
+        return xr.open_dataset(path)
+    raise ValueError(f"unknown {engine=}, expected one of {ENGINES}")
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Iterator
+
+import netCDF4
+import numpy as np
+
+__all__ = ["REPACK_PATH", "repack", "same_data"]
+
+# repacked copies waiting to be uploaded, by checksum of the original file
+REPACK_PATH = Path(f"~/.cache/{__package__}/repacked").expanduser()
+
+# zlib level, higher levels are much slower for little gain on station time series
+COMPLEVEL = 4
+
+# values per chunk along time, a leap year of hourly values
+TIME_CHUNK = 8784
+TIME_DIM = "time"
+
+
+def _chunksizes(var: netCDF4.Variable, time_chunk: int) -> list[int]:
+    """chunks along time, and the whole extent of any other dimension"""
+    return [
+        max(min(len(dim), time_chunk) if dim.name == TIME_DIM else len(dim), 1)
+        for dim in var.get_dims()
+    ]
+
+
+def repack(
+    path: Path, output: Path, *, complevel: int = COMPLEVEL, time_chunk: int = TIME_CHUNK
+) -> None:
+    """rewrite path as netCDF4, with zlib/shuffle compression and chunked along time
+
+    Dimensions, attributes and the stored values are copied as they are, without
+    decoding fill values, scale factors or char arrays, so the data reads back the same.
+    Values are copied one time chunk at the time.
+    """
+    with netCDF4.Dataset(path) as src:
+        if src.groups:
+            raise ValueError("netCDF4 groups are not supported")
+        src.set_auto_maskandscale(False)
+        src.set_auto_chartostring(False)
+        with netCDF4.Dataset(output, "w", format="NETCDF4") as dst:
+            dst.setncatts({attr: src.getncattr(attr) for attr in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+            for name, var in src.variables.items():
+                attrs = {attr: var.getncattr(attr) for attr in var.ncattrs()}
+                compress = bool(var.dimensions) and var.dtype != str  # not scalars or vlen
+                out = dst.createVariable(  # type: ignore[call-overload]
+                    name,
+                    var.dtype,
+                    var.dimensions,
+                    zlib=compress,
+                    complevel=complevel,
+                    shuffle=compress,
+                    chunksizes=_chunksizes(var, time_chunk) if compress else None,
+                    fill_value=attrs.pop("_FillValue", None),
+                )
+                out.set_auto_maskandscale(False)
+                out.set_auto_chartostring(False)
+                out.setncatts(attrs)
+                if not var.dimensions:
+                    out.assignValue(var.getValue())
+                    continue
+                for block in _blocks(var, time_chunk):
+                    out[block] = var[block]
+
+
+def _blocks(var: netCDF4.Variable, time_chunk: int) -> Iterator[slice]:
+    """slices along the first dimension, one chunk at the time"""
+    step = _chunksizes(var, time_chunk)[0]
+    for start in range(0, len(var.get_dims()[0]), step):
+        yield slice(start, start + step)
+
+
+def _same(a: Any, b: Any) -> bool:
+    """same dtype, shape and values, NaN included"""
+    a, b = np.asarray(a), np.asarray(b)
+    if a.dtype != b.dtype or a.shape != b.shape:
+        return False
+    if a.dtype.kind in "fc":
+        nan = np.isnan(a)
+        return bool(np.array_equal(nan, np.isnan(b)) and np.array_equal(a[~nan], b[~nan]))
+    return bool(np.array_equal(a, b))
+
+
+def _attrs(obj: netCDF4.Dataset | netCDF4.Variable) -> dict[str, Any]:
+    return {attr: obj.getncattr(attr) for attr in obj.ncattrs()}
+
+
+def _same_attrs(
+    obj: netCDF4.Dataset | netCDF4.Variable, other: netCDF4.Dataset | netCDF4.Variable
+) -> bool:
+    attrs, other_attrs = _attrs(obj), _attrs(other)
+    if attrs.keys() != other_attrs.keys():
+        return False
+    return all(_same(value, other_attrs[attr]) for attr, value in attrs.items())
+
+
+def same_data(path: Path, other: Path) -> bool:
+    """True if both files have the same dimensions, attributes, variables and stored values,
+    regardless of their format, compression or chunking"""
+    with netCDF4.Dataset(path) as a, netCDF4.Dataset(other) as b:
+        dims = {name: len(dim) for name, dim in a.dimensions.items()}
+        if dims != {name: len(dim) for name, dim in b.dimensions.items()}:
+            return False
+        if not _same_attrs(a, b) or list(a.variables) != list(b.variables):
+            return False
+        for name, var in a.variables.items():
+            other_var = b.variables[name]
+            if var.dimensions != other_var.dimensions or var.dtype != other_var.dtype:
+                return False
+            if not _same_attrs(var, other_var):
+                return False
+            for nc in (var, other_var):
+                nc.set_auto_maskandscale(False)
+                nc.set_auto_chartostring(False)
+            if not var.dimensions:
+                if not _same(var.getValue(), other_var.getValue()):
+                    return False
+                continue
+            if not all(_same(var[block], other_var[block]) for block in _blocks(var, TIME_CHUNK)):
+                return False
+    return True
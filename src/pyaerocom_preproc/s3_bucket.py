@@ -1,41 +1,704 @@
 from __future__ import annotations
 
+import json
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from functools import lru_cache
 from pathlib import Path
+from threading import Lock
+from typing import Any, Iterator, NamedTuple
 
 import boto3
-from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from dynaconf import Dynaconf
 from loguru import logger
 from typer import Abort
 
+from .checksum import HASHLIB, checksum
 from .config import config
+from .scheduler import UploadScheduler
+from .timing import timed
+
+MiB = 2**20
+
+# files larger than the threshold are uploaded in chunks, up to `max_concurrency` at the time
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * MiB,
+    multipart_chunksize=16 * MiB,
+    max_concurrency=4,
+)
+
+# number of files uploaded at the same time, at the start of a run, see `UploadScheduler`
+UPLOAD_JOBS = 8
+
+# S3 allows up to 10000 parts per multipart upload
+MAX_PARTS = 10_000
+
+# local index of the bucket listing, and state of the multipart uploads
+INDEX_PATH = Path(f"~/.cache/{__package__}/bucket_index.sqlite").expanduser()
+
+
+class S3Object(NamedTuple):
+    key: str
+    size: int | None = None  # None for common prefixes
+    etag: str = ""
+    last_modified: str = ""
+
+    def __str__(self) -> str:
+        if self.size is None:
+            return f"{'PRE':>12} {'':25} {self.key}"
+        return f"{self.size:>12} {self.last_modified:25} {self.key}"
 
 
 @lru_cache
-def s3_client(settings: Dynaconf):
+def s3_client(settings: Dynaconf, *, max_pool_connections: int = 10):
     return boto3.client(
         "s3",
         endpoint_url=settings.s3_bucket.endpoint_url,
         aws_access_key_id=settings.s3_bucket.access_key_id,
         aws_secret_access_key=settings.s3_bucket.secret_access_key,
+        config=Config(max_pool_connections=max_pool_connections),
     )
 
 
-def s3_upload(path: Path, *, object_name: str | None = None):
+def remote_checksum(client, bucket_name: str, object_name: str) -> tuple[str, str] | None:
+    """(hashlib, checksum) stored as metadata of an uploaded object, None if not found"""
+    try:
+        response = client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in {"404", "NoSuchKey"}:
+            return None
+        raise
+    metadata = response.get("Metadata", {})
+    if "hashlib" not in metadata or "checksum" not in metadata:
+        return None
+    return metadata["hashlib"], metadata["checksum"]
+
+
+def _metadata(path: Path, source: Path | None = None) -> dict[str, str]:
+    """object metadata, with the checksum of path
+
+    If source is given, e.g. a repacked copy of path which is uploaded instead,
+    the checksum of the uploaded bytes is also stored, as repacked-checksum.
+    """
+    metadata = dict(hashlib=HASHLIB, checksum=checksum(path))
+    if source is not None and source != path:
+        metadata["repacked-checksum"] = checksum(source)
+    return metadata
+
+
+def _resumable_upload(
+    client,
+    path: Path,
+    bucket_name: str,
+    object_name: str,
+    metadata: dict[str, str],
+    *,
+    transfer_config: TransferConfig = TRANSFER_CONFIG,
+    database: Path = INDEX_PATH,
+    scheduler: UploadScheduler | None = None,
+) -> None:
+    """multipart upload, which resumes an interrupted upload of the same content to object_name
+
+    The upload ID and the ETag of each part are stored on the local index as soon as
+    they are known, so a re-run only uploads the missing parts. Up to
+    `transfer_config.max_concurrency` parts of `transfer_config.multipart_chunksize` bytes
+    are uploaded at the same time, within the bandwidth of `scheduler`, if given.
+    """
+    select_upload = """
+        SELECT
+            upload_id
+        FROM
+            multipart_uploads
+        WHERE
+            bucket IS ? AND key IS ? AND checksum IS ? AND part_size IS ?;
+        """
+    select_parts = """
+        SELECT
+            part_number, etag
+        FROM
+            multipart_parts
+        WHERE
+            upload_id IS ?;
+        """
+    insert_upload = """
+        INSERT INTO multipart_uploads (upload_id, bucket, key, checksum, part_size, started)
+        VALUES (?, ?, ?, ?, ?, ?);
+        """
+    insert_part = """
+        INSERT or REPLACE INTO multipart_parts (upload_id, part_number, etag)
+        VALUES (?, ?, ?);
+        """
+    size = path.stat().st_size
+    part_size = max(transfer_config.multipart_chunksize, -(-size // MAX_PARTS))
+    # parts can only be resumed from the same bytes, which differ from path if repacked
+    uploaded_checksum = metadata.get("repacked-checksum", metadata["checksum"])
+    key = (bucket_name, object_name, uploaded_checksum, part_size)
+    db = _index_db(database)
+    with _lock:
+        row = db.execute(select_upload, key).fetchone()
+
+    upload_id: str | None = None
+    parts: dict[int, str] = {}
+    if row is not None:
+        upload_id = row[0]
+        try:
+            uploaded = _uploaded_parts(client, bucket_name, object_name, upload_id)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            _forget_upload(upload_id, database=database)  # aborted or completed elsewhere
+            upload_id = None
+        else:
+            with _lock:
+                known = db.execute(select_parts, (upload_id,)).fetchall()
+            parts = {number: etag for number, etag in known if uploaded.get(number) == etag}
+            logger.bind(path=path).info(f"resume upload, {len(parts)} parts already uploaded")
+
+    if upload_id is None:
+        response = client.create_multipart_upload(
+            Bucket=bucket_name, Key=object_name, Metadata=metadata
+        )
+        upload_id = response["UploadId"]
+        with _lock, db:
+            db.execute(insert_upload, (upload_id, *key, time.time()))
+
+    def upload_part(number: int) -> tuple[int, str]:
+        with path.open("rb") as f:
+            f.seek((number - 1) * part_size)
+            body = f.read(part_size)
+        if scheduler is not None:
+            scheduler.consume(len(body))
+        response = client.upload_part(
+            Bucket=bucket_name, Key=object_name, UploadId=upload_id, PartNumber=number, Body=body
+        )
+        return number, response["ETag"]
+
+    pending = [number for number in range(1, -(-size // part_size) + 1) if number not in parts]
+    error: Exception | None = None
+    with ThreadPoolExecutor(transfer_config.max_concurrency) as pool:
+        # record each part as soon as it is uploaded, even if other parts fail
+        for future in as_completed([pool.submit(upload_part, number) for number in pending]):
+            try:
+                number, etag = future.result()
+            except (ClientError, BotoCoreError) as e:
+                error = error or e
+                continue
+            parts[number] = etag
+            with _lock, db:
+                db.execute(insert_part, (upload_id, number, etag))
+    if error is not None:
+        raise error
+
+    client.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=object_name,
+        UploadId=upload_id,
+        MultipartUpload=dict(
+            Parts=[dict(ETag=etag, PartNumber=number) for number, etag in sorted(parts.items())]
+        ),
+    )
+    _forget_upload(upload_id, database=database)
+
+
+def _uploaded_parts(client, bucket_name: str, object_name: str, upload_id: str) -> dict[int, str]:
+    """{part_number: etag} of the parts of a multipart upload, as seen by the server"""
+    paginator = client.get_paginator("list_parts")
+    pages = paginator.paginate(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+    return {part["PartNumber"]: part["ETag"] for page in pages for part in page.get("Parts", [])}
+
+
+def _forget_upload(upload_id: str, *, database: Path = INDEX_PATH) -> None:
+    db = _index_db(database)
+    with _lock, db:
+        db.execute("DELETE FROM multipart_parts WHERE upload_id IS ?;", (upload_id,))
+        db.execute("DELETE FROM multipart_uploads WHERE upload_id IS ?;", (upload_id,))
+
+
+def abort_uploads(
+    *, older_than: float = 24 * 3600, prefix: str = "", database: Path = INDEX_PATH
+) -> int:
+    """abort multipart uploads under prefix started more than `older_than` seconds ago,
+    returns the number of uploads aborted
+
+    The parts of incomplete uploads are kept (and billed) on the bucket until aborted,
+    but aborted uploads can not be resumed.
+    """
+    if (settings := config()) is None:
+        raise Abort()
+    client = s3_client(settings)
+    bucket_name = settings.s3_bucket.bucket_name
+    started = time.time() - older_than
+
+    aborted = 0
+    paginator = client.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for upload in page.get("Uploads", []):
+            if upload["Initiated"].timestamp() > started:
+                continue
+            try:
+                client.abort_multipart_upload(
+                    Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"]
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "NoSuchUpload":
+                    raise
+            _forget_upload(upload["UploadId"], database=database)
+            logger.debug(f"aborted upload of {upload['Key']}")
+            aborted += 1
+    return aborted
+
+
+def s3_upload(
+    path: Path,
+    *,
+    object_name: str | None = None,
+    max_pool_connections: int = 10,
+    transfer_config: TransferConfig = TRANSFER_CONFIG,
+    database: Path = INDEX_PATH,
+    scheduler: UploadScheduler | None = None,
+    source: Path | None = None,
+) -> bool:
+    """upload a single file, returns True if the upload succeeded
+
+    The file checksum is stored as object metadata,
+    and the upload is skipped if the object already has the same checksum.
+    If `source` is given: upload its content instead, e.g. a repacked copy of path,
+    the object keeps the checksum of path, see `_metadata`.
+    Files larger than `transfer_config.multipart_threshold` are uploaded in parts,
+    and interrupted uploads are resumed, see `_resumable_upload`.
+    If `scheduler` is given: wait for a free slot, within its bandwidth,
+    and retry throttled uploads, see `UploadScheduler`.
+    """
     if (settings := config()) is None:
         raise Abort()
     if object_name is None:
         object_name = path.name
+    client = s3_client(settings, max_pool_connections=max_pool_connections)
+    bucket_name = settings.s3_bucket.bucket_name
+    if source is None:
+        source = path
     try:
-        s3_client(settings).upload_file(path, settings.s3_bucket.bucket_name, object_name)
+        with timed("upload", path) as stage:
+            if remote_checksum(client, bucket_name, object_name) == (HASHLIB, checksum(path)):
+                logger.bind(path=path).debug("already uploaded, skip")
+                return True
+            metadata = _metadata(path, source)
+            stage.bytes = size = source.stat().st_size
+
+            def upload() -> None:
+                if size >= transfer_config.multipart_threshold:
+                    _resumable_upload(
+                        client,
+                        source,
+                        bucket_name,
+                        object_name,
+                        metadata,
+                        transfer_config=transfer_config,
+                        database=database,
+                        scheduler=scheduler,
+                    )
+                else:
+                    client.upload_file(
+                        str(source),
+                        bucket_name,
+                        object_name,
+                        ExtraArgs=dict(Metadata=metadata),
+                        Config=transfer_config,
+                        Callback=scheduler.consume if scheduler is not None else None,
+                    )
+
+            if scheduler is None:
+                upload()
+            else:
+                scheduler.run(upload, size)
+    except (ClientError, BotoCoreError, S3UploadFailedError) as e:
+        logger.bind(path=path).error(f"{e}, skip")
+        return False
+    return True
+
+
+def s3_upload_many(
+    uploads: dict[Path, str],
+    *,
+    jobs: int | None = None,
+    max_rate: float | None = None,
+    sources: dict[Path, Path] | None = None,
+    transfer_config: TransferConfig = TRANSFER_CONFIG,
+) -> list[Path]:
+    """upload {path: object_name}, starting with `jobs` files at the same time
+    (default `UPLOAD_JOBS`), returns the files which failed to upload
+
+    Files with a {path: source} are uploaded from source, e.g. a repacked copy, see `s3_upload`.
+
+    The concurrency adapts to the throughput and throttling, and all uploads together send
+    at most `max_rate` bytes/s, if given, see `UploadScheduler`. All uploads share a client
+    with enough connections for the most files at the same time
+    and `transfer_config.max_concurrency` multipart chunks per file.
+    """
+    if config() is None:
+        raise Abort()
+    scheduler = UploadScheduler(jobs or UPLOAD_JOBS, max_rate=max_rate)
+    max_pool_connections = scheduler.max_jobs * transfer_config.max_concurrency
+
+    def upload(path: Path) -> bool:
+        return s3_upload(
+            path,
+            object_name=uploads[path],
+            max_pool_connections=max_pool_connections,
+            transfer_config=transfer_config,
+            scheduler=scheduler,
+            source=sources.get(path) if sources else None,
+        )
+
+    with ThreadPoolExecutor(scheduler.max_jobs) as pool:
+        failed = [path for path, ok in zip(uploads, pool.map(upload, uploads)) if not ok]
+
+    if (report := scheduler.report()).files:
+        logger.info(report)
+    if failed:
+        logger.error(f"{len(failed)} of {len(uploads)} uploads failed, skip")
+
+    return failed
+
+
+class StagedUpload:
+    """upload files to a staging prefix as soon as they are ready, e.g. while other files
+    are still being checked, and then promote all of them at once, or none of them
+
+    Files are promoted to their final object name with server-side copies,
+    and the staging prefix is always cleaned up. Files whose final object already has
+    the same checksum are neither staged nor copied. The staged uploads share
+    an `UploadScheduler`, with the same `jobs` and `max_rate` as `s3_upload_many`.
+
+        with StagedUpload("data_set/staging/run") as staging:
+            for path in files:
+                staging.submit(path, f"data_set/download/{path.name}")
+            failed = staging.promote()  # without promote, nothing is published
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        *,
+        jobs: int | None = None,
+        max_rate: float | None = None,
+        transfer_config: TransferConfig = TRANSFER_CONFIG,
+    ):
+        if (settings := config()) is None:
+            raise Abort()
+        self.prefix = prefix.rstrip("/")
+        self.bucket_name = settings.s3_bucket.bucket_name
+        self.transfer_config = transfer_config
+        self.scheduler = UploadScheduler(jobs or UPLOAD_JOBS, max_rate=max_rate)
+        self.max_pool_connections = self.scheduler.max_jobs * transfer_config.max_concurrency
+        self.client = s3_client(settings, max_pool_connections=self.max_pool_connections)
+        self._pool = ThreadPoolExecutor(self.scheduler.max_jobs)
+        self._staged: dict[Path, Future[bool | None]] = {}
+        self._object_names: dict[Path, str] = {}
+        self._sources: dict[Path, Path] = {}
+        self._promoted = False
+
+    def staging_key(self, object_name: str) -> str:
+        return f"{self.prefix}/{object_name}"
+
+    def _stage(self, path: Path) -> bool | None:
+        """True if uploaded to staging, None if the final object is already up to date"""
+        object_name = self._object_names[path]
+        metadata = (HASHLIB, checksum(path))
+        try:
+            if remote_checksum(self.client, self.bucket_name, object_name) == metadata:
+                logger.bind(path=path).debug("already uploaded, skip")
+                return None
+        except (ClientError, BotoCoreError) as e:
+            logger.bind(path=path).error(f"{e}, skip")
+            return False
+        return s3_upload(
+            path,
+            object_name=self.staging_key(object_name),
+            max_pool_connections=self.max_pool_connections,
+            transfer_config=self.transfer_config,
+            scheduler=self.scheduler,
+            source=self._sources.get(path),
+        )
+
+    def submit(self, path: Path, object_name: str, *, source: Path | None = None) -> None:
+        """start uploading path to staging, to be promoted as object_name
+
+        If `source` is given: upload its content instead, e.g. a repacked copy of path.
+        """
+        self._object_names[path] = object_name
+        if source is not None:
+            self._sources[path] = source
+        self._staged[path] = self._pool.submit(self._stage, path)
+
+    def _copy(self, path: Path) -> bool:
+        object_name = self._object_names[path]
+        metadata = _metadata(path, self._sources.get(path))
+        try:
+            with timed("promote", path):
+                self.client.copy(
+                    dict(Bucket=self.bucket_name, Key=self.staging_key(object_name)),
+                    self.bucket_name,
+                    object_name,
+                    # multipart copies do not carry over the metadata
+                    ExtraArgs=dict(Metadata=metadata, MetadataDirective="REPLACE"),
+                    Config=self.transfer_config,
+                )
+        except (ClientError, BotoCoreError) as e:
+            logger.bind(path=path).error(f"{e}, skip")
+            return False
+        return True
+
+    def promote(self) -> list[Path]:
+        """wait for the staged uploads and copy them to their final object names,
+        returns the files which failed
+
+        Nothing is promoted if any of the staged uploads failed.
+        """
+        staged = {path: future.result() for path, future in self._staged.items()}
+        if (report := self.scheduler.report()).files:
+            logger.info(report)
+        if failed := [path for path, ok in staged.items() if ok is False]:
+            logger.error(f"{len(failed)} of {len(staged)} uploads failed, skip")
+            return failed
+
+        copies = [path for path, ok in staged.items() if ok]
+        failed = [path for path, ok in zip(copies, self._pool.map(self._copy, copies)) if not ok]
+        if failed:
+            logger.error(f"{len(failed)} of {len(copies)} promotions failed, skip")
+        self._promoted = True
+        return failed
+
+    def cleanup(self) -> None:
+        """cancel pending uploads, and delete everything under the staging prefix"""
+        for future in self._staged.values():
+            future.cancel()
+        self._pool.shutdown()
+        try:
+            keys = [obj.key for obj in s3_objects(prefix=f"{self.prefix}/")]
+            for start in range(0, len(keys), 1000):  # up to 1000 keys per request
+                objects = [dict(Key=key) for key in keys[start : start + 1000]]
+                self.client.delete_objects(Bucket=self.bucket_name, Delete=dict(Objects=objects))
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"{e}, skip")
+            return
+        if keys and not self._promoted:
+            logger.warning(f"removed {len(keys)} staged files from {self.prefix}/")
+
+    def __enter__(self) -> StagedUpload:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.cleanup()
+
+
+def read_manifest(object_name: str) -> tuple[dict[str, Any], str | None]:
+    """JSON manifest stored on the bucket and its ETag, ({}, None) if not found"""
+    if (settings := config()) is None:
+        raise Abort()
+    client = s3_client(settings)
+    try:
+        response = client.get_object(Bucket=settings.s3_bucket.bucket_name, Key=object_name)
     except ClientError as e:
+        if e.response["Error"]["Code"] in {"404", "NoSuchKey"}:
+            return {}, None
+        raise
+    return json.loads(response["Body"].read()), response["ETag"]
+
+
+def write_manifest(object_name: str, manifest: dict[str, Any], *, etag: str | None) -> bool:
+    """replace the manifest, if it did not change since it was read with `etag`,
+    returns True if the manifest was replaced
+
+    The manifest is written with a single PUT, so readers see either the old or the new one.
+    """
+    if (settings := config()) is None:
+        raise Abort()
+    client = s3_client(settings)
+    bucket_name = settings.s3_bucket.bucket_name
+    try:
+        try:
+            current = client.head_object(Bucket=bucket_name, Key=object_name)["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in {"404", "NoSuchKey"}:
+                raise
+            current = None
+        if current != etag:
+            logger.error(f"{object_name} changed since it was read, skip")
+            return False
+        client.put_object(
+            Bucket=bucket_name,
+            Key=object_name,
+            Body=json.dumps(manifest, indent=2, sort_keys=True).encode(),
+            ContentType="application/json",
+        )
+    except (ClientError, BotoCoreError) as e:
         logger.error(f"{e}, skip")
+        return False
+    return True
 
 
-def s3_list():
+def s3_objects(
+    *, prefix: str = "", delimiter: str = "", page_size: int = 1000
+) -> Iterator[S3Object]:
+    """stream objects, and common prefixes if `delimiter` is given, one listing page at the time"""
     if (settings := config()) is None:
         raise Abort()
-    objects = s3_client(settings).list_objects_v2(Bucket=settings.s3_bucket.bucket_name)
-    for obj in objects["Contents"]:
-        print(obj["Key"])
+    paginator = s3_client(settings).get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=settings.s3_bucket.bucket_name,
+        Prefix=prefix,
+        Delimiter=delimiter,
+        PaginationConfig=dict(PageSize=page_size),
+    )
+    for page in pages:
+        objects = [
+            S3Object(
+                obj["Key"], obj["Size"], obj["ETag"].strip('"'), obj["LastModified"].isoformat()
+            )
+            for obj in page.get("Contents", [])
+        ]
+        objects.extend(S3Object(obj["Prefix"]) for obj in page.get("CommonPrefixes", []))
+        yield from sorted(objects)
+
+
+_lock = Lock()
+
+
+@lru_cache
+def _index_db(database: Path) -> sqlite3.Connection:
+    """long-lived connection to the bucket index, create db and tables if needed
+
+    The connection is shared by the upload threads, which serialize their writes with `_lock`.
+    """
+    if not database.exists():
+        database.parent.mkdir(parents=True, exist_ok=True)
+        database.parent.chmod(0o700)  # only user has read/write/execute permissions
+
+    db = sqlite3.connect(database, check_same_thread=False)
+    db.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS objects (
+            bucket        TEXT NOT NULL,
+            key           TEXT NOT NULL,
+            size          INTEGER NOT NULL,
+            etag          TEXT NOT NULL,
+            last_modified TEXT NOT NULL,
+            listed        REAL NOT NULL,
+            PRIMARY KEY(bucket, key)
+        );
+        CREATE TABLE IF NOT EXISTS multipart_uploads (
+            upload_id     TEXT PRIMARY KEY,
+            bucket        TEXT NOT NULL,
+            key           TEXT NOT NULL,
+            checksum      TEXT NOT NULL,
+            part_size     INTEGER NOT NULL,
+            started       REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS multipart_uploads_key
+            ON multipart_uploads (bucket, key, checksum);
+        CREATE TABLE IF NOT EXISTS multipart_parts (
+            upload_id     TEXT NOT NULL,
+            part_number   INTEGER NOT NULL,
+            etag          TEXT NOT NULL,
+            PRIMARY KEY(upload_id, part_number)
+        );
+        """
+    )
+    return db
+
+
+def _key_range(prefix: str) -> tuple[str, str]:
+    """all keys starting with prefix are between these bounds, and can use the primary key"""
+    return prefix, f"{prefix}\U0010ffff"
+
+
+def refresh_index(*, prefix: str = "", page_size: int = 1000, database: Path = INDEX_PATH) -> int:
+    """re-list the objects under prefix into the local index, returns the number of objects
+
+    Objects outside prefix are left untouched, so the index can be refreshed one prefix at the time.
+    """
+    if (settings := config()) is None:
+        raise Abort()
+    bucket = settings.s3_bucket.bucket_name
+    listed = time.time()
+
+    insert = """
+        INSERT or REPLACE INTO objects (bucket, key, size, etag, last_modified, listed)
+        VALUES (?, ?, ?, ?, ?, ?);
+        """
+    delete = """
+        DELETE FROM objects
+        WHERE
+            bucket IS ? AND key >= ? AND key < ? AND listed < ?;
+        """
+    count = 0
+    db = _index_db(database)
+    with db:
+        for obj in s3_objects(prefix=prefix, page_size=page_size):
+            db.execute(insert, (bucket, *obj, listed))
+            count += 1
+        db.execute(delete, (bucket, *_key_range(prefix), listed))
+    logger.debug(f"indexed {count} objects under '{prefix}'")
+    return count
+
+
+def indexed_objects(
+    *, prefix: str = "", delimiter: str = "", database: Path = INDEX_PATH
+) -> Iterator[S3Object]:
+    """stream objects from the local index, with the same ordering and filters as `s3_objects`"""
+    if (settings := config()) is None:
+        raise Abort()
+
+    select = """
+        SELECT
+            key, size, etag, last_modified
+        FROM
+            objects
+        WHERE
+            bucket IS ? AND key >= ? AND key < ?
+        ORDER BY
+            key;
+        """
+    common_prefix = None
+    cursor = _index_db(database).execute(
+        select, (settings.s3_bucket.bucket_name, *_key_range(prefix))
+    )
+    for obj in map(S3Object._make, cursor):
+        rest = obj.key[len(prefix) :]
+        if delimiter and delimiter in rest:
+            # keys sharing a common prefix are contiguous in sorted order
+            if (key := prefix + rest.split(delimiter, 1)[0] + delimiter) != common_prefix:
+                common_prefix = key
+                yield S3Object(key)
+            continue
+        yield obj
+
+
+def s3_list(
+    *,
+    prefix: str = "",
+    delimiter: str = "",
+    index: bool = False,
+    refresh: bool = False,
+    long: bool = False,
+):
+    """print objects from the bucket listing, or from the local index
+
+    If `refresh` is True: update the local index under prefix before printing from it.
+    """
+    if refresh:
+        refresh_index(prefix=prefix)
+    if index or refresh:
+        objects = indexed_objects(prefix=prefix, delimiter=delimiter)
+    else:
+        objects = s3_objects(prefix=prefix, delimiter=delimiter)
+    for obj in objects:
+        print(obj if long else obj.key)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import random
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Callable, Iterator, NamedTuple
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+from loguru import logger
+
+__all__ = ["UploadReport", "UploadScheduler", "is_throttled"]
+
+# error codes of throttled requests, retried with a lower concurrency
+THROTTLING_CODES = {
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequests",
+}
+
+
+def is_throttled(error: BaseException) -> bool:
+    """throttling and 5xx responses, which should be retried later and with fewer connections"""
+    if isinstance(error, S3UploadFailedError):  # upload_file wraps the ClientError
+        error = error.__context__ or error
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get("Error", {}).get("Code", "")
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    if code.isdigit():  # e.g. "503", from responses without an error body
+        status = status or int(code)
+    return code in THROTTLING_CODES or status == 429 or status >= 500
+
+
+class UploadReport(NamedTuple):
+    files: int
+    bytes: int
+    seconds: float  # from the start of the first upload to the end of the last one
+    retries: int
+    jobs: int  # concurrency at the end of the run
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / self.seconds / 1e6 if self.seconds > 0 else 0
+
+    def __str__(self) -> str:
+        return (
+            f"uploaded {self.files} files, {self.bytes / 1e6:.1f} MB in {self.seconds:.1f}s, "
+            f"{self.mb_per_s:.1f} MB/s, {self.retries} retries, {self.jobs} jobs"
+        )
+
+
+class UploadScheduler:
+    """share the uplink between the uploads of a run
+
+    Up to `jobs` files are uploaded at the same time, adapted between 1 and `max_jobs`
+    (default 2 * jobs): after each round of `jobs` uploads, the concurrency moves one step
+    in the same direction while the throughput grows, and turns around when it drops.
+    Throttled (429, SlowDown) and 5xx uploads halve the concurrency, and are retried
+    up to `retries` times after an exponential backoff with full jitter.
+    If `max_rate` is given: all uploads together send at most `max_rate` bytes/s.
+
+        scheduler = UploadScheduler(8, max_rate=10e6)
+        scheduler.run(lambda: client.upload_file(..., Callback=scheduler.consume), size)
+        logger.info(scheduler.report())
+    """
+
+    def __init__(
+        self,
+        jobs: int = 8,
+        *,
+        max_jobs: int | None = None,
+        max_rate: float | None = None,
+        retries: int = 5,
+        backoff: float = 1,
+        max_backoff: float = 60,
+    ):
+        if max_jobs is None:
+            max_jobs = 2 * jobs
+        if not 1 <= jobs <= max_jobs:
+            raise ValueError(f"expected 1 <= {jobs=} <= {max_jobs=}")
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError(f"expected a positive {max_rate=}")
+        self.jobs = jobs
+        self.max_jobs = max_jobs
+        self.max_rate = max_rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._slots = Condition()
+        self._active = 0
+        self._step = 1  # direction of the next concurrency change
+        self._round = (0, 0, time.monotonic())  # (files, bytes, start) since the last change
+        self._rate: float | None = None  # throughput of the previous round [bytes/s]
+
+        self._tokens_lock = Lock()
+        self._tokens = 0.0  # bytes which can be sent without waiting, negative when in debt
+        self._refilled = time.monotonic()
+
+        self._files = self._bytes = self._retries = 0
+        self._start: float | None = None
+        self._end: float | None = None
+
+    def consume(self, nbytes: int) -> None:
+        """wait until nbytes can be sent without going over `max_rate`, e.g. as upload callback
+
+        Tokens refill at `max_rate` bytes/s, up to one second worth of them.
+        Concurrent callers queue behind each other, so the aggregate rate is capped.
+        """
+        if self.max_rate is None or nbytes <= 0:  # transfers report negative bytes on retries
+            return
+        with self._tokens_lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.max_rate, self._tokens + (now - self._refilled) * self.max_rate
+            )
+            self._refilled = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.max_rate
+        if wait > 0:
+            time.sleep(wait)
+
+    @contextmanager
+    def _slot(self) -> Iterator[None]:
+        with self._slots:
+            self._slots.wait_for(lambda: self._active < self.jobs)
+            self._active += 1
+            if self._start is None:
+                self._start = time.monotonic()
+                self._round = (0, 0, self._start)
+        try:
+            yield
+        finally:
+            with self._slots:
+                self._active -= 1
+                self._slots.notify_all()
+
+    def _adapt(self, rate: float) -> None:
+        """move the concurrency one step, after a round of uploads at `rate` bytes/s"""
+        if self._rate is not None and rate < self._rate:
+            self._step = -self._step
+        if self.max_rate is not None and rate >= 0.9 * self.max_rate:
+            self._step = min(self._step, 0)  # capped, more connections would not help
+        self.jobs = min(max(self.jobs + self._step, 1), self.max_jobs)
+        self._step = self._step or 1
+        self._rate = rate
+
+    def _done(self, nbytes: int) -> None:
+        with self._slots:
+            now = self._end = time.monotonic()
+            self._files += 1
+            self._bytes += nbytes
+            files, total, start = self._round
+            files, total = files + 1, total + nbytes
+            if files < self.jobs:
+                self._round = (files, total, start)
+                return
+            if now > start:
+                self._adapt(total / (now - start))
+            self._round = (0, 0, now)
+            self._slots.notify_all()
+
+    def _throttled(self) -> None:
+        with self._slots:
+            self._retries += 1
+            self.jobs = max(self.jobs // 2, 1)
+            self._step, self._rate = 1, None
+            self._round = (0, 0, time.monotonic())
+
+    def run(self, upload: Callable[[], None], nbytes: int) -> None:
+        """call upload once a slot is free, and retry it while throttled
+
+        Errors which are not throttling, or still throttled after `retries`, are raised.
+        """
+        for attempt in range(self.retries + 1):
+            with self._slot():
+                try:
+                    upload()
+                except Exception as e:
+                    if not is_throttled(e) or attempt == self.retries:
+                        raise
+                    self._throttled()
+                else:
+                    self._done(nbytes)
+                    return
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+            logger.debug(f"throttled, retry in {delay:.1f}s with {self.jobs} jobs")
+            time.sleep(delay)
+
+    def report(self) -> UploadReport:
+        """files and bytes uploaded so far, and the achieved throughput"""
+        with self._slots:
+            seconds = 0.0
+            if self._start is not None and self._end is not None:
+                seconds = self._end - self._start
+            return UploadReport(self._files, self._bytes, seconds, self._retries, self.jobs)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from .check_obs import _check_all, _passed
+from .checksum import HASHLIB, checksum
+from .reader import Engine
+from .s3_bucket import read_manifest, write_manifest
+from .upload import _filename_year, _repack, _upload
+
+__all__ = ["sync_obs"]
+
+# manifest of the published files, under {data_set}/ on the bucket
+MANIFEST = "manifest.json"
+
+
+def _manifest_entry(data_set: str, path: Path, *, passed: bool) -> dict[str, Any] | None:
+    """year, size, checksum and check status of a file"""
+    if (year := _filename_year(data_set, path)) is None:
+        return None
+    return dict(year=year, size=path.stat().st_size, checksum=checksum(path), passed=passed)
+
+
+def sync_obs(
+    data_set: str,
+    files: list[Path],
+    *,
+    strict_checksum: bool = False,
+    jobs: int = 1,
+    upload_jobs: int | None = None,
+    max_rate: float | None = None,
+    engine: Engine = "xarray",
+    dry_run: bool = False,
+    repack: bool = False,
+):
+    """Publish files which passed the checks, and are new or changed since the last sync
+
+    A manifest of the published files, with their size, checksum and check status,
+    is kept on the bucket as `{data_set}/manifest.json`. Only the files which differ
+    from the remote manifest are uploaded, then the remote manifest is replaced.
+    If `dry_run` is True: only report the files which would be uploaded.
+    If `repack` is True: upload compressed copies of the files, see `upload._repacked`,
+    the size and checksum of the uploaded copies are also kept on the manifest.
+    """
+    if strict_checksum:
+        for path in files:
+            checksum(path, strict=True)
+    _check_all(data_set, files, jobs=jobs, engine=engine)
+
+    local = {
+        path: entry
+        for path, passed in _passed(files).items()
+        if (entry := _manifest_entry(data_set, path, passed=passed))
+    }
+    object_name = f"{data_set}/{MANIFEST}"
+    remote, etag = read_manifest(object_name)
+    published: dict[str, dict[str, Any]] = remote.get("files", {})
+    same_hashlib = remote.get("hashlib", HASHLIB) == HASHLIB
+    if not same_hashlib:
+        logger.warning(f"{object_name} checksums from {remote['hashlib']}, compare all files")
+
+    def changed(path: Path, entry: dict[str, Any]) -> bool:
+        """compared without the repacked copy, which can change with the repack settings"""
+        published_entry = published.get(path.name, {})
+        return {key: value for key, value in published_entry.items() if key != "repacked"} != entry
+
+    delta = [
+        path
+        for path, entry in local.items()
+        if entry["passed"] and (not same_hashlib or changed(path, entry))
+    ]
+    logger.info(f"{len(delta)} of {len(local)} files are new or changed")
+    if dry_run:
+        for path in delta:
+            logger.bind(path=path).info("would upload")
+        return
+    if not delta:
+        return
+
+    sources = _repack(delta) if repack else {}
+    for path, source in sources.items():
+        if source != path:
+            local[path]["repacked"] = dict(size=source.stat().st_size, checksum=checksum(source))
+
+    failed = set(_upload(data_set, delta, jobs=upload_jobs, max_rate=max_rate, sources=sources))
+    published.update((path.name, local[path]) for path in delta if path not in failed)
+    manifest = dict(
+        data_set=data_set,
+        hashlib=HASHLIB,
+        updated=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        files=published,
+    )
+    if write_manifest(object_name, manifest, etag=etag):
+        logger.success(f"{object_name} updated, {len(published)} files published")
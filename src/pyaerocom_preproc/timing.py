@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+try:  # pragma: no cover
+    from resource import RUSAGE_SELF, getrusage
+
+    def _max_rss() -> int:
+        return getrusage(RUSAGE_SELF).ru_maxrss
+
+except ModuleNotFoundError:  # pragma: no cover, e.g. on Windows
+
+    def _max_rss() -> int:
+        return 0
+
+
+__all__ = ["Timing", "enable", "enabled", "timed", "records", "extend", "summary", "print_summary"]
+
+# bytes read by the process, including reads served from the page cache (Linux only)
+PROC_IO = Path("/proc/self/io")
+
+
+class Timing(NamedTuple):
+    path: str
+    stage: str
+    seconds: float
+    bytes: int  # bytes read during the stage
+    max_rss: int  # peak resident set size of the process [KiB], at the end of the stage
+
+
+class Stage:
+    """mutable handle yielded by `timed`, e.g. to report the bytes read explicitly"""
+
+    bytes: int | None = None
+
+
+# timings recorded on this process, see `records`
+_records: list[Timing] = []
+
+# stages are only timed after `enable`, so the hot path pays nothing by default
+_enabled = False
+
+
+def enable(enabled: bool = True) -> None:
+    """start/stop recording timings on this process"""
+    global _enabled
+    _enabled = enabled
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _read_bytes() -> int:
+    try:
+        with PROC_IO.open() as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:  # pragma: no cover
+        pass
+    return 0
+
+
+@contextmanager
+def timed(stage: str, path: Path | None = None) -> Iterator[Stage]:
+    """record elapsed time, bytes read and peak RSS of a stage for path
+
+    Bytes read are taken from /proc/self/io, unless the stage sets `Stage.bytes`,
+    e.g. for memory mapped or threaded reads, which /proc/self/io does not attribute.
+    """
+    handle = Stage()
+    if not _enabled:
+        yield handle
+        return
+
+    start, read = time.perf_counter(), _read_bytes()
+    try:
+        yield handle
+    finally:
+        seconds = time.perf_counter() - start
+        nbytes = handle.bytes if handle.bytes is not None else _read_bytes() - read
+        _records.append(Timing(str(path or ""), stage, seconds, nbytes, _max_rss()))
+
+
+def records(*, clear: bool = False) -> list[Timing]:
+    """timings recorded on this process, in order"""
+    timings = list(_records)
+    if clear:
+        _records.clear()
+    return timings
+
+
+def extend(timings: list[Timing]) -> None:
+    """add timings recorded elsewhere, e.g. on a worker process"""
+    _records.extend(Timing._make(timing) for timing in timings)
+
+
+class StageSummary(NamedTuple):
+    stage: str
+    calls: int
+    seconds: float
+    max_seconds: float
+    bytes: int
+
+
+def summary(timings: list[Timing]) -> list[StageSummary]:
+    """total per stage, slowest stage first"""
+    stages: dict[str, list[Timing]] = defaultdict(list)
+    for timing in timings:
+        stages[timing.stage].append(timing)
+    result = [
+        StageSummary(
+            stage,
+            len(group),
+            sum(t.seconds for t in group),
+            max(t.seconds for t in group),
+            sum(t.bytes for t in group),
+        )
+        for stage, group in stages.items()
+    ]
+    return sorted(result, key=lambda s: s.seconds, reverse=True)
+
+
+def print_summary(timings: list[Timing]) -> None:
+    """table with the time spent on each stage, and the peak RSS"""
+    print(
+        f"{'stage':<32} {'calls':>6} {'total [s]':>10} {'mean [ms]':>10} {'max [ms]':>10} {'read [MB]':>10}"
+    )
+    for s in summary(timings):
+        print(
+            f"{s.stage:<32} {s.calls:>6} {s.seconds:>10.3f} {s.seconds / s.calls * 1e3:>10.2f} "
+            f"{s.max_seconds * 1e3:>10.2f} {s.bytes / 1e6:>10.2f}"
+        )
+    if timings:
+        print(f"peak RSS {max(t.max_rss for t in timings) / 1024:.1f} MiB")
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Callable
+from uuid import uuid4
+
+from loguru import logger
+
+from .check_obs import REGISTERED_CHECKERS, _collect
+from .checksum import checksum
+from .repack import REPACK_PATH
+from .repack import repack as repack_netcdf
+from .repack import same_data
+from .s3_bucket import StagedUpload, s3_upload_many
+from .timing import timed
+
+
+def _filename_year(data_set: str, path: Path) -> int | None:
+    regex = re.compile(rf"{data_set}-.*-(?P<year>\d\d\d\d).nc")
+    if (match := regex.search(path.name)) is None:
+        logger.bind(path=path).error(f"could not infer year from filename, skip")
+        return None
+    return int(match.group("year"))
+
+
+def _object_name(data_set: str, path: Path) -> str | None:
+    """{data_set}/download/{year}/{filename}, with the year from the filename"""
+    if (year := _filename_year(data_set, path)) is None:
+        return None
+    return f"{data_set}/download/{year}/{path.name}"
+
+
+def _upload(
+    data_set: str,
+    files: list[Path],
+    *,
+    jobs: int | None = None,
+    max_rate: float | None = None,
+    sources: dict[Path, Path] | None = None,
+) -> list[Path]:
+    """upload files to {data_set}/download/{year}/, with the year from the filename,
+    returns the files which were not uploaded
+
+    Files with a {path: source} are uploaded from source, see `_repack`.
+    The repacked copies are removed once uploaded.
+    """
+    uploads: dict[Path, str] = {}
+    failed: list[Path] = []
+    for path in files:
+        if (object_name := _object_name(data_set, path)) is None:
+            failed.append(path)
+        else:
+            uploads[path] = object_name
+
+    failed_uploads = s3_upload_many(uploads, jobs=jobs, max_rate=max_rate, sources=sources)
+    if not failed_uploads:
+        logger.success("uploaded files 🚀")
+    if sources:
+        _forget_repacked([path for path in uploads if path not in failed_uploads])
+    return failed + failed_uploads
+
+
+def _repacked(path: Path) -> Path:
+    """compressed netCDF4 copy of path, if it is smaller and holds the same data,
+    otherwise path itself
+
+    The copy must have the same stored values as path, see `repack.same_data`,
+    and pass all the registered checkers. Verified copies are kept under `REPACK_PATH`,
+    by checksum of path, until they are uploaded, see `_forget_repacked`.
+    """
+    output = REPACK_PATH / f"{checksum(path)}.nc"
+    if not output.exists():
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output.with_suffix(".tmp.nc")
+        try:
+            with timed("repack", path):
+                repack_netcdf(path, tmp)
+            with timed("repack:verify", path):
+                same = same_data(path, tmp)
+                _, errors = _collect(tmp, REGISTERED_CHECKERS, timed_as=path)
+        except (OSError, ValueError) as e:
+            tmp.unlink(missing_ok=True)
+            logger.bind(path=path).warning(f"{e}, upload as it is")
+            return path
+        if not same or errors:
+            tmp.unlink(missing_ok=True)
+            logger.bind(path=path).warning("repacked data differs, upload as it is")
+            return path
+        tmp.replace(output)
+
+    if output.stat().st_size >= path.stat().st_size:
+        logger.bind(path=path).debug("repacked file is not smaller, upload as it is")
+        return path
+    return output
+
+
+def _repack(files: list[Path]) -> dict[Path, Path]:
+    """{path: smallest of path and its repacked copy}, see `_repacked`"""
+    sources = {path: _repacked(path) for path in files}
+    if repacked := [path for path, source in sources.items() if source != path]:
+        before = sum(path.stat().st_size for path in repacked)
+        after = sum(sources[path].stat().st_size for path in repacked)
+        logger.info(
+            f"repacked {len(repacked)} of {len(files)} files, "
+            f"{before / 1e6:.1f} MB to {after / 1e6:.1f} MB"
+        )
+    return sources
+
+
+def _forget_repacked(files: list[Path]) -> None:
+    for path in files:
+        (REPACK_PATH / f"{checksum(path)}.nc").unlink(missing_ok=True)
+
+
+def _pipelined(
+    data_set: str,
+    files: list[Path],
+    check_all: Callable[..., bool],
+    *,
+    jobs: int | None = None,
+    max_rate: float | None = None,
+    repack: bool = False,
+) -> list[Path]:
+    """check files with `check_all` and upload them to a staging prefix as soon as they pass,
+    returns the files which were not published
+
+    The staged files are promoted to `{data_set}/download/{year}/` with server-side copies
+    only if all files passed and were staged, so readers never see a partial data set
+    from a failed run. The staging prefix is removed in any case.
+    If `repack` is True: stage the repacked copies of the files, see `_repacked`.
+    """
+    unnamed: list[Path] = []
+    staged: list[Path] = []
+
+    with StagedUpload(
+        f"{data_set}/staging/{uuid4().hex}", jobs=jobs, max_rate=max_rate
+    ) as staging:
+
+        def stage(path: Path) -> None:
+            if (object_name := _object_name(data_set, path)) is None:
+                unnamed.append(path)
+            else:
+                staging.submit(path, object_name, source=_repacked(path) if repack else None)
+                staged.append(path)
+
+        try:
+            if not check_all(data_set, files, on_pass=stage) or unnamed:
+                return files
+
+            if failed := staging.promote():
+                return failed
+        finally:
+            if repack:
+                _forget_repacked(staged)
+
+    logger.success("uploaded files 🚀")
+    return []
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from .check_obs import _check_all, _passed
+from .checksum import checksum
+from .error_db import WatchedFile, read_watched, write_watched
+from .reader import Engine
+from .upload import _repack, _upload
+
+__all__ = ["watch_obs"]
+
+
+def _scan(directory: Path, data_set: str) -> dict[Path, tuple[int, int]]:
+    """(size, mtime_ns) of the data_set files under directory, without opening them"""
+    with os.scandir(directory) as entries:
+        return {
+            Path(entry.path): (stat.st_size, stat.st_mtime_ns)
+            for entry in entries
+            if entry.name.startswith(data_set)
+            and entry.name.endswith(".nc")
+            and entry.is_file()
+            and (stat := entry.stat())
+        }
+
+
+def watch_obs(
+    data_set: str,
+    directory: Path,
+    *,
+    interval: float = 10,
+    settle: float = 30,
+    upload: bool = False,
+    jobs: int = 1,
+    upload_jobs: int | None = None,
+    max_rate: float | None = None,
+    engine: Engine = "xarray",
+    iterations: int | None = None,
+    repack: bool = False,
+):
+    """Poll directory for new or modified data_set files, check them, and upload the files
+    once all the files in directory passed, if `upload` is True.
+
+    Files are only checked after they have not changed for `settle` seconds,
+    so partially written files are not checked.
+    The size and modification time of the files seen are kept on the DB,
+    so after a restart only new or modified files are checked.
+    Stop after `iterations` polls, every `interval` seconds, or run until interrupted.
+    If `repack` is True: upload compressed copies of the files, see `upload._repacked`.
+    """
+    logger.bind(path=directory).info(f"watching {data_set} files")
+    previous: dict[Path, tuple[int, int]] = {}
+    iteration = 0
+    while True:
+        state = read_watched(directory)
+        current = _scan(directory, data_set)
+
+        def known(path: Path) -> WatchedFile | None:
+            """state from a previous check, if the file did not change since"""
+            if (file := state.get(path.resolve())) is None:
+                return None
+            return file if (file.size, file.mtime_ns) == current[path] else None
+
+        now = time.time_ns()
+        ready = [
+            path
+            for path, (size, mtime_ns) in sorted(current.items())
+            if known(path) is None
+            and previous.get(path, (size, mtime_ns)) == (size, mtime_ns)
+            and now - mtime_ns >= settle * 1e9
+        ]
+        previous = current
+
+        if ready:
+            checksum.cache_clear()  # in-memory checksums from previous polls might be stale
+            _check_all(data_set, ready, jobs=jobs, engine=engine)
+            write_watched(
+                {
+                    path: WatchedFile(*current[path], passed)
+                    for path, passed in _passed(ready).items()
+                }
+            )
+            state = read_watched(directory)
+
+        # upload only when the complete set passed, and none of the files is being written
+        files = {path: file for path in sorted(current) if (file := known(path)) is not None}
+        if upload and len(files) == len(current) and all(f.passed for f in files.values()):
+            if uploads := [path for path, file in files.items() if not file.uploaded]:
+                sources = _repack(uploads) if repack else None
+                failed = set(
+                    _upload(
+                        data_set, uploads, jobs=upload_jobs, max_rate=max_rate, sources=sources
+                    )
+                )
+                write_watched(
+                    {
+                        path: files[path]._replace(uploaded=True)
+                        for path in uploads
+                        if path not in failed
+                    }
+                )
+
+        iteration += 1
+        if iterations is not None and iteration >= iterations:
+            return
+        time.sleep(interval)
@@ -2,17 +2,17 @@ from __future__ import annotations
 
 import sys
 from pathlib import Path
-from typing import Iterator
+from typing import Any, Iterator, Literal
 
 if sys.version_info >= (3, 11):  # pragma: no cover
     from importlib import resources
 else:  # pragma: no cover
     import importlib_resources as resources
 
-import loguru
 import pandas as pd
 import pytest
 import xarray as xr
+from pyaerocom_preproc.check_obs import Checker, Issue
 
 
 @pytest.fixture(params=(2020,))
@@ -40,12 +40,6 @@ def datetime_stop(year: int, freq: str) -> xr.DataArray:
     return da.reset_coords().drop_vars("time")["datetime_stop"]
 
 
-@pytest.fixture
-def patched_logger(logger: loguru.Logger, monkeypatch) -> loguru.Logger:
-    monkeypatch.setattr("pyaerocom_preproc.check_obs.logger", logger)
-    return logger
-
-
 @pytest.fixture
 def empty_nc() -> Iterator[Path]:
     resource = resources.files(__package__) / "empty.nc"
@@ -124,3 +118,43 @@ def icos_co2_nrt() -> Iterator[Path]:
     assert resource.is_file()
     with resources.as_file(resource) as path:
         yield path
+
+
+class FakeCheckers:
+    """checkers named `name`, which yield an Issue for each of `errors`
+    and record the names and datasets they are called with"""
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        self.datasets: list[Any] = []
+
+    def __call__(
+        self,
+        name: str,
+        *,
+        errors: tuple[str, ...] = (),
+        phase: Literal["single", "metadata", "values"] = "values",
+        **kwargs,
+    ) -> Checker:
+        def func(ds) -> Iterator[Issue]:
+            self.calls.append(name)
+            self.datasets.append(ds)
+            for message in errors:
+                yield Issue("fake", message)
+
+        func.__name__ = name
+        if phase == "single":
+            return Checker(func, **kwargs)
+        return Checker(func, **{phase: func}, **kwargs)
+
+    def replace(self, checkers: list[Checker]) -> list[Checker]:
+        """single phase fakes of checkers, with the same versions, costs and prerequisites"""
+        return [
+            c._replace(func=self(c.name, phase="single").func, metadata=None, values=None)
+            for c in checkers
+        ]
+
+
+@pytest.fixture
+def fake_checker() -> FakeCheckers:
+    return FakeCheckers()
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+import xarray as xr
+from pyaerocom_preproc.check_obs import (
+    REGISTERED_CHECKERS,
+    Checker,
+    CheckResult,
+    _collect,
+    check_plan,
+    register,
+)
+
+
+def names(checkers: list[Checker]) -> list[str]:
+    return [checker.name for checker in checkers]
+
+
+def test_registered_plan():
+    assert names(check_plan(REGISTERED_CHECKERS)) == [
+        "coord_checker",
+        "time_checker",
+        "data_checker",
+    ]
+
+
+def test_check_plan(fake_checker):
+    checkers = [
+        fake_checker("high", cost="high"),
+        fake_checker("medium", cost="medium", requires=("low_2",)),
+        fake_checker("low_1", cost="low"),
+        fake_checker("low_2", cost="low", requires=("high",)),
+    ]
+    assert names(check_plan(checkers)) == ["low_1", "high", "low_2", "medium"]
+
+    # prerequisites from previous checks
+    assert names(check_plan(checkers[1:])) == ["low_1", "low_2", "medium"]
+
+
+def test_check_plan_circular(fake_checker):
+    checkers = [
+        fake_checker("a", requires=("b",)),
+        fake_checker("b", requires=("a",)),
+    ]
+    with pytest.raises(ValueError, match="circular prerequisites"):
+        check_plan(checkers)
+
+
+def test_register_validation():
+    with pytest.raises(ValueError, match="unknown cost"):
+        register(cost="free")  # type: ignore[arg-type]
+    with pytest.raises(ValueError, match="unknown prerequisites"):
+        register(requires=("not_registered",))
+
+
+def test_collect_prerequisites(good_nc: Path, fake_checker):
+    checkers = [
+        fake_checker("expensive", cost="high", requires=("broken",), errors=("expensive error",)),
+        fake_checker("broken", errors=("broken error",)),
+        fake_checker("cheap", cost="low"),
+    ]
+    completed, errors = _collect(good_nc, checkers)
+    assert names(completed) == ["cheap", "broken"]
+    assert errors == [("broken", "fake", "broken error")]
+
+
+@pytest.mark.parametrize("phase", ("metadata", "values"))
+def test_collect_fail_fast(good_nc: Path, fake_checker, phase: str):
+    checkers = [
+        fake_checker("first", phase=phase, errors=("first error", "second error")),
+        fake_checker("second", phase=phase, errors=("third error",)),
+    ]
+    completed, errors = _collect(good_nc, checkers)
+    assert len(errors) == 3
+
+    completed, errors = _collect(good_nc, checkers, fail_fast=True)
+    assert names(completed) == ["first"]
+    assert errors == [("first", "fake", "first error"), ("first", "fake", "second error")]
+
+
+def test_collect_results(incomplete_nc: Path):
+    completed, errors = _collect(incomplete_nc, REGISTERED_CHECKERS)
+    assert names(completed) == ["coord_checker", "time_checker", "data_checker"]
+    assert errors == [CheckResult("time_checker", "incomplete_year", "not a full year")]
+
+
+def test_collect_single_phase(good_nc: Path, fake_checker, monkeypatch):
+    opened: list[xr.Dataset] = []
+    open_dataset = xr.open_dataset
+
+    def spy(*args, **kwargs) -> xr.Dataset:
+        opened.append(open_dataset(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr("xarray.open_dataset", spy)
+    checkers = [
+        fake_checker("first", phase="single", errors=("first error",)),
+        fake_checker("second", phase="single", errors=("second error",)),
+    ]
+    completed, errors = _collect(good_nc, checkers, engine="netcdf4")
+    assert names(completed) == ["first", "second"]
+    assert errors == [("first", "fake", "first error"), ("second", "fake", "second error")]
+    assert len(opened) == 1  # opened once, for all single phase checkers
+    assert all(ds is opened[0] for ds in fake_checker.datasets)
+    assert opened[0]._close is None  # and closed with the lazy dataset
@@ -2,71 +2,108 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import loguru
+import numpy as np
+import pytest
 import xarray as xr
-from pyaerocom_preproc.check_obs import data_checker
-from pyaerocom_preproc.error_db import read_errors
+from pyaerocom_preproc.check_obs import (
+    VARIABLE_UNITS,
+    data_checker,
+    data_values,
+    has_negatives,
+    variable_stats,
+)
 
 
-def test_data_checker(good_nc: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=good_nc):
-        data_checker(xr.open_dataset(good_nc))
+def test_data_checker(good_nc: Path):
+    errors = data_checker(xr.open_dataset(good_nc))
+    assert list(errors) == []
 
-    assert read_errors(good_nc, database=database) == []
 
+def test_empty(empty_nc: Path):
+    errors = data_checker(xr.open_dataset(empty_nc))
+    assert set(errors) == {
+        ("missing_obs", "missing obs found"),
+    }
 
-def test_empty(empty_nc: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=empty_nc):
-        data_checker(xr.open_dataset(empty_nc))
 
-    assert set(read_errors(empty_nc, database=database)) == {
-        ("data_checker", "missing obs found"),
+def test_wrong_dims(wrong_dims_nc: Path):
+    errors = data_checker(xr.open_dataset(wrong_dims_nc))
+    assert set(errors) == {
+        ("wrong_dims", "air_quality_index.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "CO_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "NO2_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "O3_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "PM10_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "PM2p5_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+        ("wrong_dims", "SO2_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
     }
 
 
-def test_wrong_dims(wrong_dims_nc: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=wrong_dims_nc):
-        data_checker(xr.open_dataset(wrong_dims_nc))
-
-    assert set(read_errors(wrong_dims_nc, database=database)) == {
-        ("data_checker", "air_quality_index.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "CO_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "NO2_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "O3_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "PM10_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "PM2p5_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
-        ("data_checker", "SO2_density.dims=('latitude', 'longitude', 'time') != ('time',)"),
+def test_wrong_units(wrong_units_nc: Path):
+    errors = data_checker(xr.open_dataset(wrong_units_nc))
+    assert set(errors) == {
+        ("missing_units", "missing air_quality_index.units"),
+        ("wrong_units", "CO_density.units='ug/m3' not in ['mg m-3', 'mg/m3']"),
     }
 
 
-def test_wrong_units(wrong_units_nc: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=wrong_units_nc):
-        data_checker(xr.open_dataset(wrong_units_nc))
-
-    assert set(read_errors(wrong_units_nc, database=database)) == {
-        ("data_checker", "missing air_quality_index.units"),
-        ("data_checker", "CO_density.units='ug/m3' not in ['mg m-3', 'mg/m3']"),
+def test_negative_values(negative_nc: Path):
+    errors = data_checker(xr.open_dataset(negative_nc))
+    assert set(errors) == {
+        ("negative_values", "CO_density has negative values"),
+        ("negative_values", "NO2_density has negative values"),
+        ("negative_values", "O3_density has negative values"),
+        ("negative_values", "PM10_density has negative values"),
+        ("negative_values", "PM2p5_density has negative values"),
+        ("negative_values", "SO2_density has negative values"),
     }
 
 
-def test_negative_values(negative_nc: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=negative_nc):
-        data_checker(xr.open_dataset(negative_nc))
-
-    assert set(read_errors(negative_nc, database=database)) == {
-        ("data_checker", "CO_density has negative values"),
-        ("data_checker", "NO2_density has negative values"),
-        ("data_checker", "O3_density has negative values"),
-        ("data_checker", "PM10_density has negative values"),
-        ("data_checker", "PM2p5_density has negative values"),
-        ("data_checker", "SO2_density has negative values"),
+def test_icos_co2_nrt(icos_co2_nrt: Path):
+    errors = data_checker(xr.open_dataset(icos_co2_nrt))
+    assert set(errors) == {
+        ("missing_obs", "missing obs found"),
     }
 
 
-def test_icos_co2_nrt(icos_co2_nrt: Path, patched_logger: loguru.Logger, database: Path):
-    with patched_logger.contextualize(path=icos_co2_nrt):
-        data_checker(xr.open_dataset(icos_co2_nrt))
-
-    assert set(read_errors(icos_co2_nrt, database=database)) == {
-        ("data_checker", "missing obs found"),
-    }
+@pytest.mark.parametrize("max_memory", (1, 100, 2**30))
+def test_variable_stats(negative_nc: Path, max_memory: int):
+    ds = xr.open_dataset(negative_nc)
+    ds["CO_density"][::3] = np.nan
+    ds["NO2_density"][1::2] = 2
+    for var in ds.data_vars:
+        if var not in VARIABLE_UNITS:
+            continue
+        data = ds[var].values
+        assert variable_stats(ds[var], max_memory=max_memory) == (
+            np.count_nonzero(data < 0),
+            np.count_nonzero(np.isnan(data)),
+            np.nanmin(data),
+            np.nanmax(data),
+        )
+
+
+@pytest.mark.parametrize("max_memory", (1, 100, 2**30))
+def test_has_negatives(good_nc: Path, max_memory: int):
+    ds = xr.open_dataset(good_nc)
+    assert not has_negatives(ds["CO_density"], max_memory=max_memory)
+    ds["CO_density"][-1] = -1  # in the last chunk
+    assert has_negatives(ds["CO_density"], max_memory=max_memory)
+
+
+def test_variable_stats_all_nan(good_nc: Path):
+    ds = xr.open_dataset(good_nc)
+    stats = variable_stats(ds["CO_density"], max_memory=100)
+    assert stats == (0, ds["CO_density"].size, np.inf, -np.inf)
+
+
+@pytest.mark.parametrize("max_memory", (1, 100, 2**30))
+def test_data_values(negative_nc: Path, good_nc: Path, max_memory: int):
+    for path in (negative_nc, good_nc):
+        ds = xr.open_dataset(path)
+        in_memory = [
+            ("negative_values", f"{var} has negative values")
+            for var in VARIABLE_UNITS
+            if var in ds.data_vars and (ds[var] < 0).any()
+        ]
+        assert list(data_values(ds, max_memory=max_memory)) == in_memory
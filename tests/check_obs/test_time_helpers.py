@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+import numpy as np
+import pandas as pd
 import pytest
 import xarray as xr
-from pyaerocom_preproc.check_obs import infer_freq, monotonically_increasing, years
+from pyaerocom_preproc.check_obs import (
+    NaT,
+    infer_freq,
+    monotonically_increasing,
+    time_summary,
+    years,
+)
 
 
 @pytest.fixture(params=(2020, 2022))
@@ -21,6 +29,15 @@ def test_monotonically_increasing(datetime_start: xr.DataArray, datetime_stop: x
         assert not monotonically_increasing(time.roll(time=1))
 
 
+@pytest.mark.parametrize("nat", (0, 5, -1))
+def test_monotonically_increasing_nat(datetime_start: xr.DataArray, nat: int):
+    values = datetime_start.values.copy()
+    values[nat] = np.datetime64("NaT", "ns")
+    time = xr.DataArray(values, dims="time")
+    assert not monotonically_increasing(time)
+    assert monotonically_increasing(time[[nat]])  # nothing to compare
+
+
 def test_infer_freq(datetime_start: xr.DataArray, datetime_stop: xr.DataArray, freq: str):
     assert infer_freq(datetime_start.diff("time")) == freq
     assert infer_freq(datetime_stop.diff("time")) == freq
@@ -35,3 +52,43 @@ def test_infer_freq_unknown(datetime_start: xr.DataArray, datetime_stop: xr.Data
 def test_years(datetime_start: xr.DataArray, datetime_stop: xr.DataArray, year: int):
     assert years(datetime_start) == {year}
     assert years(datetime_stop) == {year, year + 1}
+
+
+@pytest.mark.parametrize(
+    "seconds",
+    (3600, 3629, 3630, 3631, 3690, 86400, 86430, 86490, 90000, -3600, -82800, 0),
+)
+def test_infer_freq_rounding(seconds: int):
+    time_delta = xr.DataArray(pd.to_timedelta([seconds] * 3, unit="s"), dims="time")
+
+    # reference implementation with the xarray datetime accessors
+    rounded = time_delta.dt.round("min")
+    if (rounded.dt.seconds == 3600).all():
+        freq = "1H"
+    elif (rounded.dt.days == 1).all():
+        freq = "1D"
+    else:
+        freq = "?"
+    assert infer_freq(time_delta) == freq
+
+
+def test_infer_freq_nat():
+    time_delta = xr.DataArray(pd.to_timedelta([3600, None, 3600], unit="s"), dims="time")
+    assert infer_freq(time_delta) == "?"
+
+
+def test_time_summary(datetime_start: xr.DataArray, datetime_stop: xr.DataArray, year: int):
+    start = datetime_start.values.view(np.int64)
+    stop = datetime_stop.values.view(np.int64)
+    summary = time_summary(start, stop)
+    assert summary.start_increasing and summary.stop_increasing and summary.start_before_stop
+    assert summary.freq == infer_freq(datetime_stop - datetime_start)
+    assert summary.years == {year}
+    assert summary.records == datetime_start.size
+
+    summary = time_summary(stop, start)
+    assert not summary.start_before_stop
+
+    start[3] = stop[3] = NaT
+    summary = time_summary(start, stop)
+    assert not summary.start_before_stop
@@ -2,10 +2,7 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import loguru
 import pytest
-from loguru import logger as _logger
-from pyaerocom_preproc.error_db import logging_patcher
 
 pytest_plugins = ["tests.check_obs.fixtures"]
 
@@ -22,11 +19,13 @@ def path(tmp_path: Path, text: str) -> Path:
     return path
 
 
-@pytest.fixture
-def database(tmp_path: Path) -> Path:
-    return tmp_path / "errors.sqlite"
+@pytest.fixture(autouse=True)
+def checksum_cache(tmp_path: Path, monkeypatch) -> Path:
+    path = tmp_path / "checksums.sqlite"
+    monkeypatch.setattr("pyaerocom_preproc.checksum.CACHE_PATH", path)
+    return path
 
 
 @pytest.fixture
-def logger(database: Path) -> loguru.Logger:
-    return _logger.patch(logging_patcher(database))
+def database(tmp_path: Path) -> Path:
+    return tmp_path / "errors.sqlite"
@@ -1,6 +1,18 @@
+from __future__ import annotations
+
+import os
+from hashlib import blake2b
 from pathlib import Path
 
-from pyaerocom_preproc.checksum import HASHLIB, checksum, hasher
+import pytest
+from pyaerocom_preproc.checksum import HASHLIB, checksum, file_digest, hasher
+
+
+@pytest.fixture(autouse=True)
+def clear_lru_cache():
+    checksum.cache_clear()
+    yield
+    checksum.cache_clear()
 
 
 def test_HASHLIB():
@@ -9,3 +21,63 @@ def test_HASHLIB():
 
 def test_checksum(text: str, path: Path):
     assert checksum(path) == hasher(text.encode()).hexdigest()
+
+
+@pytest.mark.parametrize("use_mmap", (False, True))
+@pytest.mark.parametrize("buffer_size", (1, 3, 2**20))
+def test_file_digest(text: str, path: Path, buffer_size: int, use_mmap: bool):
+    digest = file_digest(path, hasher=blake2b, buffer_size=buffer_size, use_mmap=use_mmap)
+    assert digest == blake2b(text.encode()).hexdigest()
+
+    digest = file_digest(path, buffer_size=buffer_size, use_mmap=use_mmap, max_threads=2)
+    assert digest == hasher(text.encode()).hexdigest()
+
+
+@pytest.mark.parametrize("use_mmap", (False, True))
+def test_file_digest_empty(tmp_path: Path, use_mmap: bool):
+    path = tmp_path / "empty.txt"
+    path.touch()
+    assert file_digest(path, hasher=blake2b, use_mmap=use_mmap) == blake2b().hexdigest()
+
+
+def test_checksum_cache(text: str, path: Path, checksum_cache: Path, monkeypatch):
+    assert not checksum_cache.exists()
+    _checksum = checksum(path)
+    assert checksum_cache.exists()
+
+    def fail(path: Path) -> str:
+        raise AssertionError(f"{path} should not be re-hashed")
+
+    # unchanged file, only stat
+    checksum.cache_clear()
+    monkeypatch.setattr("pyaerocom_preproc.checksum._hash", fail)
+    assert checksum(path) == _checksum
+
+    # strict mode, always re-hash
+    checksum.cache_clear()
+    with pytest.raises(AssertionError):
+        checksum(path, strict=True)
+
+
+def test_checksum_cache_invalidation(text: str, path: Path):
+    assert checksum(path) == hasher(text.encode()).hexdigest()
+
+    # new content, same size and mtime: only found on strict mode
+    stat = path.stat()
+    path.write_text(text[::-1])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    checksum.cache_clear()
+    assert checksum(path) == hasher(text.encode()).hexdigest()
+    checksum.cache_clear()
+    assert checksum(path, strict=True) == hasher(text[::-1].encode()).hexdigest()
+
+    # new mtime
+    path.write_text(text)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    checksum.cache_clear()
+    assert checksum(path) == hasher(text.encode()).hexdigest()
+
+    # new size
+    path.write_text(text * 2)
+    checksum.cache_clear()
+    assert checksum(path) == hasher((text * 2).encode()).hexdigest()
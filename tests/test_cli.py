@@ -1,32 +1,111 @@
 from __future__ import annotations
 
+import json
+import shutil
+import subprocess
+import sys
+import time
 from functools import partial
 from importlib import metadata
 from pathlib import Path
 
 import pytest
+from pyaerocom_preproc import check_obs
+from pyaerocom_preproc.check_obs import REGISTERED_CHECKERS
 from pyaerocom_preproc.cli import main
-from pyaerocom_preproc.error_db import logging_patcher, read_errors
+from pyaerocom_preproc.error_db import (
+    DAY,
+    delete_db,
+    invalidate,
+    maintain,
+    optimize,
+    prune,
+    read_errors_many,
+    read_results_many,
+    read_timings,
+    read_watched,
+    write_results,
+    write_seen,
+    write_timings,
+    write_watched,
+)
 from typer.testing import CliRunner
 
 runner = CliRunner()
 
 
-def fake_s3_upload(path: Path, *, object_name: str | None = None):
-    assert path.is_file()
-    assert object_name is not None
-    assert object_name.endswith(path.name)
+def fake_s3_upload_many(
+    uploads: dict[Path, str],
+    *,
+    jobs: int | None,
+    max_rate: float | None,
+    sources: dict[Path, Path] | None,
+) -> list[Path]:
+    assert jobs is None or jobs >= 1
+    assert max_rate is None or max_rate > 0
+    assert sources is None or sources.keys() == uploads.keys()
+    for path, object_name in uploads.items():
+        assert path.is_file()
+        assert object_name.endswith(path.name)
+    return []
 
 
 @pytest.fixture(autouse=True)
 def use_tmp_db(database: Path, monkeypatch) -> None:
     monkeypatch.setattr(
-        "pyaerocom_preproc.cli.logging_patcher", partial(logging_patcher, database=database)
+        "pyaerocom_preproc.check_obs.read_errors_many",
+        partial(read_errors_many, database=database),
+    )
+    monkeypatch.setattr(
+        "pyaerocom_preproc.check_obs.read_results_many",
+        partial(read_results_many, database=database),
+    )
+    monkeypatch.setattr(
+        "pyaerocom_preproc.check_obs.write_results", partial(write_results, database=database)
+    )
+    monkeypatch.setattr(
+        "pyaerocom_preproc.check_obs.delete_db", partial(delete_db, database=database)
+    )
+    monkeypatch.setattr(
+        "pyaerocom_preproc.check_obs.write_timings", partial(write_timings, database=database)
+    )
+    monkeypatch.setattr(
+        "pyaerocom_preproc.check_obs.read_timings", partial(read_timings, database=database)
     )
     monkeypatch.setattr(
-        "pyaerocom_preproc.check_obs.read_errors", partial(read_errors, database=database)
+        "pyaerocom_preproc.watch.read_watched", partial(read_watched, database=database)
     )
-    monkeypatch.setattr("pyaerocom_preproc.check_obs.s3_upload", fake_s3_upload)
+    monkeypatch.setattr(
+        "pyaerocom_preproc.watch.write_watched", partial(write_watched, database=database)
+    )
+    for func in (write_seen, prune, maintain, invalidate):
+        monkeypatch.setattr(
+            f"pyaerocom_preproc.check_obs.{func.__name__}", partial(func, database=database)
+        )
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.optimize", partial(optimize, database))
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.DB_PATH", database)
+    monkeypatch.setattr("pyaerocom_preproc.upload.s3_upload_many", fake_s3_upload_many)
+
+
+# modules imported by `import pyaerocom_preproc.cli` should stay under this budget
+IMPORT_TIME_BUDGET_US = 500_000
+
+
+def test_import_time():
+    command = [sys.executable, "-X", "importtime", "-c", "import pyaerocom_preproc.cli"]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+
+    # import time: self [us] | cumulative | imported package
+    imports: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        imports[name.strip()] = int(cumulative)
+
+    heavy = {"xarray", "numpy", "pandas", "netCDF4", "boto3", "botocore", "dynaconf"}
+    assert heavy.isdisjoint(imports)
+    assert imports["pyaerocom_preproc.cli"] < IMPORT_TIME_BUDGET_US
 
 
 @pytest.mark.parametrize("options", ("--version", "-V"))
@@ -74,6 +153,13 @@ def test_report_obs_clear_cache():
     assert "not a full year" in result.output
 
 
+def test_report_obs_strict_checksum():
+    options = "report-obs incomplete tests/check_obs/incomplete-1D-2020.nc --strict-checksum"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "not a full year" in result.output
+
+
 @pytest.mark.parametrize(
     "options",
     (
@@ -90,6 +176,15 @@ def test_report_obs_incomplete(options: str):
     assert "not a full year" in result.output
 
 
+def test_report_obs_negative_values():
+    # time errors do not hide the data errors
+    options = "report-obs negative_density tests/check_obs/negative_density-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "datetime_start is not monotonically increasing" in result.output
+    assert "CO_density has negative values" in result.output
+
+
 @pytest.mark.parametrize(
     "options",
     (
@@ -103,8 +198,335 @@ def test_report_obs_inconsistent(options: str):
     assert "filename does not match" in result.output
 
 
-def test_upload_obs():
-    options = "upload-obs valid tests/check_obs/valid-1D-2020.nc"
+def test_report_obs_metadata_phase(monkeypatch):
+    def open_dataset(path):
+        raise AssertionError(f"{path} should not be loaded")
+
+    # metadata errors are found without loading the data
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.xr.open_dataset", open_dataset)
+    options = "report-obs wrong_units tests/check_obs/wrong_units-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "missing air_quality_index.units" in result.output
+    assert "pass" not in result.output
+
+
+def test_report_obs_cached_pass(monkeypatch):
+    options = "report-obs valid tests/check_obs/valid-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "pass" in result.output
+
+    def open_dataset(path):
+        raise AssertionError(f"{path} should not be opened")
+
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.xr.open_dataset", open_dataset)
     result = runner.invoke(main, options.split())
     assert result.exit_code == 0
     assert "pass" in result.output
+
+
+def test_report_obs_cached_first(tmp_path: Path, monkeypatch):
+    result = runner.invoke(
+        main, "report-obs incomplete tests/check_obs/incomplete-1D-2020.nc".split()
+    )
+    assert "not a full year" in result.output
+
+    events: list[tuple[str, str]] = []
+    read_header, report = check_obs.read_header, check_obs._report
+
+    def spy_read_header(path: Path):
+        events.append(("open", path.name))
+        return read_header(path)
+
+    def spy_report(path: Path, errors):
+        if errors:
+            events.append(("report", path.name))
+        report(path, errors)
+
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.read_header", spy_read_header)
+    monkeypatch.setattr("pyaerocom_preproc.check_obs._report", spy_report)
+
+    # known errors are reported before the new file is opened
+    path = tmp_path / "incomplete-new-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+    options = f"report-obs incomplete {path} tests/check_obs/incomplete-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert events == [("report", "incomplete-1D-2020.nc"), ("open", path.name)]
+    assert result.output.index("not a full year") < result.output.index("pass")
+
+
+def test_report_obs_checker_version(fake_checker, monkeypatch):
+    options = "report-obs valid tests/check_obs/valid-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+
+    # only the new checker version is re-run
+    checkers = fake_checker.replace(REGISTERED_CHECKERS)
+    checkers[-1] = checkers[-1]._replace(version=checkers[-1].version + 1)
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.REGISTERED_CHECKERS", checkers)
+
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "pass" in result.output
+    assert fake_checker.calls == [REGISTERED_CHECKERS[-1].name]
+
+
+def test_cache_prune():
+    options = "report-obs valid tests/check_obs/valid-1D-2020.nc"
+    assert runner.invoke(main, options.split()).exit_code == 0
+
+    result = runner.invoke(main, "cache-prune".split())
+    assert result.exit_code == 0
+    assert "evicted 0 files" in result.output
+
+    result = runner.invoke(main, "cache-prune --max-files 0".split())
+    assert result.exit_code == 0
+    assert "evicted 1 files" in result.output
+
+
+def test_cache_prune_max_age(database: Path):
+    path = Path("tests/check_obs/valid-1D-2020.nc")
+    assert runner.invoke(main, f"report-obs valid {path}".split()).exit_code == 0
+
+    result = runner.invoke(main, "cache-prune --max-age 30".split())
+    assert result.exit_code == 0
+    assert "evicted 0 files" in result.output
+
+    write_seen([path], data_set="valid", now=time.time() - 400 * DAY, database=database)
+    result = runner.invoke(main, "cache-prune --max-age 30".split())
+    assert result.exit_code == 0
+    assert "evicted 1 files" in result.output
+
+
+def test_cache_invalidate(fake_checker, monkeypatch):
+    options = "report-obs valid tests/check_obs/valid-1D-2020.nc"
+    assert runner.invoke(main, options.split()).exit_code == 0
+
+    result = runner.invoke(main, "cache-invalidate".split())
+    assert "nothing to invalidate" in result.output
+
+    result = runner.invoke(main, "cache-invalidate --checker not_a_checker".split())
+    assert "unknown checkers not_a_checker" in result.output
+
+    name = REGISTERED_CHECKERS[-1].name
+    result = runner.invoke(main, f"cache-invalidate --data-set valid --checker {name}".split())
+    assert result.exit_code == 0
+    assert "invalidated 1 results" in result.output
+
+    # only the invalidated checker is re-run
+    checkers = fake_checker.replace(REGISTERED_CHECKERS)
+    monkeypatch.setattr("pyaerocom_preproc.check_obs.REGISTERED_CHECKERS", checkers)
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert fake_checker.calls == [name]
+
+
+@pytest.mark.parametrize("jobs", ("--jobs 1", "--jobs 2", "-j 4"))
+def test_report_obs_jobs(jobs: str):
+    files = sorted(Path("tests/check_obs").glob("wrong_*.nc"))
+    options = f"report-obs {jobs} wrong {' '.join(map(str, files))}"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "pass" not in result.output
+
+    # messages are grouped by file and follow the order of the files
+    lines = [line.split()[0] for line in result.output.splitlines()]
+    assert list(dict.fromkeys(lines)) == [path.name for path in files]
+
+    # second call, answered from the DB
+    cached = runner.invoke(main, options.split())
+    assert cached.exit_code == 0
+    assert sorted(cached.output.splitlines()) == sorted(result.output.splitlines())
+
+
+@pytest.mark.parametrize(
+    "upload_jobs", ("", "--upload-jobs 1", "--upload-jobs 4", "--max-rate 0.5")
+)
+def test_upload_obs(upload_jobs: str):
+    options = f"upload-obs {upload_jobs} valid tests/check_obs/valid-1D-2020.nc"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "pass" in result.output
+    assert "uploaded files" in result.output
+
+
+class FakeStagedUpload:
+    submitted: dict[Path, str] = {}
+    promoted = False
+
+    def __init__(self, prefix: str, *, jobs: int | None, max_rate: float | None):
+        assert prefix.startswith("valid/staging/")
+        FakeStagedUpload.submitted, FakeStagedUpload.promoted = {}, False
+
+    def submit(self, path: Path, object_name: str, *, source: Path | None = None) -> None:
+        self.submitted[path] = object_name
+
+    def promote(self) -> list[Path]:
+        FakeStagedUpload.promoted = True
+        return []
+
+    def __enter__(self) -> FakeStagedUpload:
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+@pytest.mark.parametrize(
+    "files,promoted",
+    (
+        pytest.param("valid-1D-2020.nc", True, id="pass"),
+        pytest.param("valid-1D-2020.nc incomplete-1D-2020.nc", False, id="fail"),
+    ),
+)
+def test_upload_obs_pipeline(files: str, promoted: bool, monkeypatch):
+    monkeypatch.setattr("pyaerocom_preproc.upload.StagedUpload", FakeStagedUpload)
+    paths = [f"tests/check_obs/{name}" for name in files.split()]
+    result = runner.invoke(main, ["upload-obs", "--pipeline", "valid", *paths])
+    assert result.exit_code == 0
+    assert FakeStagedUpload.submitted == {Path(paths[0]): "valid/download/2020/valid-1D-2020.nc"}
+    assert FakeStagedUpload.promoted == promoted
+    assert ("uploaded files" in result.output) == promoted
+
+
+def test_upload_obs_repack_profile(tmp_path: Path, database: Path, monkeypatch):
+    repack_path = tmp_path / "repacked"
+    monkeypatch.setattr("pyaerocom_preproc.upload.REPACK_PATH", repack_path)
+
+    path = tmp_path / "valid-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+    result = runner.invoke(main, f"upload-obs --repack --profile valid {path}".split())
+    assert result.exit_code == 0
+    assert "repacked 1 of 1 files" in result.output
+    assert "uploaded files" in result.output
+    assert list(repack_path.iterdir()) == []  # removed once uploaded
+
+    # the checks of the repacked copy are timed under the original file
+    stages = {stage for stage, _, _ in read_timings("stage", limit=100, database=database)}
+    assert {"repack", "repack:verify", "values:data_checker"} <= stages
+    paths = {path for path, _, _ in read_timings("path", limit=100, database=database)}
+    assert str(path) in paths
+    assert not any(name.endswith(".tmp.nc") for name in paths)
+
+
+def test_report_obs_engine():
+    files = " ".join(map(str, sorted(Path("tests/check_obs").glob("*.nc"))))
+    outputs = {}
+    for engine in ("xarray", "netcdf4"):
+        options = f"report-obs --clear-cache --engine {engine} wrong {files}"
+        result = runner.invoke(main, options.split())
+        assert result.exit_code == 0
+        outputs[engine] = result.output
+    assert outputs["netcdf4"] == outputs["xarray"]
+
+
+def test_report_obs_fail_fast():
+    files = " ".join(map(str, sorted(Path("tests/check_obs").glob("wrong_*.nc"))))
+    options = f"report-obs --clear-cache wrong {files}"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+
+    fail_fast = runner.invoke(main, f"{options} --fail-fast".split())
+    assert fail_fast.exit_code == 0
+    assert set(fail_fast.output.splitlines()) < set(result.output.splitlines())
+
+    # one failing checker per file
+    lines = [line.split(" - ")[:2] for line in fail_fast.output.splitlines()]
+    files_checkers = {(path.strip(), func.strip()) for path, func in lines}
+    assert len(files_checkers) == len({path for path, _ in files_checkers})
+
+
+@pytest.mark.parametrize(
+    "path", sorted(Path("tests/check_obs").glob("*.nc")), ids=lambda path: path.name
+)
+@pytest.mark.parametrize("jobs", ("--jobs 1", "--jobs 2"))
+def test_report_obs_after_fail_fast(path: Path, jobs: str):
+    options = f"report-obs {jobs} {path.name.split('-')[0]} {path}"
+    result = runner.invoke(main, f"{options} --clear-cache".split())
+    assert result.exit_code == 0
+
+    fail_fast = runner.invoke(main, f"{options} --clear-cache --fail-fast".split())
+    assert fail_fast.exit_code == 0
+
+    # checkers skipped by the fail-fast run are run, and report the same errors
+    for _ in range(2):
+        report = runner.invoke(main, options.split())
+        assert report.exit_code == 0
+        assert set(report.output.splitlines()) == set(result.output.splitlines())
+
+
+@pytest.mark.parametrize("jobs", ("--jobs 1", "--jobs 2"))
+def test_report_obs_profile(jobs: str, tmp_path: Path, database: Path):
+    output = tmp_path / "profile.json"
+    files = "tests/check_obs/valid-1D-2020.nc tests/check_obs/wrong_units-1D-2020.nc"
+    options = f"report-obs {jobs} --profile --profile-json {output} valid {files}"
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "open_dataset:xarray" in result.output
+    assert "slowest files across runs" in result.output
+
+    profile = json.loads(output.read_text())
+    stages = {stage["stage"] for stage in profile["stages"]}
+    assert {"checksum", "error_db", "read_header", "open_dataset:xarray"} <= stages
+    assert {f"values:{checker.name}" for checker in REGISTERED_CHECKERS} <= stages
+
+    # timings are also stored on the DB
+    assert {stage for stage, _, _ in read_timings("stage", limit=100, database=database)} == stages
+
+    # not timed without --profile
+    result = runner.invoke(main, f"report-obs valid {files}".split())
+    assert result.exit_code == 0
+    assert "slowest files" not in result.output
+
+
+def test_watch(tmp_path: Path):
+    valid = tmp_path / "valid-a-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", valid)
+    options = f"watch valid {tmp_path} --once --settle 0"
+
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "valid-a-1D-2020.nc" in result.output and "pass" in result.output
+
+    # restart, unchanged files are not checked again
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "pass" not in result.output
+
+    # modified files are checked again
+    shutil.copy("tests/check_obs/incomplete-1D-2020.nc", valid)
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "not a full year" in result.output
+
+    # files which changed recently might still be written
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", valid)
+    result = runner.invoke(main, f"{options} --settle 3600".split())
+    assert result.exit_code == 0
+    assert "pass" not in result.output and "not a full year" not in result.output
+
+
+def test_watch_upload(tmp_path: Path):
+    for name in ("a", "b"):
+        shutil.copy("tests/check_obs/valid-1D-2020.nc", tmp_path / f"valid-{name}-1D-2020.nc")
+    options = f"watch valid {tmp_path} --once --settle 0 --upload"
+
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert result.output.count("pass") == 2
+    assert "uploaded files" in result.output
+
+    # already uploaded
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "uploaded files" not in result.output
+
+    # a new file which does not pass, blocks the upload of the set
+    shutil.copy("tests/check_obs/incomplete-1D-2020.nc", tmp_path / "valid-c-1D-2020.nc")
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", tmp_path / "valid-d-1D-2020.nc")
+    result = runner.invoke(main, options.split())
+    assert result.exit_code == 0
+    assert "not a full year" in result.output
+    assert "uploaded files" not in result.output
@@ -2,34 +2,258 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import loguru
-from pyaerocom_preproc.error_db import read_errors
+import pytest
+from pyaerocom_preproc.error_db import (
+    DAY,
+    CheckResult,
+    WatchedFile,
+    delete_db,
+    errors_db,
+    invalidate,
+    maintain,
+    prune,
+    read_errors,
+    read_errors_many,
+    read_results,
+    read_results_many,
+    read_timings,
+    read_watched,
+    write_errors,
+    write_results,
+    write_seen,
+    write_timings,
+    write_watched,
+)
+from pyaerocom_preproc.timing import Timing
 
 
-def test_read_errors(path: Path, logger: loguru.Logger, database: Path):
+def test_read_errors(path: Path, database: Path):
     assert not read_errors(path, database=database)
 
-    def error_report():
-        logger.error("error_report")
-
-    with logger.contextualize(path=path):
-        # ignored
-        logger.debug("debug")
-        logger.success("success")
-        logger.critical("critical")
-        logger.error("error, skip")
-        error_report()
-        # logged into db
-        logger.error("error 1")
-        logger.error("error 2")
-        logger.error("error 3")
-        # repeated
-        logger.error("error 3")
-        logger.error("error 2")
-        logger.error("error 1")
-
-    assert read_errors(path, database=database) == [
-        ("test_read_errors", "error 1"),
-        ("test_read_errors", "error 2"),
-        ("test_read_errors", "error 3"),
+    errors = [
+        CheckResult("checker_a", "code_1", "error 1"),
+        CheckResult("checker_a", "code_2", "error 2"),
+        CheckResult("checker_b", "code_1", "error 3"),
     ]
+    write_errors(path, errors, database=database)
+    # repeated
+    write_errors(path, errors[::-1], database=database)
+
+    assert read_errors(path, database=database) == errors
+
+
+def test_read_errors_versions(path: Path, database: Path):
+    errors = [("checker_a", "code", "error 1"), ("checker_b", "code", "error 2")]
+    write_errors(path, errors, versions=dict(checker_a=1, checker_b=1), database=database)
+
+    assert read_errors(path, database=database) == errors
+    assert read_errors(path, versions=dict(checker_a=1, checker_b=1), database=database) == errors
+    assert read_errors(path, versions=dict(checker_a=1, checker_b=2), database=database) == [
+        ("checker_a", "code", "error 1")
+    ]
+    assert read_errors(path, versions=dict(checker_b=1), database=database) == [
+        ("checker_b", "code", "error 2")
+    ]
+
+
+def test_read_results(path: Path, database: Path):
+    versions = dict(checker_a=1, checker_b=1)
+    assert read_results(path, versions=versions, database=database) == {}
+
+    write_results(
+        path, dict(checker_a=True, checker_b=False), versions=versions, database=database
+    )
+    assert read_results(path, versions=versions, database=database) == dict(
+        checker_a=True, checker_b=False
+    )
+
+    # new checker version, needs to be re-run
+    versions.update(checker_b=2)
+    assert read_results(path, versions=versions, database=database) == dict(checker_a=True)
+
+    write_results(path, dict(checker_b=True), versions=versions, database=database)
+    assert read_results(path, versions=versions, database=database) == dict(
+        checker_a=True, checker_b=True
+    )
+
+
+def test_write_results(path: Path, database: Path):
+    versions = dict(checker_a=1, checker_b=1)
+    errors = [("checker_b", "code", "error 1"), ("checker_b", "code", "error 2")]
+    write_results(
+        path,
+        dict(checker_a=True, checker_b=False),
+        errors=errors,
+        versions=versions,
+        database=database,
+    )
+    assert read_results(path, versions=versions, database=database) == dict(
+        checker_a=True, checker_b=False
+    )
+    assert read_errors(path, versions=versions, database=database) == errors
+
+
+def test_read_many(tmp_path: Path, database: Path):
+    files = [tmp_path / f"{name}.txt" for name in ("a", "b", "c", "same_as_a")]
+    for path in files:
+        path.write_text(path.name[-5])
+    versions = dict(checker_a=1, checker_b=1)
+    assert read_errors_many(files, versions=versions, database=database) == {}
+    assert read_results_many(files, versions=versions, database=database) == {}
+
+    errors = [("checker_b", "code", "error 1"), ("checker_b", "code", "error 2")]
+    write_results(
+        files[0],
+        dict(checker_a=True, checker_b=False),
+        errors=errors,
+        versions=versions,
+        database=database,
+    )
+    write_results(files[1], dict(checker_a=True), versions=versions, database=database)
+
+    assert read_errors_many(files, versions=versions, database=database) == {
+        files[0]: errors,
+        files[3]: errors,
+    }
+    assert read_results_many(files, versions=versions, database=database) == {
+        files[0]: dict(checker_a=True, checker_b=False),
+        files[1]: dict(checker_a=True),
+        files[3]: dict(checker_a=True, checker_b=False),
+    }
+
+    # same answers as the single file lookups
+    versions.update(checker_b=2)
+    for path in files:
+        errors_many = read_errors_many(files, versions=versions, database=database)
+        assert errors_many.get(path, []) == read_errors(path, versions=versions, database=database)
+        results_many = read_results_many(files, versions=versions, database=database)
+        assert results_many.get(path, {}) == read_results(
+            path, versions=versions, database=database
+        )
+
+
+def test_errors_db(database: Path):
+    with errors_db(database) as db:
+        (journal_mode,) = db.execute("PRAGMA journal_mode;").fetchone()
+        assert journal_mode == "wal"
+
+        # long-lived connection
+        with errors_db(database) as other:
+            assert other is db
+
+    delete_db(database)
+    assert not database.exists()
+    with errors_db(database) as other:
+        assert other is not db
+
+
+def test_timings(path: Path, database: Path):
+    assert read_timings("path", database=database) == []
+
+    for run in (1.0, 2.0):
+        timings = [
+            Timing(str(path), "checksum", 0.1 * run, 10, 0),
+            Timing(str(path), "error_db", 0.2 * run, 0, 0),
+            Timing("", "upload", 1.0, 0, 0),
+        ]
+        write_timings(timings, run=run, database=database)
+
+    assert read_timings("path", database=database) == [(str(path), 2, pytest.approx(0.45))]
+    slowest = read_timings("stage", limit=2, database=database)
+    assert slowest == [("upload", 2, 1.0), ("error_db", 2, pytest.approx(0.3))]
+
+    with pytest.raises(ValueError):
+        read_timings("checksum", database=database)  # type: ignore[arg-type]
+
+
+def test_watched(tmp_path: Path, database: Path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "ab").mkdir()
+    files = {
+        tmp_path / "a/1.nc": WatchedFile(1, 10, True),
+        tmp_path / "a/2.nc": WatchedFile(2, 20, False),
+        tmp_path / "ab/3.nc": WatchedFile(3, 30, True, True),
+    }
+    write_watched(files, database=database)
+    assert read_watched(tmp_path / "a", database=database) == {
+        path: file for path, file in files.items() if path.parent.name == "a"
+    }
+    assert read_watched(tmp_path, database=database) == files
+
+    write_watched({tmp_path / "a/1.nc": WatchedFile(1, 10, True, True)}, database=database)
+    assert read_watched(tmp_path / "a", database=database)[tmp_path / "a/1.nc"].uploaded
+
+
+@pytest.fixture
+def files(tmp_path: Path, database: Path) -> list[Path]:
+    """files a/b/c, checked on day 1/2/3 and with errors from checker_b"""
+    files = []
+    versions = dict(checker_a=1, checker_b=1)
+    for day, name in enumerate("abc", start=1):
+        path = tmp_path / f"{name}.txt"
+        path.write_text(name)
+        errors = [("checker_b", "code", f"error {name}")]
+        results = dict(checker_a=True, checker_b=False)
+        write_results(path, results, errors=errors, versions=versions, database=database)
+        write_seen([path], data_set=f"data_set_{day % 2}", now=day * DAY, database=database)
+        files.append(path)
+    return files
+
+
+def cached(files: list[Path], database: Path) -> list[str]:
+    versions = dict(checker_a=1, checker_b=1)
+    results = read_results_many(files, versions=versions, database=database)
+    return [path.name for path in files if path in results]
+
+
+def test_prune(files: list[Path], database: Path):
+    assert prune(max_age=None, database=database) == 0
+    assert cached(files, database) == ["a.txt", "b.txt", "c.txt"]
+
+    assert prune(max_age=1.5 * DAY, now=3 * DAY, database=database) == 1
+    assert cached(files, database) == ["b.txt", "c.txt"]
+    assert read_errors(files[0], database=database) == []
+
+    # seen again, is the most recent
+    write_seen(files[1:2], data_set="data_set_0", now=4 * DAY, database=database)
+    assert prune(max_age=None, max_entries=1, database=database) == 1
+    assert cached(files, database) == ["b.txt"]
+
+    assert prune(max_age=None, max_bytes=0, database=database) == 1
+    assert cached(files, database) == []
+
+
+def test_prune_unseen(path: Path, database: Path):
+    write_results(path, dict(checker_a=True), versions=dict(checker_a=1), database=database)
+    assert prune(max_age=None, database=database) == 0
+    assert read_results(path, versions=dict(checker_a=1), database=database) == {}
+
+
+def test_maintain(files: list[Path], database: Path):
+    assert maintain(now=200 * DAY, database=database)
+    assert cached(files, database) == []
+
+    # only once per interval
+    write_seen(files, data_set="data_set", now=200 * DAY, database=database)
+    write_results(files[0], dict(checker_a=True), versions=dict(checker_a=1), database=database)
+    assert not maintain(interval=DAY, now=200.5 * DAY, database=database)
+    assert maintain(interval=DAY, now=201 * DAY, database=database)
+    assert cached(files, database) == ["a.txt"]
+
+
+def test_invalidate(files: list[Path], database: Path):
+    with pytest.raises(ValueError, match="nothing to invalidate"):
+        invalidate(database=database)
+
+    assert invalidate(files=files[:1], database=database) == 2
+    assert cached(files, database) == ["b.txt", "c.txt"]
+
+    # a and c were seen as data_set_1, only checker_b results
+    assert invalidate(data_set="data_set_1", checkers=["checker_b"], database=database) == 1
+    assert read_errors(files[2], database=database) == []
+    versions = dict(checker_a=1, checker_b=1)
+    assert read_results(files[2], versions=versions, database=database) == dict(checker_a=True)
+    assert read_errors(files[1], database=database) == [("checker_b", "code", "error b")]
+
+    assert invalidate(checkers=["checker_a", "checker_b"], database=database) == 3
+    assert cached(files, database) == []
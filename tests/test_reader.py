@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+from pyaerocom_preproc.check_obs import (
+    coord_metadata,
+    coord_values,
+    data_metadata,
+    data_values,
+    time_metadata,
+    time_values,
+)
+from pyaerocom_preproc.reader import LazyDataset, open_dataset, read_header
+
+FILES = sorted(Path("tests/check_obs").glob("*.nc"))
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+def test_read_header(path: Path):
+    header = read_header(path)
+    ds = xr.open_dataset(path)
+
+    assert header.dims == dict(ds.sizes)
+    assert set(header.data_vars) == set(ds.data_vars)
+    for name, var in header.variables.items():
+        assert var.dims == ds[name].dims
+        assert var.size == ds[name].size
+        if "units" in ds[name].attrs:
+            assert var.attrs["units"] == ds[name].attrs["units"]
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+@pytest.mark.parametrize("metadata", (time_metadata, coord_metadata, data_metadata))
+def test_metadata(path: Path, metadata):
+    assert list(metadata(read_header(path))) == list(metadata(xr.open_dataset(path)))
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+def test_lazy_dataset(path: Path):
+    ds = xr.open_dataset(path)
+    with open_dataset(path, engine="netcdf4") as lazy:
+        assert isinstance(lazy, LazyDataset)
+        assert set(lazy.data_vars) == set(ds.data_vars)
+        for name in ds.variables:
+            var, values = lazy[name], ds[name].values
+            assert var.dims == ds[name].dims
+            assert var.sizes == dict(ds[name].sizes)
+            assert var.dtype == values.dtype
+            np.testing.assert_array_equal(var.values, values)
+
+            if "time" not in var.dims:
+                continue
+            window = dict(time=slice(3, 30, 2))
+            np.testing.assert_array_equal(
+                var.isel(**window).isel(time=slice(1, None)).values,
+                ds[name].isel(**window).isel(time=slice(1, None)).values,
+            )
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+@pytest.mark.parametrize("values", (time_values, coord_values, data_values))
+def test_values(path: Path, values):
+    with open_dataset(path, engine="netcdf4") as lazy:
+        assert list(values(lazy)) == list(values(xr.open_dataset(path)))
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError, match="unknown engine"):
+        open_dataset(FILES[0], engine="h5py")  # type: ignore[arg-type]
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+import netCDF4
+import pytest
+import xarray as xr
+from pyaerocom_preproc import upload
+from pyaerocom_preproc.checksum import checksum
+from pyaerocom_preproc.repack import repack, same_data
+from pyaerocom_preproc.upload import _repacked
+
+FILES = sorted(Path("tests/check_obs").glob("*.nc"))
+
+
+@pytest.fixture
+def repack_path(tmp_path: Path, monkeypatch) -> Path:
+    path = tmp_path / "repacked"
+    monkeypatch.setattr("pyaerocom_preproc.upload.REPACK_PATH", path)
+    return path
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+def test_repack(path: Path, tmp_path: Path):
+    output = tmp_path / path.name
+    repack(path, output, time_chunk=100)
+    assert same_data(path, output)
+    with xr.open_dataset(path) as ds, xr.open_dataset(output) as repacked:
+        assert repacked.identical(ds)
+
+    with netCDF4.Dataset(output) as nc:
+        assert nc.data_model == "NETCDF4"
+        for var in nc.variables.values():
+            if "time" not in var.dimensions:
+                continue
+            assert var.filters()["zlib"] and var.filters()["shuffle"]
+            assert var.chunking()[var.dimensions.index("time")] == min(
+                len(nc.dimensions["time"]), 100
+            )
+
+
+def test_same_data(tmp_path: Path):
+    path = Path("tests/check_obs/valid-1D-2020.nc")
+    output = tmp_path / path.name
+    repack(path, output)
+    assert same_data(path, output)
+
+    with netCDF4.Dataset(output, "a") as nc:
+        nc["CO_density"][0] = 123.456
+    assert not same_data(path, output)
+
+    repack(path, output)
+    with netCDF4.Dataset(output, "a") as nc:
+        nc["CO_density"].units = "ppb"
+    assert not same_data(path, output)
+
+
+def test_repack_groups(tmp_path: Path):
+    path = tmp_path / "groups.nc"
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createGroup("station")
+    with pytest.raises(ValueError, match="groups are not supported"):
+        repack(path, tmp_path / "repacked.nc")
+
+
+def test_repacked(tmp_path: Path, repack_path: Path):
+    # uncompressed netCDF4 shrinks
+    path = tmp_path / "valid-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+    repacked = _repacked(path)
+    assert repacked == repack_path / f"{checksum(path)}.nc"
+    assert repacked.stat().st_size < path.stat().st_size
+    assert _repacked(path) == repacked  # verified copies are re-used
+
+    # tiny netCDF3 files grow with the netCDF4 headers
+    path = Path("tests/check_obs/icos-co2-nrt-bir-10.0m-20230401-20230403T100446.nc")
+    assert _repacked(path) == path
+
+
+def test_repacked_differs(tmp_path: Path, repack_path: Path, monkeypatch):
+    path = tmp_path / "valid-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+    monkeypatch.setattr(upload, "same_data", lambda path, other: False)
+    assert _repacked(path) == path
+    assert list(repack_path.iterdir()) == []  # unverified copies are not kept
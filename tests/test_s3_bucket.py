@@ -0,0 +1,473 @@
+from __future__ import annotations
+
+import shutil
+import sqlite3
+import time
+from functools import partial
+from pathlib import Path
+
+import boto3
+import pytest
+import tomli_w
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from dynaconf import Dynaconf
+from moto import mock_aws
+from pyaerocom_preproc import error_db
+from pyaerocom_preproc.check_obs import obs_report
+from pyaerocom_preproc.checksum import HASHLIB, checksum
+from pyaerocom_preproc.config import _settings
+from pyaerocom_preproc.repack import same_data
+from pyaerocom_preproc.s3_bucket import (
+    TRANSFER_CONFIG,
+    MiB,
+    S3Object,
+    StagedUpload,
+    abort_uploads,
+    indexed_objects,
+    read_manifest,
+    refresh_index,
+    remote_checksum,
+    s3_client,
+    s3_objects,
+    s3_upload,
+    s3_upload_many,
+    write_manifest,
+)
+from pyaerocom_preproc.sync import sync_obs
+
+
+@pytest.fixture
+def settings(tmp_path: Path, monkeypatch) -> Dynaconf:
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("PYA_PP_S3_BUCKET__ENDPOINT_URL", "https://s3.amazonaws.com")
+    secrets = tmp_path / "secrets.toml"
+    s3_bucket = dict(
+        bucket_name="test-bucket",
+        access_key_id="testing",
+        secret_access_key="testing",
+    )
+    secrets.write_text(tomli_w.dumps(dict(s3_bucket=s3_bucket)))
+    settings = _settings(secrets=secrets)
+    monkeypatch.setattr("pyaerocom_preproc.s3_bucket.config", lambda: settings)
+    return settings
+
+
+@pytest.fixture
+def bucket(settings: Dynaconf):
+    with mock_aws():
+        s3_client.cache_clear()
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        yield s3.create_bucket(Bucket=settings.s3_bucket.bucket_name)
+        s3_client.cache_clear()
+
+
+@pytest.fixture
+def files(tmp_path: Path) -> list[Path]:
+    files = []
+    for n in range(5):
+        path = tmp_path / f"file{n}.nc"
+        path.write_bytes(bytes(n + 1))
+        files.append(path)
+    return files
+
+
+def test_s3_upload(bucket, files: list[Path]):
+    assert s3_upload(files[0], object_name="test/file0.nc")
+    assert [obj.key for obj in bucket.objects.all()] == ["test/file0.nc"]
+
+
+def test_s3_upload_skip(settings: Dynaconf, bucket, files: list[Path], monkeypatch):
+    path = files[0]
+    assert s3_upload(path, object_name="test/file0.nc")
+
+    client = s3_client(settings, max_pool_connections=10)
+    remote = remote_checksum(client, bucket.name, "test/file0.nc")
+    assert remote == (HASHLIB, checksum(path))
+    assert remote_checksum(client, bucket.name, "test/missing.nc") is None
+
+    uploads: list[str] = []
+    upload_file = client.upload_file
+
+    def spy(filename: str, bucket: str, key: str, **kwargs):
+        uploads.append(key)
+        return upload_file(filename, bucket, key, **kwargs)
+
+    monkeypatch.setattr(client, "upload_file", spy)
+
+    # same content
+    assert s3_upload(path, object_name="test/file0.nc")
+    assert uploads == []
+
+    # new content
+    path.write_bytes(b"new content")
+    checksum.cache_clear()
+    assert s3_upload(path, object_name="test/file0.nc")
+    assert uploads == ["test/file0.nc"]
+    assert remote_checksum(client, bucket.name, "test/file0.nc") == (HASHLIB, checksum(path))
+
+
+@pytest.mark.parametrize("jobs", (1, 3))
+def test_s3_upload_many(bucket, files: list[Path], jobs: int):
+    uploads = {path: f"test/{path.name}" for path in files}
+    assert s3_upload_many(uploads, jobs=jobs) == []
+
+    objects = {obj.key: obj.size for obj in bucket.objects.all()}
+    assert objects == {f"test/{path.name}": path.stat().st_size for path in files}
+
+
+def test_s3_upload_many_failed(bucket, files: list[Path]):
+    bucket.delete()
+    uploads = {path: f"test/{path.name}" for path in files}
+    assert s3_upload_many(uploads, jobs=2) == files
+
+
+def test_s3_upload_many_throttled(settings: Dynaconf, bucket, files: list[Path], monkeypatch):
+    client = s3_client(settings, max_pool_connections=4 * TRANSFER_CONFIG.max_concurrency)
+    upload_file = client.upload_file
+    throttled: list[str] = []
+
+    def spy(filename: str, bucket: str, key: str, **kwargs):
+        if key not in throttled:  # first attempt of each file
+            throttled.append(key)
+            error = dict(Error=dict(Code="SlowDown", Message="Please reduce your request rate"))
+            raise ClientError(error, "PutObject")  # type: ignore[arg-type]
+        assert kwargs["Callback"] is not None
+        return upload_file(filename, bucket, key, **kwargs)
+
+    monkeypatch.setattr(client, "upload_file", spy)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    uploads = {path: f"test/{path.name}" for path in files}
+    assert s3_upload_many(uploads, jobs=2, max_rate=10e6) == []
+    assert sorted(throttled) == sorted(uploads.values())
+    assert {obj.key for obj in bucket.objects.all()} == set(uploads.values())
+
+
+@pytest.fixture
+def keys(bucket) -> list[str]:
+    keys = [
+        f"{ds}/download/{year}/{ds}-{n}-{year}.nc"
+        for ds in ("a", "b")
+        for year in (2020, 2021)
+        for n in range(3)
+    ]
+    keys.append("readme.txt")
+    for key in keys:
+        bucket.put_object(Key=key, Body=key.encode())
+    return sorted(keys)
+
+
+@pytest.mark.parametrize("page_size", (2, 1000))
+def test_s3_objects(keys: list[str], page_size: int):
+    objects = list(s3_objects(page_size=page_size))
+    assert [obj.key for obj in objects] == keys
+    assert [obj.size for obj in objects] == [len(key) for key in keys]
+
+    objects = list(s3_objects(prefix="a/download/2021/", page_size=page_size))
+    assert [obj.key for obj in objects] == [
+        key for key in keys if key.startswith("a/download/2021/")
+    ]
+
+    objects = list(s3_objects(prefix="a/download/", delimiter="/", page_size=page_size))
+    assert objects == [S3Object("a/download/2020/"), S3Object("a/download/2021/")]
+
+    objects = list(s3_objects(delimiter="/", page_size=page_size))
+    assert [obj.key for obj in objects] == ["a/", "b/", "readme.txt"]
+
+
+def test_index(bucket, keys: list[str], tmp_path: Path):
+    database = tmp_path / "bucket_index.sqlite"
+    assert list(indexed_objects(database=database)) == []
+
+    assert refresh_index(page_size=3, database=database) == len(keys)
+    assert list(indexed_objects(database=database)) == list(s3_objects())
+    for prefix, delimiter in (("a/", ""), ("a/", "/"), ("", "/"), ("b/download/", "/")):
+        assert list(
+            indexed_objects(prefix=prefix, delimiter=delimiter, database=database)
+        ) == list(s3_objects(prefix=prefix, delimiter=delimiter))
+
+    # refresh a single prefix
+    bucket.Object("a/download/2020/a-0-2020.nc").delete()
+    bucket.Object("b/download/2020/b-0-2020.nc").delete()
+    bucket.put_object(Key="a/download/2022/a-0-2022.nc", Body=b"new")
+    assert refresh_index(prefix="a/", database=database) == 6
+
+    indexed = [obj.key for obj in indexed_objects(database=database)]
+    assert "a/download/2020/a-0-2020.nc" not in indexed
+    assert "a/download/2022/a-0-2022.nc" in indexed
+    assert "b/download/2020/b-0-2020.nc" in indexed  # not refreshed
+    assert list(indexed_objects(prefix="a/", database=database)) == list(s3_objects(prefix="a/"))
+
+
+def test_manifest(bucket):
+    assert read_manifest("test/manifest.json") == ({}, None)
+
+    assert write_manifest("test/manifest.json", dict(version=1), etag=None)
+    manifest, etag = read_manifest("test/manifest.json")
+    assert manifest == dict(version=1)
+
+    # replaced by somebody else since it was read
+    assert write_manifest("test/manifest.json", dict(version=2), etag=etag)
+    assert not write_manifest("test/manifest.json", dict(version=3), etag=etag)
+    assert read_manifest("test/manifest.json")[0] == dict(version=2)
+    assert not write_manifest("test/manifest.json", dict(version=3), etag=None)
+
+
+@pytest.fixture
+def check_obs_db(database: Path, monkeypatch) -> None:
+    for name in (
+        "read_errors_many",
+        "read_results_many",
+        "write_results",
+        "write_seen",
+        "maintain",
+    ):
+        func = getattr(error_db, name)
+        monkeypatch.setattr(
+            f"pyaerocom_preproc.check_obs.{name}", partial(func, database=database)
+        )
+
+
+def test_sync_obs(bucket, tmp_path: Path, check_obs_db, monkeypatch):
+    files = []
+    for name in ("a", "b"):
+        path = tmp_path / f"valid-{name}-1D-2020.nc"
+        shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+        files.append(path)
+    broken = tmp_path / "valid-c-1D-2020.nc"
+    shutil.copy("tests/check_obs/incomplete-1D-2020.nc", broken)
+
+    uploads: list[str] = []
+    upload_many = s3_upload_many
+
+    def spy(uploads_: dict[Path, str], **kwargs) -> list[Path]:
+        uploads.extend(uploads_.values())
+        return upload_many(uploads_, **kwargs)
+
+    monkeypatch.setattr("pyaerocom_preproc.upload.s3_upload_many", spy)
+
+    # dry run
+    sync_obs("valid", [*files, broken], dry_run=True)
+    assert uploads == []
+    assert read_manifest("valid/manifest.json") == ({}, None)
+
+    # only the files which passed are published
+    sync_obs("valid", [*files, broken])
+    assert uploads == [f"valid/download/2020/{path.name}" for path in files]
+    manifest, _ = read_manifest("valid/manifest.json")
+    assert manifest["hashlib"] == HASHLIB
+    assert manifest["files"] == {
+        path.name: dict(year=2020, size=path.stat().st_size, checksum=checksum(path), passed=True)
+        for path in files
+    }
+
+    # nothing changed
+    uploads.clear()
+    sync_obs("valid", [*files, broken])
+    assert uploads == []
+
+    # only the delta is uploaded, files missing locally stay on the manifest
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", broken)
+    checksum.cache_clear()
+    sync_obs("valid", [files[0], broken])
+    assert uploads == [f"valid/download/2020/{broken.name}"]
+    manifest, _ = read_manifest("valid/manifest.json")
+    assert set(manifest["files"]) == {path.name for path in [*files, broken]}
+
+
+def test_staged_upload(settings: Dynaconf, bucket, files: list[Path]):
+    with StagedUpload("test/staging/run", jobs=2) as staging:
+        for path in files:
+            staging.submit(path, f"test/download/{path.name}")
+        staged = {obj.key for obj in bucket.objects.filter(Prefix="test/download/")}
+        assert staged == set()  # nothing is published before the promotion
+        assert staging.promote() == []
+
+    assert {obj.key for obj in bucket.objects.all()} == {
+        f"test/download/{path.name}" for path in files
+    }
+    client = s3_client(settings, max_pool_connections=10)
+    for path in files:
+        remote = remote_checksum(client, bucket.name, f"test/download/{path.name}")
+        assert remote == (HASHLIB, checksum(path))
+
+    # up to date files are neither staged nor copied
+    files[0].write_bytes(b"new content")
+    checksum.cache_clear()
+    with StagedUpload("test/staging/run", jobs=2) as staging:
+        for path in files:
+            staging.submit(path, f"test/download/{path.name}")
+        assert [path for path, future in staging._staged.items() if future.result()] == files[:1]
+        assert staging.promote() == []
+    remote = remote_checksum(client, bucket.name, f"test/download/{files[0].name}")
+    assert remote == (HASHLIB, checksum(files[0]))
+
+
+def test_staged_upload_cleanup(bucket, files: list[Path]):
+    with StagedUpload("test/staging/run", jobs=2) as staging:
+        for path in files:
+            staging.submit(path, f"test/download/{path.name}")
+        for future in staging._staged.values():
+            future.result()
+        assert len(list(bucket.objects.filter(Prefix="test/staging/run/"))) == len(files)
+
+    # not promoted
+    assert list(bucket.objects.all()) == []
+
+
+@pytest.mark.parametrize("jobs", (1, 2))
+def test_upload_pipeline(bucket, tmp_path: Path, check_obs_db, jobs: int):
+    files = []
+    for name in ("a", "b"):
+        path = tmp_path / f"valid-{name}-1D-2020.nc"
+        shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+        files.append(path)
+
+    obs_report("valid", files, upload=True, pipeline=True, jobs=jobs)
+    assert sorted(obj.key for obj in bucket.objects.all()) == [
+        f"valid/download/2020/{path.name}" for path in files
+    ]
+
+    # a file did not pass, nothing is published and the staging prefix is removed
+    broken = tmp_path / "valid-c-1D-2020.nc"
+    shutil.copy("tests/check_obs/incomplete-1D-2020.nc", broken)
+    for obj in bucket.objects.all():
+        obj.delete()
+    obs_report("valid", [*files, broken], upload=True, pipeline=True, jobs=jobs)
+    assert list(bucket.objects.all()) == []
+
+
+@pytest.mark.parametrize("pipeline", (False, True))
+def test_upload_repack(
+    settings: Dynaconf, bucket, tmp_path: Path, check_obs_db, monkeypatch, pipeline: bool
+):
+    repack_path = tmp_path / "repacked"
+    monkeypatch.setattr("pyaerocom_preproc.upload.REPACK_PATH", repack_path)
+    path = tmp_path / "valid-a-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+
+    obs_report("valid", [path], upload=True, pipeline=pipeline, repack=True)
+    obj = bucket.Object(f"valid/download/2020/{path.name}")
+    assert obj.content_length < path.stat().st_size
+    assert obj.metadata["checksum"] == checksum(path)
+    repacked = tmp_path / "repacked.nc"
+    obj.download_file(str(repacked))
+    assert obj.metadata["repacked-checksum"] == checksum(repacked)
+    assert same_data(path, repacked)
+    assert list(repack_path.iterdir()) == []  # removed once uploaded
+
+    # the original content is already uploaded
+    client = s3_client(settings, max_pool_connections=10)
+    assert remote_checksum(client, bucket.name, obj.key) == (HASHLIB, checksum(path))
+
+
+def test_sync_repack(bucket, tmp_path: Path, check_obs_db, monkeypatch):
+    monkeypatch.setattr("pyaerocom_preproc.upload.REPACK_PATH", tmp_path / "repacked")
+    path = tmp_path / "valid-a-1D-2020.nc"
+    shutil.copy("tests/check_obs/valid-1D-2020.nc", path)
+
+    sync_obs("valid", [path], repack=True)
+    manifest, _ = read_manifest("valid/manifest.json")
+    entry = manifest["files"][path.name]
+    obj = bucket.Object(f"valid/download/2020/{path.name}")
+    assert entry["checksum"] == checksum(path)
+    assert entry["repacked"] == dict(
+        size=obj.content_length, checksum=obj.metadata["repacked-checksum"]
+    )
+
+    # compared without the repacked copy
+    uploads: list[Path] = []
+    monkeypatch.setattr("pyaerocom_preproc.sync._upload", lambda _, files, **kw: uploads)
+    sync_obs("valid", [path], repack=True)
+    sync_obs("valid", [path])
+    assert uploads == []
+
+
+# 3 parts, S3 requires at least 5 MiB on all but the last part
+MULTIPART = TransferConfig(multipart_threshold=5 * MiB, multipart_chunksize=5 * MiB)
+
+
+@pytest.fixture
+def large_file(tmp_path: Path) -> Path:
+    path = tmp_path / "large.nc"
+    path.write_bytes(bytes(range(256)) * (11 * MiB // 256))
+    return path
+
+
+@pytest.fixture
+def interrupted(settings: Dynaconf, bucket, large_file: Path, tmp_path: Path, monkeypatch):
+    """large_file upload failed on its last part, yields the uploaded parts"""
+    client = s3_client(settings, max_pool_connections=10)
+    upload_part = client.upload_part
+    parts: list[int] = []
+
+    def spy(**kwargs):
+        if kwargs["PartNumber"] == 3:
+            raise ClientError(dict(Error=dict(Code="500", Message="interrupted")), "UploadPart")
+        parts.append(kwargs["PartNumber"])
+        return upload_part(**kwargs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(client, "upload_part", spy)
+        ok = s3_upload(
+            large_file,
+            object_name="test/large.nc",
+            transfer_config=MULTIPART,
+            database=tmp_path / "bucket_index.sqlite",
+        )
+    assert not ok
+    assert list(bucket.objects.all()) == []
+    yield sorted(parts)
+
+
+def test_resumable_upload(
+    settings: Dynaconf, bucket, large_file: Path, interrupted: list[int], tmp_path, monkeypatch
+):
+    assert interrupted == [1, 2]
+
+    client = s3_client(settings, max_pool_connections=10)
+    upload_part = client.upload_part
+    parts: list[int] = []
+
+    def spy(**kwargs):
+        parts.append(kwargs["PartNumber"])
+        return upload_part(**kwargs)
+
+    # only the missing part is uploaded
+    monkeypatch.setattr(client, "upload_part", spy)
+    database = tmp_path / "bucket_index.sqlite"
+    assert s3_upload(
+        large_file, object_name="test/large.nc", transfer_config=MULTIPART, database=database
+    )
+    assert parts == [3]
+    body = bucket.Object("test/large.nc").get()["Body"].read()
+    assert body == large_file.read_bytes()
+    remote = remote_checksum(client, bucket.name, "test/large.nc")
+    assert remote == (HASHLIB, checksum(large_file))
+
+    # completed uploads are forgotten
+    db = sqlite3.connect(database)
+    assert db.execute("SELECT COUNT(*) FROM multipart_uploads;").fetchone() == (0,)
+    assert db.execute("SELECT COUNT(*) FROM multipart_parts;").fetchone() == (0,)
+
+
+def test_abort_uploads(
+    settings: Dynaconf, bucket, large_file: Path, interrupted: list[int], tmp_path: Path
+):
+    client = s3_client(settings)
+    database = tmp_path / "bucket_index.sqlite"
+    # moto reports all uploads as initiated on 2010-11-10
+    assert abort_uploads(older_than=time.time(), database=database) == 0
+    assert len(client.list_multipart_uploads(Bucket=bucket.name).get("Uploads", [])) == 1
+
+    assert abort_uploads(older_than=0, prefix="other/", database=database) == 0
+    assert abort_uploads(older_than=0, database=database) == 1
+    assert client.list_multipart_uploads(Bucket=bucket.name).get("Uploads", []) == []
+    db = sqlite3.connect(database)
+    assert db.execute("SELECT COUNT(*) FROM multipart_uploads;").fetchone() == (0,)
+
+    # aborted uploads start over
+    assert s3_upload(
+        large_file, object_name="test/large.nc", transfer_config=MULTIPART, database=database
+    )
+    assert bucket.Object("test/large.nc").content_length == large_file.stat().st_size
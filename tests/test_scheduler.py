@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+from pyaerocom_preproc.scheduler import UploadReport, UploadScheduler, is_throttled
+
+
+def client_error(code: str, status: int = 400) -> ClientError:
+    response = dict(Error=dict(Code=code), ResponseMetadata=dict(HTTPStatusCode=status))
+    return ClientError(response, "PutObject")  # type: ignore[arg-type]
+
+
+def wrapped(error: ClientError) -> S3UploadFailedError:
+    try:
+        raise error
+    except ClientError as e:
+        try:
+            raise S3UploadFailedError(f"Failed to upload: {e}")
+        except S3UploadFailedError as wrapped:
+            return wrapped
+
+
+@pytest.mark.parametrize(
+    "error,throttled",
+    (
+        pytest.param(client_error("SlowDown", 503), True, id="SlowDown"),
+        pytest.param(client_error("TooManyRequests", 429), True, id="429"),
+        pytest.param(client_error("InternalError", 500), True, id="500"),
+        pytest.param(client_error("503", 0), True, id="no-body"),
+        pytest.param(wrapped(client_error("SlowDown", 503)), True, id="upload_file"),
+        pytest.param(client_error("AccessDenied", 403), False, id="403"),
+        pytest.param(client_error("NoSuchBucket", 404), False, id="404"),
+        pytest.param(ValueError("not a response"), False, id="other"),
+    ),
+)
+def test_is_throttled(error: Exception, throttled: bool):
+    assert is_throttled(error) == throttled
+
+
+def test_scheduler_validation():
+    with pytest.raises(ValueError):
+        UploadScheduler(0)
+    with pytest.raises(ValueError):
+        UploadScheduler(4, max_jobs=2)
+    with pytest.raises(ValueError):
+        UploadScheduler(max_rate=0)
+
+
+def test_max_rate():
+    scheduler = UploadScheduler(4, max_rate=1e6)
+    start = time.monotonic()
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(scheduler.consume, [100_000] * 5))
+    assert time.monotonic() - start >= 0.45  # 0.5 MB at 1 MB/s, from an empty bucket
+
+    # unlimited
+    start = time.monotonic()
+    UploadScheduler().consume(100 * 2**20)
+    assert time.monotonic() - start < 0.1
+
+
+def test_max_jobs():
+    scheduler = UploadScheduler(2, max_jobs=2)
+    active, peak = 0, 0
+
+    def upload():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        time.sleep(0.01)
+        active -= 1
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: scheduler.run(upload, 1), range(16)))
+    assert peak <= 2
+    assert scheduler.report()[:2] == (16, 16)
+
+
+def test_adapt():
+    scheduler = UploadScheduler(4, max_jobs=6)
+    for rate, jobs in ((10, 5), (20, 6), (30, 6), (20, 5), (10, 6), (5, 5)):
+        scheduler._adapt(rate)
+        assert scheduler.jobs == jobs, rate
+
+    # capped by max_rate, do not open more connections
+    scheduler = UploadScheduler(4, max_rate=10)
+    for rate in (9.5, 10, 10):
+        scheduler._adapt(rate)
+    assert scheduler.jobs == 4
+
+
+def test_retry(monkeypatch):
+    delays: list[float] = []
+    monkeypatch.setattr("time.sleep", delays.append)
+    scheduler = UploadScheduler(8, retries=3, backoff=1)
+    errors = [client_error("SlowDown", 503), client_error("InternalError", 500)]
+
+    def upload():
+        if errors:
+            raise errors.pop(0)
+
+    scheduler.run(upload, 10)
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2  # full jitter
+    assert scheduler.jobs == 2  # halved on each throttled attempt
+    assert scheduler.report()[:2] == (1, 10)
+    assert scheduler.report().retries == 2
+
+
+def test_retry_give_up(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    scheduler = UploadScheduler(retries=2)
+    attempts = 0
+
+    def throttled():
+        nonlocal attempts
+        attempts += 1
+        raise client_error("SlowDown", 503)
+
+    with pytest.raises(ClientError):
+        scheduler.run(throttled, 10)
+    assert attempts == 3
+
+    def denied():
+        raise client_error("AccessDenied", 403)
+
+    with pytest.raises(ClientError):
+        scheduler.run(denied, 10)
+    assert scheduler.report().files == 0
+
+
+def test_report():
+    report = UploadReport(files=2, bytes=5_000_000, seconds=2, retries=1, jobs=8)
+    assert report.mb_per_s == 2.5
+    assert str(report) == "uploaded 2 files, 5.0 MB in 2.0s, 2.5 MB/s, 1 retries, 8 jobs"
+    assert UploadScheduler().report() == (0, 0, 0, 0, 8)
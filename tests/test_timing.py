@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from pyaerocom_preproc import timing
+from pyaerocom_preproc.checksum import checksum
+
+
+@pytest.fixture
+def enabled():
+    timing.records(clear=True)
+    timing.enable()
+    yield
+    timing.enable(False)
+    timing.records(clear=True)
+
+
+def test_disabled(path: Path):
+    with timing.timed("stage", path):
+        pass
+    assert timing.records() == []
+
+
+def test_timed(path: Path, enabled):
+    with timing.timed("read", path):
+        path.read_bytes()
+    with timing.timed("explicit", path) as stage:
+        stage.bytes = 42
+
+    read, explicit = timing.records()
+    assert read.path == explicit.path == str(path)
+    assert read.stage == "read" and read.seconds > 0
+    assert explicit.bytes == 42
+    assert read.max_rss > 0
+
+
+def test_hash(path: Path, enabled):
+    checksum(path, strict=True)
+    (hash,) = timing.records()
+    assert hash.stage == "hash"
+    assert hash.bytes == path.stat().st_size
+
+
+def test_summary(enabled):
+    for stage in ("fast", "slow", "slow"):
+        with timing.timed(stage):
+            pass
+    timing.extend([timing.Timing("file.nc", "slow", 1.0, 10, 0)])
+
+    slow, fast = timing.summary(timing.records())
+    assert slow.stage == "slow" and slow.calls == 3 and slow.max_seconds == 1.0
+    assert slow.bytes >= 10
+    assert fast.stage == "fast" and fast.calls == 1